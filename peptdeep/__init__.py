@@ -52,4 +52,5 @@ __urls__ = {
 __extra_requirements__ = {
     "development": "requirements_development.txt",
     "gui": "requirements_gui.txt",
+    "onnx": "requirements_onnx.txt",
 }
@@ -1,3 +1,3 @@
 from peptdeep.mass_spec import (
-    match, ms_reader
+    match, ms_reader, ms1_xic
 )
\ No newline at end of file
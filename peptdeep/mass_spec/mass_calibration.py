@@ -1,16 +1,107 @@
 from sklearn.neighbors import KNeighborsRegressor
 import pandas as pd
 import numpy as np
+import numba
+
+@numba.njit(parallel=True)
+def get_fragment_medians(
+    frag_values:np.ndarray,
+    frag_start_idxes:np.ndarray,
+    frag_stop_idxes:np.ndarray,
+)->np.ndarray:
+    """
+    Segmented median of the fragment values for each PSM,
+    NaN and inf values are ignored.
+    It is 0.0 if all values of the PSM are ignored.
+
+    Parameters
+    ----------
+    frag_values : np.ndarray
+        2-D fragment values, e.g. matched mass errors
+
+    frag_start_idxes : np.ndarray
+        `frag_start_idx` of PSMs
+
+    frag_stop_idxes : np.ndarray
+        `frag_stop_idx` of PSMs
+
+    Returns
+    -------
+    np.ndarray
+        float64 medians, same length as `frag_start_idxes`
+    """
+    n_cols = frag_values.shape[1]
+    medians = np.zeros(len(frag_start_idxes))
+    for i in numba.prange(len(frag_start_idxes)):
+        start = frag_start_idxes[i]
+        stop = frag_stop_idxes[i]
+        buffer = np.empty((stop-start)*n_cols)
+        n = 0
+        for row in range(start, stop):
+            for col in range(n_cols):
+                val = frag_values[row, col]
+                if not np.isnan(val) and val != np.inf:
+                    buffer[n] = val
+                    n += 1
+        if n > 0:
+            medians[i] = np.median(buffer[:n])
+    return medians
+
+def calibrate_fragment_mass_errors(
+    psm_df:pd.DataFrame, mass_error_df:pd.DataFrame
+)->pd.DataFrame:
+    """Subtract `psm_df.frag_mass_shift` from the
+    fragment rows of each PSM in `mass_error_df` (inplace)
+    with one broadcasted operation.
+
+    Parameters
+    ----------
+    psm_df : pd.DataFrame
+        PSM dataframe with `frag_mass_shift` column
+
+    mass_error_df : pd.DataFrame
+        fragment mass error dataframe
+
+    Returns
+    -------
+    pd.DataFrame
+        `mass_error_df`
+    """
+    frag_starts = psm_df.frag_start_idx.values.astype(np.int64)
+    frag_stops = psm_df.frag_stop_idx.values.astype(np.int64)
+    frag_nums = frag_stops-frag_starts
+    frag_idxes = (
+        np.repeat(frag_starts-np.cumsum(frag_nums)+frag_nums, frag_nums)
+        +np.arange(frag_nums.sum(), dtype=np.int64)
+    )
+    mass_error_df.values[frag_idxes] -= np.repeat(
+        psm_df.frag_mass_shift.values, frag_nums
+    )[:,None]
+    return mass_error_df
 
 def get_fragment_median(start_end_idxes:tuple, frag_df:pd.DataFrame):
+    """Median of one PSM's fragment values,
+    kept for compatibility, see `get_fragment_medians()`.
+    """
     start_idx, end_idx = start_end_idxes
-    ret = np.nanmedian(frag_df.values[start_idx:end_idx])
-    if np.isnan(ret): return 0.0
-    else: return ret
+    return get_fragment_medians(
+        frag_df.values,
+        np.array([start_idx], dtype=np.int64),
+        np.array([end_idx], dtype=np.int64),
+    )[0]
 
 def calibrate_one(start_end_shift, frag_df):
+    """Calibrate one PSM's fragment values (inplace),
+    kept for compatibility, see `calibrate_fragment_mass_errors()`.
+    """
     start_idx, end_idx, mass_shift = start_end_shift
-    frag_df.values[int(start_idx):int(end_idx)] -= mass_shift
+    calibrate_fragment_mass_errors(
+        pd.DataFrame({
+            'frag_start_idx': [int(start_idx)],
+            'frag_stop_idx': [int(end_idx)],
+            'frag_mass_shift': [mass_shift],
+        }), frag_df
+    )
 
 class MassCalibratorForRT_KNN:
     """Using KNN to calibrate measured m/z across RT.
@@ -18,21 +109,75 @@ class MassCalibratorForRT_KNN:
     def __init__(self, n_neighbors=5):
         self._n_neighbors = n_neighbors
         self.model = KNeighborsRegressor(n_neighbors)
-    
+
     def fit(self, psm_df:pd.DataFrame, mass_error_df:pd.DataFrame):
-        mass_error_df = mass_error_df.replace(np.inf, np.nan)
-        mean_merrs = psm_df[['frag_start_idx','frag_stop_idx']].apply(
-            get_fragment_median, axis=1, frag_df=mass_error_df
-        ).values
+        mean_merrs = get_fragment_medians(
+            mass_error_df.values,
+            psm_df.frag_start_idx.values.astype(np.int64),
+            psm_df.frag_stop_idx.values.astype(np.int64),
+        )
         self.model.fit(psm_df.rt.values.reshape((-1,1)), mean_merrs.reshape(-1,1))
 
-    def calibrate(self, 
+    def calibrate(self,
         psm_df:pd.DataFrame, mass_error_df:pd.DataFrame
     )->pd.DataFrame:
         psm_df['frag_mass_shift'] = self.model.predict(
             psm_df.rt.values.reshape((-1,1))
         ).reshape(-1)
-        psm_df[['frag_start_idx','frag_stop_idx','frag_mass_shift']].apply(
-            calibrate_one, axis=1, frag_df=mass_error_df
-        ).values
-        return mass_error_df
+        return calibrate_fragment_mass_errors(psm_df, mass_error_df)
+
+class MassCalibratorForRT_Bin:
+    """Calibrate measured m/z across RT with a binned linear spline.
+    PSM median mass errors are averaged in fixed RT bins, and shifts
+    are linearly interpolated between the bin centers.
+    As bins only keep sums and counts, the model can be updated
+    incrementally by `partial_fit()` as more raw files come in.
+    """
+    def __init__(self, rt_bin_size:float=1.0):
+        """
+        Parameters
+        ----------
+        rt_bin_size : float, optional
+            RT bin size, in the same unit as `psm_df.rt`.
+            Defaults to 1.0.
+        """
+        self.rt_bin_size = rt_bin_size
+        self._bin_sums = np.zeros(0)
+        self._bin_counts = np.zeros(0, dtype=np.int64)
+
+    def fit(self, psm_df:pd.DataFrame, mass_error_df:pd.DataFrame):
+        self._bin_sums = np.zeros(0)
+        self._bin_counts = np.zeros(0, dtype=np.int64)
+        self.partial_fit(psm_df, mass_error_df)
+
+    def partial_fit(self, psm_df:pd.DataFrame, mass_error_df:pd.DataFrame):
+        merrs = get_fragment_medians(
+            mass_error_df.values,
+            psm_df.frag_start_idx.values.astype(np.int64),
+            psm_df.frag_stop_idx.values.astype(np.int64),
+        )
+        bins = np.maximum(
+            (psm_df.rt.values//self.rt_bin_size).astype(np.int64), 0
+        )
+        if len(bins) == 0: return
+        bin_num = max(bins.max()+1, len(self._bin_counts))
+        self._bin_sums = np.pad(
+            self._bin_sums, (0, bin_num-len(self._bin_sums))
+        )+np.bincount(bins, weights=merrs, minlength=bin_num)
+        self._bin_counts = np.pad(
+            self._bin_counts, (0, bin_num-len(self._bin_counts))
+        )+np.bincount(bins, minlength=bin_num)
+
+    def predict(self, rts:np.ndarray)->np.ndarray:
+        used = self._bin_counts > 0
+        if not used.any():
+            return np.zeros(len(rts))
+        bin_centers = (np.nonzero(used)[0]+0.5)*self.rt_bin_size
+        bin_means = self._bin_sums[used]/self._bin_counts[used]
+        return np.interp(rts, bin_centers, bin_means)
+
+    def calibrate(self,
+        psm_df:pd.DataFrame, mass_error_df:pd.DataFrame
+    )->pd.DataFrame:
+        psm_df['frag_mass_shift'] = self.predict(psm_df.rt.values)
+        return calibrate_fragment_mass_errors(psm_df, mass_error_df)
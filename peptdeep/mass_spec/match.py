@@ -10,6 +10,7 @@ from alphabase.peptide.fragment import (
 from peptdeep.mass_spec.ms_reader import (
     ms2_reader_provider, MSReaderBase
 )
+from peptdeep.settings import global_settings
 
 @numba.njit
 def match_centroid_mz(
@@ -161,7 +162,118 @@ def match_first_last_profile_mz(
     return first_indices, last_indices
 
 
-@numba.njit
+def get_spec_mz_tols(
+    spec_mzs:np.ndarray, ppm:bool, tol:float
+)->np.ndarray:
+    """
+    Da tolerance of each peak, computed once per raw file 
+    for `match_one_raw_with_numba_parallel`.
+
+    Parameters
+    ----------
+    spec_mzs : np.ndarray
+        all peak mz values of a raw file
+
+    ppm : bool
+        if use ppm tolerance
+
+    tol : float
+        tolerance value
+
+    Returns
+    -------
+    np.ndarray
+        Da tolerance array, same shape as spec_mzs
+    """
+    if ppm:
+        return spec_mzs*(tol*1e-6)
+    else:
+        return np.full_like(spec_mzs, tol, dtype=np.float64)
+
+def set_numba_thread_num(thread_num:int):
+    """
+    Set the thread number of numba parallel kernels 
+    (e.g. `match_one_raw_with_numba_parallel`) 
+    for the current thread.
+
+    Parameters
+    ----------
+    thread_num : int
+        it will be clipped into [1, numba.config.NUMBA_NUM_THREADS]
+    """
+    numba.set_num_threads(
+        max(1, min(thread_num, numba.config.NUMBA_NUM_THREADS))
+    )
+
+@numba.njit(inline='always')
+def _match_closest_peak(
+    all_spec_mzs, all_spec_mz_tols, 
+    idx, peak_start, peak_end, query_mz
+):
+    """
+    Closest peak within the tolerance around `idx`,
+    where `idx` is the searchsorted position of `query_mz` 
+    in `all_spec_mzs[peak_start:peak_end]` (plus `peak_start`).
+    Returns (-1, np.inf) if no peaks are matched.
+    """
+    min_merr = np.inf
+    min_idx = -1
+    if idx > peak_start:
+        merr = abs(all_spec_mzs[idx-1]-query_mz)
+        if merr <= all_spec_mz_tols[idx-1]:
+            min_merr = merr
+            min_idx = idx-1
+    if idx < peak_end:
+        merr = abs(all_spec_mzs[idx]-query_mz)
+        if merr <= all_spec_mz_tols[idx] and merr < min_merr:
+            min_merr = merr
+            min_idx = idx
+    return min_idx, min_merr
+
+@numba.njit(parallel=True, nogil=True)
+def match_one_raw_with_numba_parallel(
+    spec_idxes, frag_start_idxes, frag_stop_idxes,
+    all_frag_mzs,
+    all_spec_mzs, all_spec_intensities, all_spec_mz_tols,
+    peak_start_idxes, peak_end_idxes,
+    matched_intensities, matched_mz_errs,
+):
+    """ 
+    Internel function to match fragment mz values to spectrum mz values,
+    parallelized over PSMs with `numba.prange`. 
+    Tolerances of all peaks (`all_spec_mz_tols`) are computed once 
+    per raw file by `get_spec_mz_tols`. 
+    Each PSM writes the closest matched peak directly into its own 
+    `frag_start:frag_stop` rows of `matched_intensities` and `matched_mz_errs`,
+    so there are no temporary arrays and no synchronization between threads.
+    Matched_mz_errs[i] = np.inf if no peaks are matched.
+    """
+    n_frag_types = all_frag_mzs.shape[1]
+    for i in numba.prange(len(spec_idxes)):
+        spec_idx = spec_idxes[i]
+        if spec_idx < 0 or spec_idx >= len(peak_start_idxes): continue
+        peak_start = peak_start_idxes[spec_idx]
+        peak_end = peak_end_idxes[spec_idx]
+        if peak_end <= peak_start: continue
+        spec_mzs = all_spec_mzs[peak_start:peak_end]
+
+        for frag_idx in range(frag_start_idxes[i], frag_stop_idxes[i]):
+            for j in range(n_frag_types):
+                query_mz = all_frag_mzs[frag_idx, j]
+                min_idx, min_merr = _match_closest_peak(
+                    all_spec_mzs, all_spec_mz_tols,
+                    np.searchsorted(spec_mzs, query_mz)+peak_start,
+                    peak_start, peak_end, query_mz
+                )
+                if min_idx == -1:
+                    matched_intensities[frag_idx, j] = 0
+                    matched_mz_errs[frag_idx, j] = np.inf
+                else:
+                    matched_intensities[frag_idx, j] = (
+                        all_spec_intensities[min_idx]
+                    )
+                    matched_mz_errs[frag_idx, j] = min_merr
+
 def match_one_raw_with_numba(
     spec_idxes, frag_start_idxes, frag_stop_idxes,
     all_frag_mzs,
@@ -171,47 +283,182 @@ def match_one_raw_with_numba(
     ppm, tol,
 ):
     """ 
-    Internel function to match fragment mz values to spectrum mz values.
+    Match fragment mz values to spectrum mz values (inplace), 
+    kept for compatibility, see `match_one_raw_with_numba_parallel()`.
     Matched_mz_errs[i] = np.inf if no peaks are matched.
     """
-    for spec_idx, frag_start, frag_end in zip(
-        spec_idxes, frag_start_idxes, frag_stop_idxes
-    ):
+    match_one_raw_with_numba_parallel(
+        spec_idxes, frag_start_idxes, frag_stop_idxes,
+        all_frag_mzs,
+        all_spec_mzs, all_spec_intensities, 
+        get_spec_mz_tols(all_spec_mzs, ppm, tol),
+        peak_start_idxes, peak_end_idxes,
+        matched_intensities, matched_mz_errs,
+    )
+
+@numba.njit(parallel=True, nogil=True)
+def match_one_raw_with_numba_merge_join(
+    spec_idxes, frag_start_idxes, frag_stop_idxes,
+    psm_order, spec_group_idxes,
+    all_frag_mzs,
+    all_spec_mzs, all_spec_intensities, all_spec_mz_tols,
+    peak_start_idxes, peak_end_idxes,
+    matched_intensities, matched_mz_errs,
+):
+    """ 
+    Internel function to match fragment mz values to spectrum mz values
+    by merge-join, parallelized over spectra with `numba.prange`.
+    PSMs are grouped by spectrum: 
+    `psm_order[spec_group_idxes[g]:spec_group_idxes[g+1]]` are 
+    the PSMs of the g-th spectrum. All fragment mz values of a group
+    are sorted once and swept against the peaks in a single linear pass,
+    which is faster than `match_one_raw_with_numba_parallel` 
+    if many PSMs share a spectrum (e.g. open or chimeric search).
+    The closest peaks are matched, same as `match_one_raw_with_numba_parallel`.
+    Matched_mz_errs[i] = np.inf if no peaks are matched.
+    """
+    n_frag_types = all_frag_mzs.shape[1]
+    for g in numba.prange(len(spec_group_idxes)-1):
+        group_start = spec_group_idxes[g]
+        group_stop = spec_group_idxes[g+1]
+        spec_idx = spec_idxes[psm_order[group_start]]
+        if spec_idx < 0 or spec_idx >= len(peak_start_idxes): continue
         peak_start = peak_start_idxes[spec_idx]
         peak_end = peak_end_idxes[spec_idx]
-        if peak_end == peak_start: continue
-        spec_mzs = all_spec_mzs[peak_start:peak_end]
-        spec_intens = all_spec_intensities[peak_start:peak_end]
-        
-        if ppm:
-            spec_mz_tols = spec_mzs*tol*1e-6
-        else:
-            spec_mz_tols = np.full_like(spec_mzs, tol)
+        if peak_end <= peak_start: continue
+
+        query_num = 0
+        for k in range(group_start, group_stop):
+            psm = psm_order[k]
+            query_num += (
+                frag_stop_idxes[psm]-frag_start_idxes[psm]
+            )*n_frag_types
+        query_mzs = np.empty(query_num, dtype=np.float64)
+        query_rows = np.empty(query_num, dtype=np.int64)
+        query_cols = np.empty(query_num, dtype=np.int64)
+        n = 0
+        for k in range(group_start, group_stop):
+            psm = psm_order[k]
+            for frag_idx in range(
+                frag_start_idxes[psm], frag_stop_idxes[psm]
+            ):
+                for j in range(n_frag_types):
+                    query_mzs[n] = all_frag_mzs[frag_idx, j]
+                    query_rows[n] = frag_idx
+                    query_cols[n] = j
+                    n += 1
+
+        idx = peak_start
+        for q in np.argsort(query_mzs):
+            query_mz = query_mzs[q]
+            while idx < peak_end and all_spec_mzs[idx] < query_mz:
+                idx += 1
+            min_idx, min_merr = _match_closest_peak(
+                all_spec_mzs, all_spec_mz_tols,
+                idx, peak_start, peak_end, query_mz
+            )
+            if min_idx == -1:
+                matched_intensities[query_rows[q], query_cols[q]] = 0
+                matched_mz_errs[query_rows[q], query_cols[q]] = np.inf
+            else:
+                matched_intensities[query_rows[q], query_cols[q]] = (
+                    all_spec_intensities[min_idx]
+                )
+                matched_mz_errs[query_rows[q], query_cols[q]] = min_merr
 
-        frag_mzs = all_frag_mzs[frag_start:frag_end,:].copy()
-        
-        matched_idxes = match_centroid_mz(
-            spec_mzs, frag_mzs, spec_mz_tols
-        ).reshape(-1)
+def match_one_raw_with_numba_auto(
+    spec_idxes, frag_start_idxes, frag_stop_idxes,
+    all_frag_mzs,
+    all_spec_mzs, all_spec_intensities, all_spec_mz_tols,
+    peak_start_idxes, peak_end_idxes,
+    matched_intensities, matched_mz_errs,
+    merge_join_min_psms_per_spec:float=2.0,
+):
+    """
+    Match fragments of one raw file with 
+    `match_one_raw_with_numba_merge_join` if there are on average
+    at least `merge_join_min_psms_per_spec` PSMs per spectrum, 
+    otherwise with `match_one_raw_with_numba_parallel`. 
+    Both kernels give the same results.
+    """
+    if len(spec_idxes) == 0: return
+    psm_order = np.argsort(spec_idxes, kind='stable')
+    sorted_spec_idxes = spec_idxes[psm_order]
+    spec_group_idxes = np.flatnonzero(np.concatenate((
+        [True], sorted_spec_idxes[1:]!=sorted_spec_idxes[:-1], [True]
+    ))).astype(np.int64)
+    if (
+        len(spec_idxes) >= 
+        merge_join_min_psms_per_spec*(len(spec_group_idxes)-1)
+    ):
+        match_one_raw_with_numba_merge_join(
+            spec_idxes, frag_start_idxes, frag_stop_idxes,
+            psm_order, spec_group_idxes,
+            all_frag_mzs,
+            all_spec_mzs, all_spec_intensities, all_spec_mz_tols,
+            peak_start_idxes, peak_end_idxes,
+            matched_intensities, matched_mz_errs,
+        )
+    else:
+        match_one_raw_with_numba_parallel(
+            spec_idxes, frag_start_idxes, frag_stop_idxes,
+            all_frag_mzs,
+            all_spec_mzs, all_spec_intensities, all_spec_mz_tols,
+            peak_start_idxes, peak_end_idxes,
+            matched_intensities, matched_mz_errs,
+        )
 
-        matched_intens = spec_intens[matched_idxes]
-        matched_intens[matched_idxes==-1] = 0
+def load_ms2_reader(
+    ms2_file, ms2_file_type:str,
+    use_peak_store:bool=None,
+    peak_store_folder:str=None,
+    reader_process_num:int=None,
+)->MSReaderBase:
+    """Load the ms2 file with the reader of `ms2_file_type`.
+    If `use_peak_store` is True,
+    the peak store of the ms2 file will be opened (or created for the first time), 
+    see `MSReaderBase.load_with_peak_store()`.
 
-        matched_mass_errs = np.abs(
-            spec_mzs[
-                matched_idxes.reshape(-1)
-            ]-frag_mzs.reshape(-1)
-        )
-        matched_mass_errs[matched_idxes==-1] = np.inf
+    Parameters
+    ----------
+    ms2_file : str or file-like object
+        ms2 file
 
-        matched_intensities[
-            frag_start:frag_end,:
-        ] = matched_intens.reshape(frag_mzs.shape)
+    ms2_file_type : str
+        ms2 file type, could be ["thermo","alphapept","mgf"]
 
-        matched_mz_errs[
-            frag_start:frag_end,:
-        ] = matched_mass_errs.reshape(frag_mzs.shape)
+    use_peak_store : bool, optional
+        Defaults to None, 
+        `global_settings['peak_matching']['use_peak_store']`.
 
+    peak_store_folder : str, optional
+        Defaults to None, 
+        `global_settings['peak_matching']['peak_store_folder']`.
+
+    reader_process_num : int, optional
+        process number of readers which support multiprocessing 
+        (e.g. `MGFReader.process_num`). Defaults to None, 
+        `global_settings['peak_matching']['reader_process_num']`.
+
+    Returns
+    -------
+    MSReaderBase
+        the loaded ms2 reader
+    """
+    if use_peak_store is None:
+        use_peak_store = global_settings['peak_matching']['use_peak_store']
+    if peak_store_folder is None:
+        peak_store_folder = global_settings['peak_matching']['peak_store_folder']
+    if reader_process_num is None:
+        reader_process_num = global_settings['peak_matching']['reader_process_num']
+    ms2_reader = ms2_reader_provider.get_reader(ms2_file_type)
+    if hasattr(ms2_reader, 'process_num'):
+        ms2_reader.process_num = reader_process_num
+    if use_peak_store:
+        ms2_reader.load_with_peak_store(ms2_file, peak_store_folder)
+    else:
+        ms2_reader.load(ms2_file)
+    return ms2_reader
 
 class PepSpecMatch(object):
     """Main entry for peptide-spectrum matching"""
@@ -219,9 +466,43 @@ class PepSpecMatch(object):
         charged_frag_types = get_charged_frag_types(
             ['b','y','b_modloss','y_modloss'],
             2
-        )
+        ),
+        thread_num:int = None,
+        use_peak_store:bool = None,
+        peak_store_folder:str = None,
+        reader_process_num:int = None,
     ):
+        """
+        Parameters
+        ----------
+        charged_frag_types : list, optional
+            fragment types to match
+
+        thread_num : int, optional
+            thread number of the numba matching kernel.
+            Defaults to None, which means `global_settings['thread_num']`.
+
+        use_peak_store : bool, optional
+            if use peak stores to load ms2 files, see `load_ms2_reader()`.
+            Defaults to None, which means 
+            `global_settings['peak_matching']['use_peak_store']`.
+
+        peak_store_folder : str, optional
+            Defaults to None, which means 
+            `global_settings['peak_matching']['peak_store_folder']`.
+
+        reader_process_num : int, optional
+            process number of ms2 readers, see `load_ms2_reader()`.
+            Defaults to None, which means 
+            `global_settings['peak_matching']['reader_process_num']`.
+        """
         self.charged_frag_types = charged_frag_types
+        if thread_num is None:
+            thread_num = global_settings['thread_num']
+        self.thread_num = thread_num
+        self.use_peak_store = use_peak_store
+        self.peak_store_folder = peak_store_folder
+        self.reader_process_num = reader_process_num
 
     def _preprocess_psms(self, psm_df):
         pass
@@ -276,10 +557,11 @@ class PepSpecMatch(object):
         if isinstance(ms2_file, MSReaderBase):
             ms2_reader = ms2_file
         else:
-            ms2_reader = ms2_reader_provider.get_reader(
-                ms2_file_type
+            ms2_reader = load_ms2_reader(
+                ms2_file, ms2_file_type,
+                self.use_peak_store, self.peak_store_folder,
+                self.reader_process_num,
             )
-            ms2_reader.load(ms2_file)
 
         add_spec_info_list = []
         if 'rt_norm' not in psm_df.columns:
@@ -317,45 +599,24 @@ class PepSpecMatch(object):
             ), 
             columns=fragment_mz_df.columns
         )
-        
-        for (
-            spec_idx, frag_start_idx, frag_stop_idx
-        ) in psm_df[[
-            'spec_idx', 'frag_start_idx', 
-            'frag_stop_idx'
-        ]].values:
-            (
-                spec_mzs, spec_intens
-            ) = ms2_reader.get_peaks(spec_idx)
-            if len(spec_mzs)==0: continue
-
-            if ppm:
-                mz_tols = spec_mzs*tol*1e-6
-            else:
-                mz_tols = np.full_like(spec_mzs, tol)
 
-            frag_mzs = fragment_mz_df.values[
-                frag_start_idx:frag_stop_idx,:
-            ]
-            
-            matched_idxes = match_centroid_mz(
-                spec_mzs, frag_mzs, mz_tols
-            )
-            matched_intens = spec_intens[matched_idxes]
-            matched_intens[matched_idxes==-1] = 0
-
-            matched_mz_errs = np.abs(
-                spec_mzs[matched_idxes]-frag_mzs
-            )
-            matched_mz_errs[matched_idxes==-1] = np.inf
-
-            matched_intensity_df.values[
-                frag_start_idx:frag_stop_idx,:
-            ] = matched_intens
-
-            matched_mz_err_df.values[
-                frag_start_idx:frag_stop_idx,:
-            ] = matched_mz_errs
+        ms2_reader.update_peak_indices()
+        set_numba_thread_num(self.thread_num)
+        match_one_raw_with_numba_auto(
+            ms2_reader._get_spec_positions(psm_df.spec_idx.values),
+            psm_df.frag_start_idx.values,
+            psm_df.frag_stop_idx.values,
+            fragment_mz_df.values,
+            ms2_reader.peak_df.mz.values, 
+            ms2_reader.peak_df.intensity.values,
+            get_spec_mz_tols(
+                ms2_reader.peak_df.mz.values, ppm, tol
+            ),
+            ms2_reader.peak_start_idxes,
+            ms2_reader.peak_end_idxes,
+            matched_intensity_df.values,
+            matched_mz_err_df.values,
+        )
 
         return (
             psm_df, fragment_mz_df, 
@@ -367,10 +628,12 @@ class PepSpecMatch(object):
             if isinstance(self._ms2_file_dict[raw_name], MSReaderBase):
                 ms2_reader = self._ms2_file_dict[raw_name]
             else:
-                ms2_reader = ms2_reader_provider.get_reader(
-                    self._ms2_file_type
+                ms2_reader = load_ms2_reader(
+                    self._ms2_file_dict[raw_name], 
+                    self._ms2_file_type,
+                    self.use_peak_store, self.peak_store_folder,
+                    self.reader_process_num,
                 )
-                ms2_reader.load(self._ms2_file_dict[raw_name])
             if self.rt_not_in_df:
                 # pfind does not report RT in the result file
                 _df = df_group.reset_index().merge(
@@ -384,18 +647,22 @@ class PepSpecMatch(object):
                     _df.index, ['rt','rt_norm']
                 ] = _df[['rt','rt_norm']]
 
-            match_one_raw_with_numba(
-                df_group.spec_idx.values,
+            ms2_reader.update_peak_indices()
+            set_numba_thread_num(self.thread_num)
+            match_one_raw_with_numba_auto(
+                ms2_reader._get_spec_positions(df_group.spec_idx.values),
                 df_group.frag_start_idx.values,
                 df_group.frag_stop_idx.values,
                 self.fragment_mz_df.values,
                 ms2_reader.peak_df.mz.values, 
                 ms2_reader.peak_df.intensity.values,
-                ms2_reader.spectrum_df.peak_start_idx.values,
-                ms2_reader.spectrum_df.peak_end_idx.values,
+                get_spec_mz_tols(
+                    ms2_reader.peak_df.mz.values, self.ppm, self.tol
+                ),
+                ms2_reader.peak_start_idxes,
+                ms2_reader.peak_end_idxes,
                 self.matched_intensity_df.values,
                 self.matched_mz_err_df.values,
-                self.ppm, self.tol
             )
     
     def match_ms2_centroid(self,
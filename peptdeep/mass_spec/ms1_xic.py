@@ -0,0 +1,262 @@
+import numpy as np
+import numba
+import pandas as pd
+
+from peptdeep.mass_spec.ms_reader import (
+    ms1_reader_provider, MSReaderBase
+)
+from peptdeep.mass_spec.match import (
+    match_centroid_mz, match_profile_mz, get_spec_mz_tols
+)
+
+@numba.njit
+def _are_peaks_sorted(
+    all_spec_mzs, peak_start_idxes, peak_end_idxes
+)->bool:
+    for start, end in zip(peak_start_idxes, peak_end_idxes):
+        for i in range(start+1, end):
+            if all_spec_mzs[i] < all_spec_mzs[i-1]:
+                return False
+    return True
+
+@numba.njit
+def _sort_peaks_in_scans(
+    all_spec_mzs, all_spec_intensities,
+    peak_start_idxes, peak_end_idxes,
+):
+    for start, end in zip(peak_start_idxes, peak_end_idxes):
+        if end <= start: continue
+        order = np.argsort(all_spec_mzs[start:end])+start
+        all_spec_mzs[start:end] = all_spec_mzs[order]
+        all_spec_intensities[start:end] = all_spec_intensities[order]
+
+@numba.njit(parallel=True)
+def extract_xics_with_numba(
+    query_mzs, scan_starts, scan_stops, xic_offsets,
+    all_spec_mzs, all_spec_intensities, all_spec_mz_tols,
+    peak_start_idxes, peak_end_idxes,
+    xic_intensities, profile_mode,
+):
+    """
+    Internel function to extract XICs, parallelized over precursors.
+    The XIC of query_mzs[i] is written into
+    `xic_intensities[xic_offsets[i]:xic_offsets[i+1],:]`,
+    one row for each RT-sorted scan in `scan_starts[i]:scan_stops[i]`.
+    """
+    for i in numba.prange(len(query_mzs)):
+        for j in range(scan_starts[i], scan_stops[i]):
+            peak_start = peak_start_idxes[j]
+            peak_end = peak_end_idxes[j]
+            if peak_end <= peak_start: continue
+            spec_mzs = all_spec_mzs[peak_start:peak_end]
+            spec_intens = all_spec_intensities[peak_start:peak_end]
+            spec_mz_tols = all_spec_mz_tols[peak_start:peak_end]
+            if profile_mode:
+                matched_idxes = match_profile_mz(
+                    spec_mzs, query_mzs[i], spec_mz_tols, spec_intens
+                )
+            else:
+                matched_idxes = match_centroid_mz(
+                    spec_mzs, query_mzs[i], spec_mz_tols
+                )
+            xic_idx = xic_offsets[i]+j-scan_starts[i]
+            for k in range(len(matched_idxes)):
+                if matched_idxes[k] != -1:
+                    xic_intensities[xic_idx, k] = spec_intens[
+                        matched_idxes[k]
+                    ]
+
+class MS1XICExtractor(object):
+    """
+    Extract XICs (extracted-ion chromatograms) of precursors from MS1 scans.
+    Scans are indexed by RT once, then XICs of many precursors
+    are extracted together by binary search of RT windows and
+    the `match_centroid_mz`/`match_profile_mz` kernels.
+    """
+    def __init__(self,
+        ppm:bool=True, tol:float=20.0,
+        profile_mode:bool=False,
+    ):
+        """
+        Parameters
+        ----------
+        ppm : bool, optional
+            if use ppm tolerance. Defaults to True.
+
+        tol : float, optional
+            tolerance value. Defaults to 20.0.
+
+        profile_mode : bool, optional
+            if MS1 peaks are profile peaks. If True, the highest
+            peak in the tolerance is used, otherwise the closest one.
+            Defaults to False.
+        """
+        self.ppm = ppm
+        self.tol = tol
+        self.profile_mode = profile_mode
+        self.ms1_reader:MSReaderBase = None
+
+    def load(self, 
+        ms1_file, ms1_file_type:str='alphapept',
+        reader_process_num:int=None,
+    ):
+        """Load MS1 scans and build the RT index
+
+        Parameters
+        ----------
+        ms1_file : str or MSReaderBase
+            ms1 file path or a loaded ms1 reader
+
+        ms1_file_type : str, optional
+            ms1 file type, could be ["thermo","alphapept"].
+            Defaults to 'alphapept'.
+
+        reader_process_num : int, optional
+            process number to read the ms1 file 
+            (e.g. `ThermoRawMS1Reader.process_num`). Defaults to None, 
+            `global_settings['peak_matching']['reader_process_num']`.
+        """
+        if isinstance(ms1_file, MSReaderBase):
+            self.ms1_reader = ms1_file
+        else:
+            self.ms1_reader = ms1_reader_provider.get_reader(
+                ms1_file_type
+            )
+            if (
+                reader_process_num is not None and 
+                hasattr(self.ms1_reader, 'process_num')
+            ):
+                self.ms1_reader.process_num = reader_process_num
+            self.ms1_reader.load(ms1_file)
+        self.build_index()
+
+    def build_index(self):
+        """Build the RT-sorted index over non-empty MS1 scans
+        of `self.ms1_reader`, and make sure peaks in each scan
+        are sorted by mz. Index RTs are in minutes, RTs of readers 
+        with `rt_unit=='second'` (e.g. `ThermoRawMS1Reader`) are converted.
+        """
+        spectrum_df = self.ms1_reader.spectrum_df
+        peak_starts = spectrum_df.peak_start_idx.values.astype(np.int64)
+        peak_ends = spectrum_df.peak_end_idx.values.astype(np.int64)
+        rts = spectrum_df.rt.values
+        if self.ms1_reader.rt_unit == 'second':
+            rts = rts/60
+        valid = (peak_ends>peak_starts)&~np.isnan(rts)
+        order = np.argsort(rts[valid], kind='stable')
+        self.scan_rts = rts[valid][order]
+        self.scan_spec_idxes = spectrum_df.spec_idx.values[valid][order]
+        self.peak_start_idxes = peak_starts[valid][order]
+        self.peak_end_idxes = peak_ends[valid][order]
+
+        self.spec_mzs = self.ms1_reader.peak_df.mz.values
+        self.spec_intensities = self.ms1_reader.peak_df.intensity.values
+        if not _are_peaks_sorted(
+            self.spec_mzs, self.peak_start_idxes, self.peak_end_idxes
+        ):
+            self.spec_mzs = self.spec_mzs.copy()
+            self.spec_intensities = self.spec_intensities.copy()
+            _sort_peaks_in_scans(
+                self.spec_mzs, self.spec_intensities,
+                self.peak_start_idxes, self.peak_end_idxes
+            )
+        self.spec_mz_tols = get_spec_mz_tols(
+            self.spec_mzs, self.ppm, self.tol
+        )
+
+    def extract_xics(self,
+        precursor_mzs:np.ndarray,
+        rt_starts:np.ndarray,
+        rt_stops:np.ndarray,
+    )->tuple:
+        """Extract XICs of all precursors at once.
+
+        Parameters
+        ----------
+        precursor_mzs : np.ndarray
+            1-D array of precursor mz values, or 2-D array
+            of shape (precursor_num, isotope_num) for isotope XICs
+
+        rt_starts : np.ndarray
+            start RT (minutes) of the XIC window for each precursor
+
+        rt_stops : np.ndarray
+            stop RT (minutes) of the XIC window for each precursor
+
+        Returns
+        -------
+        tuple
+            np.ndarray: int64 offsets of length `precursor_num+1`,
+            the XIC of precursor i is in `offsets[i]:offsets[i+1]`.
+
+            np.ndarray: flat RT values (minutes) of XIC points
+
+            np.ndarray: XIC intensities of shape (offsets[-1], isotope_num),
+            0 if no peaks are matched
+        """
+        query_mzs = np.asarray(precursor_mzs, dtype=np.float64)
+        if query_mzs.ndim == 1:
+            query_mzs = query_mzs.reshape((-1,1))
+        query_mzs = np.ascontiguousarray(query_mzs)
+        scan_starts = np.searchsorted(
+            self.scan_rts, rt_starts, side='left'
+        ).astype(np.int64)
+        scan_stops = np.searchsorted(
+            self.scan_rts, rt_stops, side='right'
+        ).astype(np.int64)
+        scan_stops = np.maximum(scan_stops, scan_starts)
+        xic_offsets = np.zeros(len(query_mzs)+1, dtype=np.int64)
+        xic_offsets[1:] = np.cumsum(scan_stops-scan_starts)
+        xic_scan_idxes = (
+            np.repeat(scan_starts-xic_offsets[:-1], scan_stops-scan_starts)
+            +np.arange(xic_offsets[-1], dtype=np.int64)
+        )
+        xic_intensities = np.zeros(
+            (xic_offsets[-1], query_mzs.shape[1]),
+            dtype=self.spec_intensities.dtype
+        )
+        extract_xics_with_numba(
+            query_mzs, scan_starts, scan_stops, xic_offsets,
+            self.spec_mzs, self.spec_intensities, self.spec_mz_tols,
+            self.peak_start_idxes, self.peak_end_idxes,
+            xic_intensities, self.profile_mode,
+        )
+        return (
+            xic_offsets,
+            self.scan_rts[xic_scan_idxes],
+            xic_intensities
+        )
+
+    def extract_xics_for_precursor_df(self,
+        precursor_df:pd.DataFrame,
+        rt_win:float,
+        mz_col:str='precursor_mz',
+        rt_col:str='rt',
+    )->tuple:
+        """Extract XICs of precursors in `precursor_df`
+        within `[rt-rt_win, rt+rt_win]`.
+
+        Parameters
+        ----------
+        precursor_df : pd.DataFrame
+            precursor dataframe
+
+        rt_win : float
+            half RT window in minutes
+
+        mz_col : str, optional
+            Defaults to 'precursor_mz'.
+
+        rt_col : str, optional
+            RT column in minutes. Defaults to 'rt'.
+
+        Returns
+        -------
+        tuple
+            see `extract_xics()`
+        """
+        rts = precursor_df[rt_col].values
+        return self.extract_xics(
+            precursor_df[mz_col].values,
+            rts-rt_win, rts+rt_win,
+        )
@@ -1,8 +1,12 @@
 import os
+import json
+import hashlib
+import multiprocessing as mp
 import numpy as np
 import pandas as pd
 from alphabase.io.hdf import HDF_File
 from peptdeep.utils import logging
+from peptdeep.settings import global_settings
 from inspect import currentframe, getframeinfo
 
 try:
@@ -13,12 +17,29 @@ except (ImportError,AttributeError) as e:
     logging.warn(f"{frameinfo.filename}#L{frameinfo.lineno}: Cannot import `RawFileReader`, check if PythonNet is installed. See https://github.com/MannLabs/alphapeptdeep#pip")
     RawFileReader = None
 
+def _frame_from_columns(columns:dict)->pd.DataFrame:
+    """DataFrame whose columns are the given 1-D arrays (no copies).
+
+    With `copy=False`, pandas keeps one block for each column 
+    instead of consolidating same-dtype columns into a new 2-D block,
+    so `df[col].values` shares memory with `columns[col]`.
+    """
+    return pd.DataFrame(columns, copy=False)
+
 class MSReaderBase:
     def __init__(self):
         self.spectrum_df:pd.DataFrame = pd.DataFrame()
         self.peak_df:pd.DataFrame = pd.DataFrame()
         # self.mzs: np.ndarray = np.array([])
         # self.intensities: np.ndarray = np.array([])
+        # int32/float32 columns in `spectrum_df`, see `build_spectrum_df()`
+        self.compact_spectrum_df:bool = False
+        # peak offsets (views of `spectrum_df` columns), see `update_peak_indices()`
+        self.peak_start_idxes:np.ndarray = np.array([], dtype=np.int64)
+        self.peak_end_idxes:np.ndarray = np.array([], dtype=np.int64)
+        self._is_positional_index = True
+        # unit of `spectrum_df.rt`, 'minute' or 'second'
+        self.rt_unit:str = 'minute'
 
     def load(self, file_path):
         raise NotImplementedError('load()')
@@ -45,25 +66,86 @@ class MSReaderBase:
 
         mobility_list : list, optional
             mobility for each scan. Defaults to None.
+
+        Notes
+        -----
+        Columns are filled into preallocated numpy arrays in one pass,
+        `spectrum_df` and `peak_start_idxes`/`peak_end_idxes` are
+        views of these arrays. If `self.compact_spectrum_df` is True, int32 `spec_idx` and 
+        peak indices (if there are less than 2^31 peaks) 
+        and float32 `rt`/`mobility` are used.
             
         """
-        def set_col(col, indexes, values, dtype, na_value):
-            self.spectrum_df.loc[indexes, col] = values
-            self.spectrum_df[col].fillna(na_value, inplace=True)
-            self.spectrum_df[col] = self.spectrum_df[col].astype(dtype)
-
-        scan_list = np.array(scan_list, dtype=np.int32)
+        scan_list = np.array(scan_list, dtype=np.int64)
         if scan_list.min() > 0:
             # thermo scan >= 1
             scan_list -= 1
         idx_len = np.max(scan_list)+1
-        self.spectrum_df = pd.DataFrame(index=np.arange(idx_len, dtype=np.int64))
-        self.spectrum_df['spec_idx'] = self.spectrum_df.index.values
-        set_col('peak_start_idx', scan_list, scan_indices[:-1], np.int64, -1)
-        set_col('peak_end_idx', scan_list, scan_indices[1:], np.int64, -1)
-        set_col('rt', scan_list, rt_list, np.float64, np.nan)
+        scan_indices = np.asarray(scan_indices)
+
+        if (
+            self.compact_spectrum_df and 
+            scan_indices[-1] < np.iinfo(np.int32).max and
+            idx_len < np.iinfo(np.int32).max
+        ):
+            int_dtype = np.int32
+            float_dtype = np.float32
+        elif self.compact_spectrum_df:
+            int_dtype = np.int64
+            float_dtype = np.float32
+        else:
+            int_dtype = np.int64
+            float_dtype = np.float64
+
+        def fill_array(values, dtype, na_value):
+            array = np.full(idx_len, na_value, dtype=dtype)
+            array[scan_list] = values
+            return array
+
+        spectrum_dict = {
+            'spec_idx': np.arange(idx_len, dtype=int_dtype),
+            'peak_start_idx': fill_array(scan_indices[:-1], int_dtype, -1),
+            'peak_end_idx': fill_array(scan_indices[1:], int_dtype, -1),
+            'rt': fill_array(rt_list, float_dtype, np.nan),
+        }
         if mobility_list is not None:
-            set_col('mobility', scan_list, mobility_list, np.float64, np.nan)
+            spectrum_dict['mobility'] = fill_array(
+                mobility_list, float_dtype, np.nan
+            )
+        self.spectrum_df = _frame_from_columns(spectrum_dict)
+        self.update_peak_indices()
+
+    def update_peak_indices(self):
+        """Update `peak_start_idxes` and `peak_end_idxes` 
+        from `spectrum_df`. It must be called if `spectrum_df` 
+        is modified outside of `build_spectrum_df()` 
+        (the lengths are checked in `get_peaks()` and `get_peaks_batch()`).
+        The arrays are views of the `spectrum_df` columns and keep their
+        dtype (int32 for compact `spectrum_df`).
+        """
+        self.peak_start_idxes = self.spectrum_df.peak_start_idx.values
+        self.peak_end_idxes = self.spectrum_df.peak_end_idx.values
+        # spec_idx is the label of `spectrum_df.index`, it is also 
+        # the row position if the index is 0..n-1 (the common case)
+        index = self.spectrum_df.index
+        self._is_positional_index = (
+            isinstance(index, pd.RangeIndex) and index.start == 0 
+            and index.step == 1
+        ) or np.array_equal(index.values, np.arange(len(index)))
+
+    def _get_spec_positions(self, spec_idxes:np.ndarray)->np.ndarray:
+        """Row positions of `spec_idxes` in `spectrum_df`, -1 if not found"""
+        if len(self.peak_start_idxes) != len(self.spectrum_df):
+            self.update_peak_indices()
+        spec_idxes = np.asarray(spec_idxes, dtype=np.int64)
+        if not self._is_positional_index:
+            return self.spectrum_df.index.get_indexer(spec_idxes).astype(
+                np.int64, copy=False
+            )
+        return np.where(
+            (spec_idxes>=0)&(spec_idxes<len(self.peak_start_idxes)),
+            spec_idxes, -1
+        )
 
     def get_peaks(self, spec_idx:int):
         """Get peak (mz and intensity) values by `spec_idx`
@@ -82,17 +164,60 @@ class MSReaderBase:
         np.array
             intensity values for the given spec_idx
 
+            Both are None if `spec_idx` is not in `spectrum_df.index`
+            (the same as before peak offsets were cached as arrays).
         """
-        if spec_idx not in self.spectrum_df.index:
+        pos = self._get_spec_positions([spec_idx])[0]
+        if pos < 0:
             return None, None
-        start_idx, end_idx = self.spectrum_df.loc[
-            spec_idx, ['peak_start_idx','peak_end_idx']
-        ].values.astype(np.int64)
+        start_idx = self.peak_start_idxes[pos]
+        end_idx = self.peak_end_idxes[pos]
         return (
             self.peak_df.mz.values[start_idx:end_idx],
             self.peak_df.intensity.values[start_idx:end_idx]
         )
 
+    def get_peaks_batch(self, spec_idxes:np.ndarray)->tuple:
+        """Get peaks of many spectra with a single vectorized call.
+        Spectra that are not in `spectrum_df` have no peaks.
+
+        Parameters
+        ----------
+        spec_idxes : np.ndarray
+            spec_idx array
+
+        Returns
+        -------
+        np.ndarray
+            int64 offsets of length `len(spec_idxes)+1`, 
+            peaks of `spec_idxes[i]` are in `offsets[i]:offsets[i+1]`
+
+        np.ndarray
+            flat mz values
+
+        np.ndarray
+            flat intensity values
+
+        """
+        positions = self._get_spec_positions(spec_idxes)
+        valid = positions>=0
+        starts = np.zeros(len(positions), dtype=np.int64)
+        ends = np.zeros(len(positions), dtype=np.int64)
+        starts[valid] = self.peak_start_idxes[positions[valid]]
+        ends[valid] = self.peak_end_idxes[positions[valid]]
+        peak_nums = np.maximum(ends-starts, 0)
+        offsets = np.zeros(len(positions)+1, dtype=np.int64)
+        offsets[1:] = np.cumsum(peak_nums)
+        peak_idxes = (
+            np.repeat(starts-offsets[:-1], peak_nums)
+            +np.arange(offsets[-1], dtype=np.int64)
+        )
+        return (
+            offsets,
+            self.peak_df.mz.values[peak_idxes],
+            self.peak_df.intensity.values[peak_idxes]
+        )
+
     def get_peaks_by_scan_num(self, scan_num:int):
         """Get peak (mz and intensity) values by `spec_idx`
 
@@ -112,6 +237,222 @@ class MSReaderBase:
         """
         return self.get_peaks(scan_num-1)
 
+    def save_peak_store(self, store_folder:str, source_file:str=None):
+        """Save `peak_df` and `spectrum_df` as a columnar peak store,
+        which can be opened with zero copy by `load_peak_store()`.
+        
+        The store folder contains:
+        
+        - peaks.npy: float64 array of shape (2, peak_num), 
+          the first row is mz and the second row is intensity.
+        - spectrum_{col}.npy: one array for each column of `spectrum_df`,
+          including the `spec_idx`->peak offset index 
+          (`peak_start_idx` and `peak_end_idx`).
+        - meta.json: written at last to mark the store is complete.
+
+        Parameters
+        ----------
+        store_folder : str
+            folder to save the peak store
+        
+        source_file : str, optional
+            the MS file or folder where the peaks are loaded from,
+            its fingerprint (see :func:`get_peak_store_fingerprint`) 
+            is stored to check if the store is outdated. 
+            Stores without fingerprints are never reused by 
+            `load_with_peak_store()`. Defaults to None.
+        """
+        os.makedirs(store_folder, exist_ok=True)
+        meta_file = os.path.join(store_folder, 'meta.json')
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+        peaks = np.empty((2, len(self.peak_df)), dtype=np.float64)
+        peaks[0] = self.peak_df.mz.values
+        peaks[1] = self.peak_df.intensity.values
+        np.save(os.path.join(store_folder, 'peaks.npy'), peaks)
+        for col in self.spectrum_df.columns:
+            np.save(
+                os.path.join(store_folder, f'spectrum_{col}.npy'),
+                self.spectrum_df[col].values
+            )
+        meta = self._get_peak_store_meta(source_file)
+        meta['spectrum_columns'] = list(self.spectrum_df.columns)
+        with open(meta_file, 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def load_peak_store(self, store_folder:str):
+        """Open a peak store saved by `save_peak_store()`. 
+        Peaks are memory-mapped (read-only) without copy, 
+        `spectrum_df` is loaded into memory.
+
+        Parameters
+        ----------
+        store_folder : str
+            folder of the peak store
+        """
+        with open(os.path.join(store_folder, 'meta.json')) as f:
+            meta = json.load(f)
+        peaks = np.load(
+            os.path.join(store_folder, 'peaks.npy'), mmap_mode='r'
+        )
+        # peaks.T is F-contiguous, so pandas keeps `peaks` 
+        # as its block and each column is a contiguous view.
+        self.peak_df = pd.DataFrame(
+            peaks.T, columns=['mz','intensity'], copy=False
+        )
+        self.spectrum_df = _frame_from_columns({
+            col: np.load(os.path.join(store_folder, f'spectrum_{col}.npy'))
+            for col in meta['spectrum_columns']
+        })
+        self.update_peak_indices()
+
+    def load_with_peak_store(self, 
+        file_path:str, store_folder:str=None
+    ):
+        """Open the peak store of `file_path` if it is up to date, 
+        otherwise load `file_path` with `load()` and 
+        save the peaks as the peak store for the next time.
+
+        Parameters
+        ----------
+        file_path : str
+            MS file or folder (e.g. Bruker .d) path. If it is not a str 
+            (e.g. a file-like object) or the path does not exist, 
+            `load()` is used without the peak store.
+
+        store_folder : str, optional
+            folder to save peak stores, see :func:`get_peak_store_path`.
+            Defaults to None, the peak store cache folder 
+            in `global_settings['PEPTDEEP_HOME']`.
+        """
+        if (
+            not isinstance(file_path, str) or 
+            not get_peak_store_fingerprint(file_path)
+        ):
+            # stores of sources without fingerprints are never up to date
+            self.load(file_path)
+            return
+        store_path = get_peak_store_path(file_path, store_folder)
+        try:
+            if self._is_peak_store_valid(store_path, file_path):
+                self.load_peak_store(store_path)
+                return
+        except OSError as e:
+            # e.g. PermissionError of shared or read-only folders
+            logging.warn(
+                f"Cannot open peak store '{store_path}', "
+                f"loading '{file_path}' without it: {e}"
+            )
+            self.load(file_path)
+            return
+        self.load(file_path)
+        try:
+            self.save_peak_store(store_path, file_path)
+        except OSError as e:
+            logging.warn(
+                f"Cannot save peak store '{store_path}': {e}"
+            )
+
+    def _get_peak_store_meta(self, source_file:str=None)->dict:
+        meta = {
+            'version': PEAK_STORE_VERSION,
+            'reader': self.__class__.__name__,
+            'profile_mode': getattr(self, 'profile_mode', False),
+        }
+        if source_file is not None:
+            meta.update(get_peak_store_fingerprint(source_file))
+        return meta
+
+    def _is_peak_store_valid(self, 
+        store_folder:str, source_file:str
+    )->bool:
+        meta_file = os.path.join(store_folder, 'meta.json')
+        if not os.path.isfile(meta_file): return False
+        expected = self._get_peak_store_meta(source_file)
+        if 'source_mtime' not in expected:
+            # the source cannot be fingerprinted
+            return False
+        with open(meta_file) as f:
+            meta = json.load(f)
+        meta.pop('spectrum_columns', None)
+        return meta == expected
+
+PEAK_STORE_VERSION = 1
+
+def get_peak_store_fingerprint(source_file:str)->dict:
+    """Fingerprint of the MS file or folder to check if its peak store
+    is outdated.
+
+    Parameters
+    ----------
+    source_file : str
+        MS file or folder (e.g. Bruker .d) path
+
+    Returns
+    -------
+    dict
+        `source_size` and `source_mtime` of a file. For a folder, 
+        they are the total size and the latest modified time 
+        of the folder and all files in it, plus `source_file_num`.
+        Empty if `source_file` does not exist.
+    """
+    if os.path.isfile(source_file):
+        stat = os.stat(source_file)
+        return {
+            'source_size': stat.st_size, 
+            'source_mtime': stat.st_mtime,
+        }
+    elif os.path.isdir(source_file):
+        size = 0
+        file_num = 0
+        mtime = 0.0
+        for root, _, files in os.walk(source_file):
+            mtime = max(mtime, os.stat(root).st_mtime)
+            for file_name in files:
+                stat = os.stat(os.path.join(root, file_name))
+                size += stat.st_size
+                file_num += 1
+                mtime = max(mtime, stat.st_mtime)
+        return {
+            'source_size': size, 
+            'source_mtime': mtime,
+            'source_file_num': file_num,
+        }
+    else:
+        return {}
+
+def get_peak_store_path(file_path:str, store_folder:str=None)->str:
+    """Peak store folder of the MS file.
+
+    Parameters
+    ----------
+    file_path : str
+        MS file path
+
+    store_folder : str, optional
+        Defaults to None, `{PEPTDEEP_HOME}/peak_stores`. MS files 
+        are often on read-only or shared storage, so stores are not 
+        saved next to them unless it is `store_folder`.
+
+    Returns
+    -------
+    str
+        `{store_folder}/{basename(file_path)}.peak_store`, or 
+        `{PEPTDEEP_HOME}/peak_stores/{basename(file_path)}.{path_hash}.peak_store`
+        by default, where the hash of the absolute path 
+        separates files with the same name in different folders.
+    """
+    file_name = os.path.basename(file_path)
+    if not store_folder:
+        store_folder = os.path.join(
+            global_settings['PEPTDEEP_HOME'], 'peak_stores'
+        )
+        path_hash = hashlib.sha1(
+            os.path.abspath(file_path).encode('utf-8')
+        ).hexdigest()[:12]
+        file_name = f'{file_name}.{path_hash}'
+    return os.path.join(store_folder, file_name+'.peak_store')
+
 class AlphaPept_HDF_MS1_Reader(MSReaderBase):
     """MS1 from AlphaPept HDF"""
     def load(self, file_path):
@@ -187,54 +528,279 @@ def index_ragged_list(ragged_list: list)  -> np.ndarray:
 
     return indices
 
+def _parse_mgf_lines(body:bytes)->tuple:
+    """Line-by-line parsing of one MGF spectrum (`body` between 
+    BEGIN IONS and END IONS), the fallback of `_parse_mgf_spectrum`"""
+    masses = []
+    intens = []
+    scan = None
+    RT = 0
+    title = None
+    for line in body.split(b'\n'):
+        line = line.strip()
+        if not line: continue
+        if line[:1].isdigit():
+            mass,inten = [float(i) for i in line.split()]
+            masses.append(mass)
+            intens.append(inten)
+        elif line.startswith(b'SCAN='):
+            scan = int(line.split(b'=')[1])
+        elif line.startswith(b'RTINSECOND'):
+            RT = float(line.split(b'=')[1])/60
+        elif line.startswith(b'TITLE=') and title is None:
+            title = line.decode()
+    return scan, RT, title, np.array(masses), np.array(intens)
+
+def _parse_mgf_spectrum(body:bytes)->tuple:
+    """Parse one MGF spectrum (`body` between BEGIN IONS and END IONS).
+    Header lines are parsed one by one until the first peak line, 
+    then all the peak lines are parsed by a single `np.fromstring` call.
+    If the values do not match "mz intensity" for each peak line
+    (e.g. extra columns or non-numeric tokens), the spectrum is 
+    parsed by `_parse_mgf_lines` instead.
+
+    Returns
+    -------
+    tuple
+        scan (None if not found), RT (minutes), title (None if not found),
+        peak values (1-D float array, mz and intensity interleaved)
+    """
+    scan = None
+    RT = 0
+    title = None
+    pos = 0
+    n = len(body)
+    while pos < n:
+        line_end = body.find(b'\n', pos)
+        if line_end == -1: line_end = n
+        line = body[pos:line_end].strip()
+        if line:
+            if line[:1].isdigit(): break
+            elif line.startswith(b'SCAN='):
+                scan = int(line.split(b'=')[1])
+            elif line.startswith(b'RTINSECOND'):
+                RT = float(line.split(b'=')[1])/60
+            elif line.startswith(b'TITLE=') and title is None:
+                title = line.decode()
+        pos = line_end+1
+    peak_lines = body[pos:].strip()
+    if b'=' not in peak_lines:
+        line_count = peak_lines.count(b'\n')+1 if peak_lines else 0
+        values = np.fromstring(peak_lines, sep=' ')
+        if len(values) == 2*line_count:
+            return scan, RT, title, values
+    # header lines after peak lines, or peak lines which 
+    # are not "mz intensity" (raise errors as line-by-line parsing)
+    scan, RT, title, masses, intens = _parse_mgf_lines(body)
+    values = np.empty(len(masses)*2)
+    values[0::2] = masses
+    values[1::2] = intens
+    return scan, RT, title, values
+
+def parse_mgf_buffer(buffer:bytes)->tuple:
+    """Parse all spectra in a bytes buffer of MGF content.
+    The last spectrum can be truncated before END IONS.
+
+    Parameters
+    ----------
+    buffer : bytes
+        MGF content
+
+    Returns
+    -------
+    tuple
+        np.ndarray: scan numbers (int64)
+
+        np.ndarray: RT in minutes (float64)
+
+        np.ndarray: peak numbers of spectra (int64)
+
+        np.ndarray: peak mz values (float64)
+
+        np.ndarray: peak intensity values (float64)
+    """
+    scan_list = []
+    rt_list = []
+    peak_num_list = []
+    values_list = []
+    for block in buffer.split(b'BEGIN IONS')[1:]:
+        end = block.find(b'END IONS')
+        if end == -1: end = len(block)
+        scan, RT, title, values = _parse_mgf_spectrum(block[:end])
+        if not scan:
+            scan = parse_pfind_scan_from_TITLE(title)
+        scan_list.append(scan)
+        rt_list.append(RT)
+        peak_num_list.append(len(values)//2)
+        values_list.append(values)
+    if len(values_list) > 0:
+        values = np.concatenate(values_list)
+    else:
+        values = np.array([], dtype=np.float64)
+    return (
+        np.array(scan_list, dtype=np.int64),
+        np.array(rt_list, dtype=np.float64),
+        np.array(peak_num_list, dtype=np.int64),
+        values[0::2].copy(), values[1::2].copy(),
+    )
+
+def _concat_mgf_results(results:list)->tuple:
+    return tuple(
+        np.concatenate([result[i] for result in results])
+        for i in range(5)
+    )
+
+def parse_mgf_stream(
+    f, end_pos:int=None, chunk_size:int=1<<26
+)->tuple:
+    """Parse MGF content from a file object chunk by chunk. 
+    Each chunk is cut after the last END IONS, 
+    and the remaining bytes are moved to the next chunk.
+
+    Parameters
+    ----------
+    f : file object
+        binary or text file object, 
+        parsing starts from the current position
+
+    end_pos : int, optional
+        stop reading at this position. Defaults to None (EOF).
+
+    chunk_size : int, optional
+        bytes to read for each chunk. Defaults to 1<<26 (64 MB).
+
+    Returns
+    -------
+    tuple
+        see `parse_mgf_buffer`
+    """
+    results = []
+    remainder = b''
+    pos = f.tell() if end_pos is not None else 0
+    while True:
+        read_size = chunk_size
+        if end_pos is not None:
+            read_size = min(read_size, end_pos-pos)
+        data = f.read(read_size) if read_size > 0 else b''
+        if isinstance(data, str):
+            data = data.encode()
+        pos += len(data)
+        if not data:
+            results.append(parse_mgf_buffer(remainder))
+            break
+        buffer = remainder+data
+        cut = buffer.rfind(b'END IONS')
+        if cut == -1:
+            remainder = buffer
+        else:
+            results.append(parse_mgf_buffer(buffer[:cut]))
+            remainder = buffer[cut:]
+    return _concat_mgf_results(results)
+
+def _parse_mgf_file_range(args)->tuple:
+    mgf, start_pos, end_pos, chunk_size = args
+    with open(mgf, 'rb') as f:
+        f.seek(start_pos)
+        return parse_mgf_stream(f, end_pos, chunk_size)
+
+def split_mgf_file(mgf:str, n_parts:int)->list:
+    """Split an MGF file into byte ranges at BEGIN IONS boundaries.
+
+    Parameters
+    ----------
+    mgf : str
+        MGF file path
+
+    n_parts : int
+        (maximal) number of ranges
+
+    Returns
+    -------
+    list
+        list of (start_pos, end_pos)
+    """
+    file_size = os.path.getsize(mgf)
+    offsets = [0]
+    with open(mgf, 'rb') as f:
+        for i in range(1, n_parts):
+            pos = max(file_size*i//n_parts, offsets[-1])
+            f.seek(pos)
+            # keep the overlap so that BEGIN IONS across two reads is found
+            overlap = b''
+            while True:
+                data = f.read(1<<20)
+                if not data: 
+                    pos = file_size
+                    break
+                found = (overlap+data).find(b'BEGIN IONS')
+                if found != -1:
+                    pos += found-len(overlap)
+                    break
+                overlap = data[-len(b'BEGIN IONS'):]
+                pos += len(data)
+            if pos >= file_size: break
+            if pos > offsets[-1]:
+                offsets.append(pos)
+    offsets.append(file_size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
 class MGFReader(MSReaderBase):
     """MGF Reader (MS2)"""
+    def __init__(self):
+        super().__init__()
+        # Parse the MGF file with multiprocessing if process_num > 1.
+        # Only valid for MGF file paths.
+        self.process_num = global_settings['peak_matching'][
+            'reader_process_num'
+        ]
+        # bytes to read for each chunk
+        self.chunk_size = 1<<26
+
     def load(self, mgf):
         if isinstance(mgf, str):
-            f = open(mgf)
+            if self.process_num > 1:
+                ranges = split_mgf_file(mgf, self.process_num)
+                with mp.get_context('spawn').Pool(
+                    min(self.process_num, len(ranges))
+                ) as p:
+                    results = p.map(_parse_mgf_file_range, [
+                        (mgf, start, end, self.chunk_size) 
+                        for start, end in ranges
+                    ])
+                (
+                    scan_list, rt_list, peak_nums, masses, intens
+                ) = _concat_mgf_results(results)
+            else:
+                with open(mgf, 'rb') as f:
+                    (
+                        scan_list, rt_list, peak_nums, masses, intens
+                    ) = parse_mgf_stream(f, chunk_size=self.chunk_size)
         else:
-            f = mgf
-        scanset = set()
-        masses_list = []
-        intens_list = []
-        scan_list = []
-        rt_list = []
-        while True:
-            line = f.readline()
-            if not line: break
-            if line.startswith('BEGIN IONS'):
-                lines = read_until(f, 'END IONS')
-                masses = []
-                intens = []
-                scan = None
-                RT = 0
-                for line in lines:
-                    if line[0].isdigit():
-                        mass,inten = [float(i) for i in line.strip().split()]
-                        masses.append(mass)
-                        intens.append(inten)
-                    elif line.startswith('SCAN='):
-                        scan = int(line.split('=')[1])
-                    elif line.startswith('RTINSECOND'):
-                        RT = float(line.split('=')[1])/60
-                if not scan:
-                    title = find_line(lines, 'TITLE=')
-                    scan = parse_pfind_scan_from_TITLE(title)
-                if scan in scanset: continue
-                scanset.add(scan)
-                scan_list.append(scan)
-                rt_list.append(RT)
-                masses_list.append(np.array(masses))
-                intens_list.append(np.array(intens))
-        if isinstance(mgf, str): 
-            f.close()
+            (
+                scan_list, rt_list, peak_nums, masses, intens
+            ) = parse_mgf_stream(mgf, chunk_size=self.chunk_size)
+
+        # only keep the first spectrum of duplicated scans
+        _, first_idxes = np.unique(scan_list, return_index=True)
+        if len(first_idxes) < len(scan_list):
+            keep = np.zeros(len(scan_list), dtype=bool)
+            keep[first_idxes] = True
+            peak_keep = np.repeat(keep, peak_nums)
+            masses = masses[peak_keep]
+            intens = intens[peak_keep]
+            scan_list = scan_list[keep]
+            rt_list = rt_list[keep]
+            peak_nums = peak_nums[keep]
+
+        scan_indices = np.zeros(len(peak_nums)+1, dtype=np.int64)
+        scan_indices[1:] = np.cumsum(peak_nums)
         self.build_spectrum_df(
             scan_list, 
-            index_ragged_list(masses_list), 
+            scan_indices, 
             rt_list
         )
-        self.peak_df['mz'] = np.concatenate(masses_list)
-        self.peak_df['intensity'] = np.concatenate(intens_list)
+        self.peak_df['mz'] = masses
+        self.peak_df['intensity'] = intens
 
 class MSReaderProvider:
     """Factory class to register and get MS Readers"""
@@ -259,6 +825,146 @@ ms1_reader_provider = MSReaderProvider()
 ms1_reader_provider.register_reader('alphapept', AlphaPept_HDF_MS1_Reader)
 ms1_reader_provider.register_reader('alphapept_hdf', AlphaPept_HDF_MS1_Reader)
 
+def read_thermo_scans(args)->tuple:
+    """Read scans of the given MS order from a Thermo RAW file
+    in the scan range [first_scan, last_scan]. 
+    It opens its own `RawFileReader`, so it can be used in 
+    worker processes (`multiprocessing.Pool.map`). The reader 
+    is closed even if reading a scan fails.
+
+    Parameters
+    ----------
+    args : tuple
+        (raw_path, first_scan, last_scan, ms_order, 
+        profile_mode, rt_in_seconds, skip_bad_scans)
+
+    Returns
+    -------
+    tuple
+        np.ndarray: scan numbers (int64)
+
+        np.ndarray: RT values (float64)
+
+        np.ndarray: peak numbers of scans (int64)
+
+        np.ndarray: flat peak mz values (float64)
+
+        np.ndarray: flat peak intensity values (float64)
+    """
+    (
+        raw_path, first_scan, last_scan, ms_order, 
+        profile_mode, rt_in_seconds, skip_bad_scans
+    ) = args
+    rawfile = RawFileReader(raw_path)
+    scan_list = []
+    rt_list = []
+    masses_list = []
+    intens_list = []
+    try:
+        for i in range(first_scan, last_scan+1):
+            try:
+                if rawfile.GetMSOrderForScanNum(i) != ms_order:
+                    continue
+                if profile_mode:
+                    masses, intens = rawfile.GetProfileMassListFromScanNum(i)
+                else:
+                    masses, intens = rawfile.GetCentroidMassListFromScanNum(i)
+                if rt_in_seconds:
+                    rt = rawfile.RTInSecondsFromScanNum(i)
+                else:
+                    rt = rawfile.RTFromScanNum(i)
+                scan_list.append(i)
+                rt_list.append(rt)
+                masses_list.append(masses)
+                intens_list.append(intens)
+            except KeyboardInterrupt as e:
+                raise e
+            except SystemExit as e:
+                raise e
+            except Exception as e:
+                if not skip_bad_scans:
+                    raise e
+                logging.warning(f"Bad scan={i} in raw file '{raw_path}'")
+    finally:
+        rawfile.Close()
+    peak_nums = np.array(
+        [len(masses) for masses in masses_list], dtype=np.int64
+    )
+    if len(masses_list) == 0:
+        masses_list = [np.array([], dtype=np.float64)]
+        intens_list = [np.array([], dtype=np.float64)]
+    return (
+        np.array(scan_list, dtype=np.int64),
+        np.array(rt_list, dtype=np.float64),
+        peak_nums,
+        np.concatenate(masses_list).astype(np.float64, copy=False),
+        np.concatenate(intens_list).astype(np.float64, copy=False),
+    )
+
+def load_thermo_raw(
+    reader:MSReaderBase, raw_path:str, ms_order:int,
+    rt_in_seconds:bool, skip_bad_scans:bool,
+):
+    """Load scans of `ms_order` from a Thermo RAW file into `reader`.
+    If `reader.process_num > 1`, the scan range is split into 
+    contiguous blocks, and each worker process reads one block 
+    with its own `RawFileReader`. The flat peak blocks are then 
+    merged in scan order.
+
+    Parameters
+    ----------
+    reader : MSReaderBase
+        ThermoRawMS1Reader or ThermoRawMS2Reader
+
+    raw_path : str
+        RAW file path
+
+    ms_order : int
+        1 or 2
+
+    rt_in_seconds : bool
+        if use `RTInSecondsFromScanNum()` or `RTFromScanNum()` for RT
+
+    skip_bad_scans : bool
+        if skip the scans which cannot be read
+    """
+    rawfile = RawFileReader(raw_path)
+    try:
+        first_scan = rawfile.FirstSpectrumNumber
+        last_scan = rawfile.LastSpectrumNumber
+    finally:
+        rawfile.Close()
+
+    scan_blocks = np.array_split(
+        np.arange(first_scan, last_scan+1), 
+        max(1, reader.process_num)
+    )
+    args_list = [
+        (
+            raw_path, block[0], block[-1], ms_order, 
+            reader.profile_mode, rt_in_seconds, skip_bad_scans
+        ) for block in scan_blocks if len(block) > 0
+    ]
+    if len(args_list) > 1:
+        with mp.get_context('spawn').Pool(len(args_list)) as p:
+            results = p.map(read_thermo_scans, args_list)
+    else:
+        results = [read_thermo_scans(args) for args in args_list]
+
+    scan_list, rt_list, peak_nums, masses, intens = [
+        np.concatenate([result[i] for result in results])
+        for i in range(5)
+    ]
+    scan_indices = np.zeros(len(peak_nums)+1, dtype=np.int64)
+    scan_indices[1:] = np.cumsum(peak_nums)
+    reader.build_spectrum_df(
+        scan_list,
+        scan_indices,
+        rt_list,
+    )
+    reader.peak_df['mz'] = masses
+    reader.peak_df['intensity'] = intens
+
 if RawFileReader is None:
     class ThermoRawMS1Reader:
         def __init__(self):
@@ -273,92 +979,34 @@ else:
         def __init__(self):
             super().__init__()
             self.profile_mode = False
+            # RTInSecondsFromScanNum() is used for MS1 scans
+            self.rt_unit = 'second'
+            # number of processes to read scans
+            self.process_num = global_settings['peak_matching'][
+                'reader_process_num'
+            ]
 
         def load(self, raw_path):
-            rawfile = RawFileReader(raw_path)
- 
-            spec_indices = np.array(
-                range(rawfile.FirstSpectrumNumber, rawfile.LastSpectrumNumber + 1)
+            load_thermo_raw(
+                self, raw_path, ms_order=1,
+                rt_in_seconds=True, skip_bad_scans=True,
             )
-            scan_list = []
-            rt_list = []
-            masses_list = []
-            intens_list = []
-            for i in spec_indices:
-                try:
-                    ms_order = rawfile.GetMSOrderForScanNum(i)
-
-                    if ms_order == 1:
-                        if self.profile_mode:
-                            masses, intens = rawfile.GetProfileMassListFromScanNum(i)
-                        else:
-                            masses, intens = rawfile.GetCentroidMassListFromScanNum(i)
-                        scan_list.append(i)
-                        rt_list.append(rawfile.RTInSecondsFromScanNum(i))
-                        masses_list.append(masses)
-                        intens_list.append(intens)
-
-                except KeyboardInterrupt as e:
-                    raise e
-                except SystemExit as e:
-                    raise e
-                except Exception as e:
-                    print(f"Bad scan={i} in raw file '{raw_path}'")
-            
-            self.build_spectrum_df(
-                scan_list,
-                index_ragged_list(masses_list),
-                rt_list,
-            )
-            self.peak_df['mz'] = np.concatenate(masses_list)
-            self.peak_df['intensity'] = np.concatenate(intens_list)
-            rawfile.Close()
 
     class ThermoRawMS2Reader(MSReaderBase):
         """Thermo RAW MS2 Reader"""
         def __init__(self):
             super().__init__()
             self.profile_mode = False
+            # number of processes to read scans
+            self.process_num = global_settings['peak_matching'][
+                'reader_process_num'
+            ]
 
         def load(self, raw_path):
-            rawfile = RawFileReader(raw_path)
- 
-            spec_indices = np.array(
-                range(rawfile.FirstSpectrumNumber, rawfile.LastSpectrumNumber + 1)
-            )
-            scan_list = []
-            rt_list = []
-            masses_list = []
-            intens_list = []
-            for i in spec_indices:
-                try:
-                    ms_order = rawfile.GetMSOrderForScanNum(i)
-
-                    if ms_order == 2:
-                        if self.profile_mode:
-                            masses, intens = rawfile.GetProfileMassListFromScanNum(i)
-                        else:
-                            masses, intens = rawfile.GetCentroidMassListFromScanNum(i)
-                        scan_list.append(i)
-                        rt_list.append(rawfile.RTFromScanNum(i))
-                        masses_list.append(masses)
-                        intens_list.append(intens)
-
-                except KeyboardInterrupt as e:
-                    raise e
-                except SystemExit as e:
-                    raise e
-                # except Exception as e:
-                #     print(f"Bad scan={i} in raw file '{raw_path}'")
-            
-            self.build_spectrum_df(
-                scan_list,
-                index_ragged_list(masses_list),
-                rt_list,
+            load_thermo_raw(
+                self, raw_path, ms_order=2,
+                rt_in_seconds=False, skip_bad_scans=False,
             )
-            self.peak_df['mz'] = np.concatenate(masses_list)
-            self.peak_df['intensity'] = np.concatenate(intens_list)
-            rawfile.Close()
     
     ms2_reader_provider.register_reader('thermo', ThermoRawMS2Reader)
     ms2_reader_provider.register_reader('thermo_raw', ThermoRawMS2Reader)
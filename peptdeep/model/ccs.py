@@ -13,7 +13,7 @@ from alphabase.peptide.mobility import (
 
 from peptdeep.model.featurize import (
     get_batch_aa_indices, 
-    get_batch_mod_feature
+    get_batch_mod_feature, PrecursorFeatureBatch,
 )
 
 from peptdeep.settings import model_const
@@ -158,14 +158,17 @@ class AlphaCCSModel(model_base.ModelInterface):
 
     def _get_features_from_batch_df(self, 
         batch_df: pd.DataFrame,
+        batch_features:PrecursorFeatureBatch=None,
     ):
-        aa_indices = self._get_26aa_indice_features(batch_df)
+        aa_indices = self._get_26aa_indice_features(
+            batch_df, batch_features
+        )
 
-        mod_x = self._get_mod_features(batch_df)
+        mod_x = self._get_mod_features(batch_df, batch_features)
 
-        charges = self._as_tensor(
-            batch_df['charge'].values
-        ).unsqueeze(1)*self.charge_factor
+        charges = self._get_charge_features(
+            batch_df, batch_features
+        )*self.charge_factor
 
         return aa_indices, mod_x, charges
 
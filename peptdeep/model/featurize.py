@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
-from typing import List, Union
+import numba
+from typing import List, Union, Tuple
 from alphabase.constants.modification import MOD_DF
 
 from peptdeep.settings import model_const
@@ -26,11 +27,37 @@ def _parse_mod_formula(formula):
     return feature
 
 MOD_TO_FEATURE = {}
+MOD_TO_ID = {}
+MOD_FEATURE_TABLE = np.zeros((0, mod_feature_size), dtype=np.float32)
 def update_all_mod_features():
     for modname, formula in MOD_DF[['mod_name','composition']].values:
         MOD_TO_FEATURE[modname] = _parse_mod_formula(formula)
+    update_mod_feature_table()
+
+def update_mod_feature_table():
+    '''Re-build `MOD_TO_ID` and the table of :func:`get_mod_feature_table` 
+    from `MOD_TO_FEATURE`'''
+    global MOD_FEATURE_TABLE
+    MOD_TO_ID.clear()
+    MOD_TO_ID.update(zip(MOD_TO_FEATURE, range(len(MOD_TO_FEATURE))))
+    MOD_FEATURE_TABLE = np.array(
+        list(MOD_TO_FEATURE.values()), dtype=np.float32
+    ).reshape((-1, mod_feature_size))
 update_all_mod_features()
 
+def get_mod_feature_table()->np.ndarray:
+    '''
+    Get the float32 feature table of all modifications, 
+    row `MOD_TO_ID[mod_name]` is the feature of `mod_name`.
+    The table is re-built only if the number of modifications 
+    in `MOD_TO_FEATURE` has been changed, so call 
+    :func:`update_mod_feature_table` after replacing 
+    features of existing modifications in `MOD_TO_FEATURE`.
+    '''
+    if len(MOD_TO_ID) != len(MOD_TO_FEATURE):
+        update_mod_feature_table()
+    return MOD_FEATURE_TABLE
+
 def parse_mod_feature(
     nAA:int, 
     mod_names:List[str], 
@@ -80,34 +107,109 @@ def get_batch_mod_feature(
     Returns
     -------
     np.ndarray
-        3-D tensor with shape (batch_size, nAA+2, mod_feature_size)
+        3-D float32 tensor with shape (batch_size, nAA+2, mod_feature_size)
+    '''
+    return mod_coo_to_dense(
+        *parse_mod_coo(
+            batch_df.mods.values, batch_df.mod_sites.values
+        ),
+        batch_df.nAA.values[0]
+    )
+
+def parse_mod_coo(
+    mods: Union[List, np.ndarray],
+    mod_sites: Union[List, np.ndarray],
+)->Tuple[np.ndarray, np.ndarray, np.ndarray]:
     '''
+    Parse the `mods` and `mod_sites` strings of peptides into 
+    a sparse (COO-like) format. Mod names are mapped to 
+    integer ids (`MOD_TO_ID`) once for all unique names.
+
+    Parameters
+    ----------
+    mods : Union[List, np.ndarray]
+        ';'-separated mod names of each peptide
+
+    mod_sites : Union[List, np.ndarray]
+        ';'-separated mod sites of each peptide
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        np.ndarray: int64 offsets with length `len(mods)+1`, 
+        mods of peptide i are in `offsets[i]:offsets[i+1]`.
 
-    mod_features_list = batch_df.mods.str.split(';').apply(
-        lambda mod_names: [
-            MOD_TO_FEATURE[mod] for mod in mod_names
-            if len(mod)>0
-        ]
+        np.ndarray: int32 mod sites
+
+        np.ndarray: int32 mod ids, row indices of `get_mod_feature_table()`
+    '''
+    get_mod_feature_table()
+    if len(mods) == 0:
+        return (
+            np.zeros(1, dtype=np.int64), 
+            np.zeros(0, dtype=np.int32), 
+            np.zeros(0, dtype=np.int32)
+        )
+    mod_counts = pd.Series(mods, dtype=str).str.count(';').values+1
+    mod_names = np.array(';'.join(mods).split(';'))
+    site_strs = np.array(';'.join(mod_sites).split(';'))
+    valid = mod_names != ''
+    peptide_idxes = np.repeat(
+        np.arange(len(mod_counts)), mod_counts
+    )[valid]
+    unique_names, inverse = np.unique(
+        mod_names[valid], return_inverse=True
     )
-    mod_sites_list = batch_df.mod_sites.str.split(';').apply(
-        lambda mod_sites:[
-            int(site) for site in mod_sites
-            if len(site)>0
-        ]
+    mod_ids = np.array(
+        [MOD_TO_ID[mod] for mod in unique_names], dtype=np.int32
+    )[inverse]
+    offsets = np.zeros(len(mod_counts)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(
+        np.bincount(peptide_idxes, minlength=len(mod_counts))
     )
+    return offsets, site_strs[valid].astype(np.int32), mod_ids
+
+def mod_coo_to_dense(
+    offsets: np.ndarray,
+    mod_sites: np.ndarray,
+    mod_ids: np.ndarray,
+    nAA: int,
+    nAAs: np.ndarray = None,
+)->np.ndarray:
+    '''
+    Convert the mod COO of peptides (with the same nAA) 
+    from `parse_mod_coo()` into the dense mod feature array.
+    For peptides with different lengths, `nAAs` must be provided,
+    `nAA` is the max length and zeros are padded after each peptide.
+
+    Returns
+    -------
+    np.ndarray
+        3-D float32 array with shape (len(offsets)-1, nAA+2, mod_feature_size)
+    '''
     mod_x_batch = np.zeros(
-        (len(batch_df), batch_df.nAA.values[0]+2, mod_feature_size)
+        (len(offsets)-1, nAA+2, mod_feature_size), dtype=np.float32
+    )
+    if nAAs is None:
+        nAAs = np.full(len(offsets)-1, nAA, dtype=np.int32)
+    _scatter_add_mod_features(
+        mod_x_batch, offsets, mod_sites, mod_ids,
+        get_mod_feature_table(), nAAs
     )
-    for i, (mod_feats, mod_sites) in enumerate(
-        zip(mod_features_list, mod_sites_list)
-    ):
-        if len(mod_sites)>0:
-            for site, feat in zip(mod_sites, mod_feats):
-                # Process multiple mods on one site
-                mod_x_batch[i,site,:] += feat
-            # mod_x_batch[i,mod_sites,:] = mod_feats
     return mod_x_batch
 
+@numba.njit(nogil=True)
+def _scatter_add_mod_features(
+    mod_x_batch, offsets, mod_sites, mod_ids, mod_feature_table, nAAs
+):
+    for i in range(len(offsets)-1):
+        for j in range(offsets[i], offsets[i+1]):
+            site = mod_sites[j]
+            if site < 0: 
+                site += nAAs[i]+2
+            # Process multiple mods on one site
+            mod_x_batch[i,site,:] += mod_feature_table[mod_ids[j]]
+
 def get_batch_aa_indices(
     seq_array: Union[List, np.ndarray]
 )->np.ndarray:
@@ -178,3 +280,219 @@ def parse_instrument_indices(instrument_list):
         instrument_dict[inst] if inst in instrument_dict
         else unknown_inst_index for inst in instrument_list
     ]
+
+
+class PrecursorFeatureBatch(object):
+    """
+    Features of a mini batch of precursors, 
+    see :meth:`PrecursorFeatures.get_batch` and
+    :meth:`PrecursorFeatures.get_padded_batch`.
+    Features are sliced from (or built by) the buffers of 
+    `PrecursorFeatures` only when they are accessed.
+    """
+    def __init__(self, 
+        precursor_features, sorted_start:int, sorted_stop:int
+    ):
+        self._features:PrecursorFeatures = precursor_features
+        self._slice = slice(sorted_start, sorted_stop)
+        self.nAAs = precursor_features.sorted_nAA[self._slice]
+        self.nAA = self.nAAs[-1]
+        self.is_padded = self.nAAs[0] != self.nAA
+
+    @property
+    def aa_indices(self)->np.ndarray:
+        """int8 aa indices with shape (batch_size, nAA+2)"""
+        if not self.is_padded:
+            group_start = self._features._group_starts[self.nAA]
+            return self._features.get_group_aa_indices(self.nAA)[
+                self._slice.start-group_start:self._slice.stop-group_start
+            ]
+        aa_indices = np.zeros((len(self.nAAs), self.nAA+2), dtype=np.int8)
+        for nAA in np.unique(self.nAAs):
+            group_start = self._features._group_starts[nAA]
+            rows = np.nonzero(self.nAAs==nAA)[0]
+            aa_indices[rows,:nAA+2] = self._features.get_group_aa_indices(
+                nAA
+            )[self._slice.start+rows-group_start]
+        return aa_indices
+
+    @property
+    def attention_mask(self)->np.ndarray:
+        """int8 mask with shape (batch_size, nAA+2), 1 for non-padded positions"""
+        return (
+            np.arange(self.nAA+2)[None,:] < (self.nAAs+2)[:,None]
+        ).astype(np.int8)
+
+    @property
+    def mod_features(self)->np.ndarray:
+        """float32 mod features with shape (batch_size, nAA+2, mod_feature_size)"""
+        offsets, mod_sites, mod_ids = self._features.mod_coo
+        return mod_coo_to_dense(
+            offsets[self._slice.start:self._slice.stop+1],
+            mod_sites, mod_ids, self.nAA, self.nAAs
+        )
+
+    @property
+    def charges(self)->np.ndarray:
+        return self._features.charges[self._slice]
+
+    @property
+    def nces(self)->np.ndarray:
+        return self._features.nces[self._slice]
+
+    @property
+    def instrument_indices(self)->np.ndarray:
+        return self._features.instrument_indices[self._slice]
+
+class PrecursorFeatures(object):
+    """
+    Featurize a whole precursor_df once into compact numpy buffers, 
+    so that batches in `ModelInterface.predict()` are only slices of
+    these buffers. RT, CCS and MS2 models can share the same 
+    `PrecursorFeatures` object if they predict the same precursor_df.
+
+    Buffers are sorted by nAA (stable) to keep the same order as 
+    `precursor_df.groupby('nAA')`, and each buffer is built 
+    only when it is first used:
+
+    - aa indices: an int8 matrix for each nAA group
+    - mod_coo: see :func:`parse_mod_coo`
+    - charges, nces: float32 vectors
+    - instrument_indices: int64 vector
+    """
+    def __init__(self, precursor_df:pd.DataFrame):
+        """
+        Parameters
+        ----------
+        precursor_df : pd.DataFrame
+            precursor_df with 'nAA' column. 
+            Its rows must not be re-ordered after featurization.
+        """
+        self.precursor_df = precursor_df
+        self._index = precursor_df.index
+        self.nAA = precursor_df.nAA.values.astype(np.int32)
+        self._order = np.argsort(self.nAA, kind='stable')
+        self.sorted_nAA = self.nAA[self._order]
+        group_nAAs, group_starts, group_sizes = np.unique(
+            self.sorted_nAA, return_index=True, return_counts=True
+        )
+        self._group_starts = dict(zip(group_nAAs.tolist(), group_starts))
+        self._group_sizes = dict(zip(group_nAAs.tolist(), group_sizes))
+        self._group_aa_indices = {}
+        self._buffers = {}
+        self._column_values = {}
+
+    def __len__(self):
+        return len(self.nAA)
+
+    def is_valid_for(self, precursor_df:pd.DataFrame)->bool:
+        """
+        If the buffers can be used for `precursor_df`. 
+        As buffers are lazily built from `self.precursor_df`, 
+        `precursor_df` must be the same object with the same index 
+        object (re-ordering or resetting rows replaces the index), 
+        and the same nAA values. Other dataframes, even with 
+        the same lengths, need new `PrecursorFeatures`.
+        """
+        return (
+            precursor_df is self.precursor_df and
+            precursor_df.index is self._index and
+            'nAA' in precursor_df.columns and
+            len(precursor_df) == len(self.nAA) and
+            np.array_equal(precursor_df.nAA.values, self.nAA)
+        )
+
+    def load_column_values(self):
+        """
+        Take the numpy arrays of the featurized columns from `precursor_df`, 
+        so that buffers can be lazily built without accessing 
+        the dataframe, e.g. in the background thread 
+        of `ModelInterface.predict()`.
+        """
+        for column in [
+            'sequence', 'mods', 'mod_sites', 'charge', 'nce', 'instrument'
+        ]:
+            if column in self.precursor_df.columns:
+                self._column_values[column] = self.precursor_df[column].values
+
+    def get_batch(self, 
+        nAA:int, start:int, stop:int
+    )->PrecursorFeatureBatch:
+        """
+        Get the batch of `precursor_df.groupby('nAA')` 
+        group `nAA` at rows `start:stop`.
+        """
+        group_start = self._group_starts[nAA]
+        return PrecursorFeatureBatch(
+            self, group_start+start, group_start+stop
+        )
+
+    def get_padded_batch(self, 
+        sorted_start:int, sorted_stop:int
+    )->PrecursorFeatureBatch:
+        """
+        Get the batch at `sorted_start:sorted_stop` of precursors sorted 
+        by nAA, the rows are `precursor_df.iloc[self.get_sorted_rows(...)]`.
+        Shorter peptides in the batch are padded to the max nAA.
+        """
+        return PrecursorFeatureBatch(self, sorted_start, sorted_stop)
+
+    def get_sorted_rows(self, 
+        sorted_start:int, sorted_stop:int
+    )->np.ndarray:
+        """Row positions in precursor_df of the nAA-sorted batch"""
+        return self._order[sorted_start:sorted_stop]
+
+    def get_group_aa_indices(self, nAA:int)->np.ndarray:
+        if nAA not in self._group_aa_indices:
+            start = self._group_starts[nAA]
+            stop = start+self._group_sizes[nAA]
+            self._group_aa_indices[nAA] = get_batch_aa_indices(
+                self._sorted_values('sequence', start, stop).astype('U')
+            ).astype(np.int8)
+        return self._group_aa_indices[nAA]
+
+    @property
+    def mod_coo(self)->Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if 'mod_coo' not in self._buffers:
+            self._buffers['mod_coo'] = parse_mod_coo(
+                self._sorted_values('mods'),
+                self._sorted_values('mod_sites'),
+            )
+        return self._buffers['mod_coo']
+
+    @property
+    def charges(self)->np.ndarray:
+        return self._get_float_buffer('charge')
+
+    @property
+    def nces(self)->np.ndarray:
+        return self._get_float_buffer('nce')
+
+    @property
+    def instrument_indices(self)->np.ndarray:
+        if 'instrument' not in self._buffers:
+            instruments, inverse = np.unique(
+                self._sorted_values('instrument').astype('U'), 
+                return_inverse=True
+            )
+            self._buffers['instrument'] = np.array(
+                parse_instrument_indices(instruments), dtype=np.int64
+            )[inverse]
+        return self._buffers['instrument']
+
+    def _get_float_buffer(self, column:str)->np.ndarray:
+        if column not in self._buffers:
+            self._buffers[column] = self._sorted_values(
+                column
+            ).astype(np.float32)
+        return self._buffers[column]
+
+    def _sorted_values(self, 
+        column:str, start:int=0, stop:int=None
+    )->np.ndarray:
+        if column in self._column_values:
+            values = self._column_values[column]
+        else:
+            values = self.precursor_df[column].values
+        return values[self._order[start:stop]]
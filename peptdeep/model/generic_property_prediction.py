@@ -230,7 +230,7 @@ class ModelInterface_for_Generic_ModAASeq_Regression(ModelInterface):
         batch_df: pd.DataFrame,
         **kwargs,
     ):
-        return self._get_aa_mod_features(batch_df)
+        return self._get_aa_mod_features(batch_df, **kwargs)
 
 class Model_for_Generic_AASeq_BinaryClassification_LSTM(
     Model_for_Generic_AASeq_Regression_LSTM
@@ -406,8 +406,9 @@ class ModelInterface_for_Generic_ModAASeq_BinaryClassification(ModelInterface):
 
     def _get_features_from_batch_df(self, 
         batch_df: pd.DataFrame,
+        **kwargs,
     ):
-        return self._get_aa_mod_features(batch_df)
+        return self._get_aa_mod_features(batch_df, **kwargs)
 
 class ModelInterface_for_Generic_ModAASeq_MultiTargetClassification(
     ModelInterface_for_Generic_ModAASeq_BinaryClassification
@@ -440,18 +441,14 @@ class ModelInterface_for_Generic_ModAASeq_MultiTargetClassification(
             [0]*self.num_target_values
         ]*len(precursor_df)
         self.predict_df = precursor_df
+        self._predict_buffer = np.zeros(
+            (len(precursor_df), self.num_target_values), dtype=np.float32
+        )
 
-    def _set_batch_predict_data(self, batch_df, predict_values, **kwargs):
-        predict_values[predict_values<self._min_pred_value] = self._min_pred_value
-        if self._predict_in_order:
-            self.predict_df.loc[:,self.target_column_to_predict].values[
-                batch_df.index.values[0]:batch_df.index.values[-1]+1
-            ] = list(predict_values)
-        else:
-            # self.predict_df.loc[
-            #     batch_df.index,self.target_column_to_predict
-            # ] = [val.tolist() for val in predict_values]
-
-            # fail to assign list of list/ndarray by .loc, use for loop instead (slow)
-            for idx,val in zip(batch_df.index.values,predict_values):
-                self.predict_df.loc[idx,self.target_column_to_predict] = val
+    def _wrap_predict_buffers(self):
+        if self._predict_buffer is not None:
+            self.predict_df[self.target_column_to_predict] = list(
+                self._predict_buffer
+            )
+            self._predict_buffer = None
+        return self.predict_df
@@ -1,13 +1,19 @@
 import os
+import io
 import numpy as np
 import pandas as pd
 import torch
 import yaml
 import inspect
+import hashlib
+import itertools
+import weakref
 from tqdm import tqdm
 
 import torch.multiprocessing as mp
-import functools
+import threading
+import queue
+import contextlib
 
 from types import ModuleType
 
@@ -28,7 +34,8 @@ from peptdeep.settings import global_settings
 
 from peptdeep.model.featurize import (
     get_ascii_indices, get_batch_aa_indices,
-    get_batch_mod_feature
+    get_batch_mod_feature, parse_instrument_indices,
+    PrecursorFeatures, PrecursorFeatureBatch,
 )
 
 # def get_cosine_schedule_with_warmup(
@@ -63,6 +70,323 @@ def append_nAA_column_if_missing(precursor_df):
         precursor_df.reset_index(drop=True,inplace=True)
     return precursor_df
 
+def prefetch_batches(batch_generator, prefetch_num:int=2):
+    """
+    Run `batch_generator` in a background thread, so the next 
+    `prefetch_num` batches are built (featurized and copied to the device) 
+    while the caller is running the model on the current batch.
+    Exceptions in the background thread are re-raised in the caller.
+
+    Parameters
+    ----------
+    batch_generator : iterator
+        batch generator, e.g. yields (batch_df, features)
+
+    prefetch_num : int, optional
+        max number of batches in the queue. 
+        If <= 0, `batch_generator` runs in the caller thread.
+        Defaults to 2.
+
+    Yields
+    ------
+    Items from `batch_generator`
+    """
+    if prefetch_num <= 0:
+        yield from batch_generator
+        return
+
+    batch_queue = queue.Queue(maxsize=prefetch_num)
+    stop_event = threading.Event()
+    end_of_batches = object()
+
+    def _put(item)->bool:
+        while not stop_event.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce():
+        try:
+            for batch in batch_generator:
+                if not _put((batch, None)): return
+            _put((end_of_batches, None))
+        except BaseException as e:
+            _put((end_of_batches, e))
+
+    producer = threading.Thread(target=_produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            batch, error = batch_queue.get()
+            if batch is end_of_batches:
+                if error is not None: raise error
+                break
+            yield batch
+    finally:
+        stop_event.set()
+        producer.join()
+
+def get_token_budget_batches(
+    sorted_nAAs:np.ndarray, max_tokens:int
+)->np.ndarray:
+    """
+    Pack nAA-sorted precursors into batches of neighbouring lengths.
+    Each batch is padded to its max nAA, and the padded size 
+    `batch_size*(max_nAA+2)` of a batch is not larger than `max_tokens`
+    (unless one precursor already exceeds it).
+
+    Parameters
+    ----------
+    sorted_nAAs : np.ndarray
+        nAA values sorted in ascending order
+
+    max_tokens : int
+        token budget of a batch
+
+    Returns
+    -------
+    np.ndarray
+        int64 batch bounds, batch i is `bounds[i]:bounds[i+1]`
+    """
+    group_nAAs, group_sizes = np.unique(sorted_nAAs, return_counts=True)
+    bounds = [0]
+    stop = 0
+    for nAA, group_size in zip(group_nAAs, group_sizes):
+        batch_cap = max(max_tokens//(int(nAA)+2), 1)
+        remaining = int(group_size)
+        while remaining > 0:
+            if stop-bounds[-1] >= batch_cap:
+                bounds.append(stop)
+            n = min(remaining, batch_cap-(stop-bounds[-1]))
+            stop += n
+            remaining -= n
+    if stop > bounds[-1]:
+        bounds.append(stop)
+    return np.array(bounds, dtype=np.int64)
+
+def get_padding_overhead(
+    sorted_nAAs:np.ndarray, batch_bounds:np.ndarray
+)->float:
+    """
+    Ratio of padded tokens to all tokens of the batches 
+    from `get_token_budget_batches()`.
+    """
+    if len(sorted_nAAs) == 0: return 0.0
+    batch_sizes = np.diff(batch_bounds)
+    max_nAAs = sorted_nAAs[batch_bounds[1:]-1]
+    all_tokens = np.sum(batch_sizes*(max_nAAs+2))
+    return float(all_tokens-np.sum(sorted_nAAs+2))/all_tokens
+
+def get_nAA_batches(
+    sorted_nAAs:np.ndarray, batch_size:int
+)->np.ndarray:
+    """
+    Split nAA-sorted precursors into batches of the same nAA, 
+    each with at most `batch_size` precursors. The batches are the same 
+    as slicing each group of `precursor_df.groupby('nAA')` by `batch_size`.
+
+    Parameters
+    ----------
+    sorted_nAAs : np.ndarray
+        nAA values sorted in ascending order
+
+    batch_size : int
+        max batch size
+
+    Returns
+    -------
+    np.ndarray
+        int64 batch bounds, batch i is `bounds[i]:bounds[i+1]`
+    """
+    _, group_starts, group_sizes = np.unique(
+        sorted_nAAs, return_index=True, return_counts=True
+    )
+    return np.concatenate([
+        np.arange(start, start+size, batch_size)
+        for start, size in zip(group_starts, group_sizes)
+    ]+[[len(sorted_nAAs)]]).astype(np.int64)
+
+class DataFrameValues(object):
+    """
+    Numpy arrays of the index and columns of a dataframe. 
+    They are taken in the caller thread, so that batch dataframes 
+    can be built in the background thread of :func:`prefetch_batches` 
+    without accessing the dataframe, which may be changed 
+    by the caller thread at the same time.
+    """
+    def __init__(self, df:pd.DataFrame, excluded_columns:list=[]):
+        self.index = df.index.values
+        self.columns = dict(
+            (col, df[col].values) for col in df.columns
+            if col not in excluded_columns
+        )
+
+    def take(self, rows:np.ndarray)->pd.DataFrame:
+        """Dataframe of the given row positions"""
+        return pd.DataFrame(
+            dict((col, values[rows]) for col, values in self.columns.items()),
+            index=self.index[rows],
+        )
+
+def get_file_sha1(model_file:Union[str, bytes, IO])->str:
+    """
+    SHA1 hex digest of the content of a file path, 
+    bytes, or a binary file stream (read from the current position).
+    """
+    sha1 = hashlib.sha1()
+    if isinstance(model_file, (bytes, bytearray)):
+        sha1.update(model_file)
+    elif isinstance(model_file, str):
+        with open(model_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1<<20), b''):
+                sha1.update(chunk)
+    else:
+        for chunk in iter(lambda: model_file.read(1<<20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+# The object sent to the current worker process by `PersistentPool`
+_mp_worker_obj = None
+
+def _init_mp_worker(obj, torch_thread_num:int):
+    global _mp_worker_obj
+    _mp_worker_obj = obj
+    torch.set_num_threads(torch_thread_num)
+
+class _WeakWorkerObject(object):
+    """
+    Pickled as the referenced object, so that a pool sends the object 
+    to its workers without holding it (see :class:`PersistentPool`).
+    """
+    def __init__(self, obj):
+        self._ref = weakref.ref(obj)
+
+    def __reduce__(self):
+        return (_identity, (self._ref(),))
+
+def _identity(obj):
+    return obj
+
+def get_mp_worker_object():
+    """
+    Get the object (e.g. a ModelInterface or a ModelManager) 
+    sent to the current worker process of a :class:`PersistentPool`.
+    """
+    return _mp_worker_obj
+
+def get_simple_attr_state(obj, ignored_attrs:tuple=('training',))->tuple:
+    """
+    Sorted (name, value) of bool/int/float/str attributes of `obj`,
+    used to check if an object sent to :class:`PersistentPool` 
+    has been changed. Attributes in `ignored_attrs` are ignored.
+    """
+    return tuple(sorted(
+        (key, val) for key, val in vars(obj).items()
+        if isinstance(val, (bool, int, float, str))
+        and key not in ignored_attrs
+    ))
+
+class PersistentPool(object):
+    """
+    A `spawn` process pool which is lazily started and then 
+    reused across calls, so workers do not have to re-import packages 
+    and re-unpickle models for each call. The object passed to :meth:`get` 
+    is sent to each worker only once when the pool starts, and tasks 
+    get it by :func:`get_mp_worker_object`. Each worker uses 
+    `cpu_count//process_num` torch threads. 
+    The pool is restarted if `process_num` or `state` changes.
+    It is not pickled with its owner, and the workers are terminated 
+    when it is garbage collected (e.g. with its owner).
+    """
+    def __init__(self):
+        self._pool = None
+        self._state = None
+        self._obj = None
+        self._finalizer = None
+
+    def get(self, obj, process_num:int, state=None):
+        """
+        Parameters
+        ----------
+        obj : object
+            The object sent to workers
+
+        process_num : int
+            Number of worker processes
+
+        state : optional
+            Hashable state of `obj`, the pool is restarted 
+            if it differs from the state when the pool started.
+            Defaults to None
+
+        Returns
+        -------
+        multiprocessing.pool.Pool
+            The running pool
+        """
+        state = (process_num, state)
+        if self._pool is not None and state != self._state:
+            self.shutdown()
+        if self._pool is None:
+            torch_thread_num = max(1, (os.cpu_count() or 1)//process_num)
+            # The pool only keeps a weak reference of `obj`, 
+            # otherwise `obj` and this object are never collected 
+            # as the finalizer keeps the pool.
+            self._pool = mp.get_context('spawn').Pool(
+                process_num, initializer=_init_mp_worker,
+                initargs=(_WeakWorkerObject(obj), torch_thread_num),
+            )
+            self._state = state
+            # kept to restart workers which exit unexpectedly
+            self._obj = obj
+            self._finalizer = weakref.finalize(self, self._pool.terminate)
+        return self._pool
+
+    def shutdown(self):
+        """Wait for the workers to finish and stop them"""
+        if self._finalizer is not None:
+            self._finalizer.detach()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+        self._pool = None
+        self._state = None
+        self._obj = None
+        self._finalizer = None
+
+    def __getstate__(self):
+        return {
+            '_pool': None, '_state': None, 
+            '_obj': None, '_finalizer': None,
+        }
+
+def _predict_mp_batch(args):
+    """Task of `ModelInterface.predict_mp()`"""
+    batch_df, kwargs = args
+    return get_mp_worker_object().predict(batch_df, **kwargs)
+
+inference_precision_choices = ['fp32', 'fp16', 'bf16', 'int8-dynamic']
+
+# Unique versions of `ModelInterface.model` objects in this process
+_model_versions = itertools.count(1)
+
+train_precision_choices = ['fp32', 'fp16', 'bf16']
+
+# Attributes of `ModelInterface` which do not change predicted values 
+# (transient states, training and batching settings), 
+# they are not used by `ModelInterface.get_model_hash()`
+_model_hash_ignored_attrs = (
+    'training', '_model_version', '_quantized_model_version',
+    '_accumulated_batch_num', '_grad_accumulation_steps',
+    '_train_precision', '_compile_train_step',
+    '_predict_in_order', '_onnx_file', '_onnx_thread_num',
+    'prefetch_batch_num', 'max_tokens_per_batch',
+    '_device_type', '_target_column_to_train',
+)
+
 class ModelInterface(object):
     """
     Provides standardized methods to interact
@@ -95,6 +419,52 @@ class ModelInterface(object):
         self.set_device(device)
         self.fixed_sequence_len = fixed_sequence_len
         self.min_pred_value = min_pred_value
+        # Row positions in precursor_df of the batch in 
+        # `_set_batch_predict_data()`, set by `predict()`
+        self._batch_rows = None
+        # Predicted values of precursor_df rows, see `_prepare_predict_data_df()`
+        self._predict_buffer = None
+        # Number of batches prepared in the background 
+        # thread while the model is running, 0 to disable
+        self.prefetch_batch_num = 2
+        # Token budget (batch_size*(max_nAA+2)) to pack different 
+        # nAAs into padded batches in `predict()`, 0 to disable. 
+        # Only used if `self.supports_attention_mask`.
+        self.max_tokens_per_batch = 0
+        self._inference_precision = 'fp32'
+        self._inference_model = None
+        # int8 quantized copy of self.model, see `_get_inference_model()`
+        self._quantized_model = None
+        self._quantized_model_version = 0
+        self._onnx_session = None
+        # to re-open `_onnx_session` after unpickling, see `load_onnx()`
+        self._onnx_file = None
+        self._onnx_thread_num = None
+        # SHA1 of the loaded ONNX and TorchScript files for `get_model_hash()`
+        self._onnx_file_hash = None
+        self._torchscript_file_hash = None
+        self._train_precision = 'fp32'
+        self._grad_accumulation_steps = 1
+        self._compile_train_step = False
+        self._train_model = None
+        self._grad_scaler = None
+        self._accumulated_batch_num = 0
+        self._mp_pool = PersistentPool()
+
+    @property
+    def model(self)->torch.nn.Module:
+        """
+        The torch model. Each time it is replaced (e.g. by :meth:`build`,
+        :meth:`load_torchscript` or wrapped by `DataParallel`), 
+        it gets a new `_model_version`, which is unique in the process, 
+        to restart :meth:`predict_mp` workers.
+        """
+        return self._model
+
+    @model.setter
+    def model(self, model:torch.nn.Module):
+        self._model = model
+        self._model_version = next(_model_versions)
 
     @property
     def fixed_sequence_len(self)->int:
@@ -124,6 +494,172 @@ class ModelInterface(object):
         self._min_pred_value = val
         self.model_params['min_pred_value'] = val
 
+    @property
+    def inference_precision(self)->str:
+        """Read-only, see :meth:`set_inference_precision`"""
+        return self._inference_precision
+
+    def set_inference_precision(self, precision:str='fp32'):
+        """
+        Set the numerical precision used by `predict()`. 
+        Training always uses the float32 model.
+
+        - 'fp32': float32 (default)
+        - 'fp16' or 'bf16': run the forward pass under `torch.autocast`
+        - 'int8-dynamic': dynamically quantize `Linear` and `LSTM` layers 
+          to int8 with `torch.ao.quantization.quantize_dynamic`, only for cpu.
+          The quantized copy is made from the float32 model in the first 
+          `predict()`, and re-made after the model is loaded, trained 
+          or moved to another device. Call :meth:`clear_quantized_model` 
+          after changing the weights in other ways.
+
+        Parameters
+        ----------
+        precision : str, optional
+            One of `inference_precision_choices`. By default 'fp32'
+        """
+        if precision not in inference_precision_choices:
+            raise ValueError(
+                f"precision must be one of {inference_precision_choices}, "
+                f"got '{precision}'"
+            )
+        self._inference_precision = precision
+        self.clear_quantized_model()
+
+    def clear_quantized_model(self):
+        """Drop the cached int8 model, it will be re-quantized 
+        from the current weights in the next `predict()`"""
+        self._quantized_model = None
+        # restarts `predict_mp()` workers which hold their own int8 copies
+        self._quantized_model_version += 1
+
+    def _get_inference_model(self)->torch.nn.Module:
+        if self._inference_precision != 'int8-dynamic':
+            return self.model
+        if self._quantized_model is None:
+            self._quantized_model = self._quantize_model()
+        return self._quantized_model
+
+    def _quantize_model(self)->torch.nn.Module:
+        """Returns the int8 model, or `self.model` (with a warning) 
+        if it cannot be quantized"""
+        if self._onnx_session is not None:
+            logging.warning(
+                f"int8-dynamic inference does not work for ONNX models, "
+                f"{self.__class__.__name__} uses fp32"
+            )
+            return self.model
+        if self.device_type != 'cpu':
+            logging.warning(
+                f"int8-dynamic inference only works on cpu, "
+                f"{self.__class__.__name__} uses fp32 on {self.device_type}"
+            )
+            return self.model
+        if isinstance(self.model, torch.jit.ScriptModule):
+            logging.warning(
+                f"int8-dynamic inference does not work for TorchScript models, "
+                f"{self.__class__.__name__} uses fp32"
+            )
+            return self.model
+        return torch.ao.quantization.quantize_dynamic(
+            self.model, {torch.nn.Linear, torch.nn.LSTM}, 
+            dtype=torch.qint8, inplace=False,
+        )
+
+    def set_train_options(self,
+        precision:str='fp32',
+        grad_accumulation_steps:int=1,
+        compile_train_step:bool=False,
+    ):
+        """
+        Set the options used by `train()`.
+
+        Parameters
+        ----------
+        precision : str, optional
+            One of `train_precision_choices`. 'fp16' and 'bf16' run the 
+            forward pass under `torch.autocast` (automatic mixed precision), 
+            the loss is always calculated in float32. 'fp16' uses dynamic 
+            loss scaling by `torch.cuda.amp.GradScaler` and only works on cuda, 
+            it falls back to 'bf16' on other devices. By default 'fp32'
+
+        grad_accumulation_steps : int, optional
+            Accumulate gradients of this number of mini batches before 
+            each optimizer step, to emulate `batch_size*grad_accumulation_steps` 
+            with the memory of `batch_size`. By default 1
+
+        compile_train_step : bool, optional
+            If train with `torch.compile(self.model, dynamic=True)` 
+            (torch>=2.0). By default False
+        """
+        if precision not in train_precision_choices:
+            raise ValueError(
+                f"precision must be one of {train_precision_choices}, "
+                f"got '{precision}'"
+            )
+        if grad_accumulation_steps < 1:
+            raise ValueError(
+                f"grad_accumulation_steps must be >= 1, "
+                f"got {grad_accumulation_steps}"
+            )
+        self._train_precision = precision
+        self._grad_accumulation_steps = int(grad_accumulation_steps)
+        self._compile_train_step = compile_train_step
+
+    def _get_train_model(self)->torch.nn.Module:
+        if not self._compile_train_step:
+            return self.model
+        if not hasattr(torch, 'compile'):
+            logging.warning(
+                f"torch.compile requires torch>=2.0, "
+                f"{self.__class__.__name__} trains without compiling"
+            )
+            return self.model
+        if isinstance(self.model, torch.jit.ScriptModule):
+            return self.model
+        return torch.compile(self.model, dynamic=True)
+
+    def _train_autocast(self):
+        train_precision = getattr(self, '_train_precision', 'fp32')
+        if train_precision == 'fp16' and self.device_type == 'cuda':
+            return torch.autocast(self.device_type, dtype=torch.float16)
+        elif train_precision in ('fp16', 'bf16'):
+            return torch.autocast(self.device_type, dtype=torch.bfloat16)
+        else:
+            return contextlib.nullcontext()
+
+    def _inference_autocast(self):
+        if self._inference_precision == 'fp16':
+            return torch.autocast(self.device_type, dtype=torch.float16)
+        elif self._inference_precision == 'bf16':
+            return torch.autocast(self.device_type, dtype=torch.bfloat16)
+        else:
+            return contextlib.nullcontext()
+
+    @property
+    def supports_batch_features(self)->bool:
+        """Read-only. If `self._get_features_from_batch_df()` 
+        has `batch_features` (or `**kwargs`) argument"""
+        params = inspect.signature(
+            self._get_features_from_batch_df
+        ).parameters
+        return 'batch_features' in params or any(
+            param.kind == inspect.Parameter.VAR_KEYWORD 
+            for param in params.values()
+        )
+
+    @property
+    def supports_attention_mask(self)->bool:
+        """Read-only. If `self.model.forward()` has `attention_mask` argument"""
+        model = self.model
+        if isinstance(model, torch.nn.DataParallel):
+            model = model.module
+        if model is None or isinstance(model, torch.jit.ScriptModule):
+            return False
+        if self._onnx_session is not None:
+            return False
+        return 'attention_mask' in inspect.signature(model.forward).parameters
+
     @property
     def device_type(self)->str:
         """Read-only"""
@@ -194,6 +730,7 @@ class ModelInterface(object):
         but this may need more setups for models and optimizers.
         """
         if self.model is None: return
+        self.clear_quantized_model()
         if self.device_type != 'cuda':
             self.model.to(self.device)
         else:
@@ -260,6 +797,7 @@ class ModelInterface(object):
                 f'[Training] Epoch={epoch+1}, lr={lr_scheduler.get_last_lr()[0]}, loss={np.mean(batch_cost)}'
             )
         
+        self._train_model = None
         torch.cuda.empty_cache()
 
     def train(self,
@@ -310,6 +848,7 @@ class ModelInterface(object):
                     )
                 if verbose: print(f'[Training] Epoch={epoch+1}, Mean Loss={np.mean(batch_cost)}')
             
+            self._train_model = None
             torch.cuda.empty_cache()
 
     def predict(self,
@@ -317,46 +856,127 @@ class ModelInterface(object):
         *,
         batch_size:int=1024,
         verbose:bool=False,
+        precursor_features:PrecursorFeatures=None,
         **kwargs
     )->pd.DataFrame:
         """
         The model predicts the properties based on the inputs it has been trained for.
         Returns the ouput as a pandas dataframe.
+
+        If `self.fixed_sequence_len==0` and `self.supports_batch_features`,
+        features are sliced from `precursor_features` built once for 
+        the whole `precursor_df`. It will be re-built if 
+        `precursor_features` is None or does not match `precursor_df`.
         """
         precursor_df = append_nAA_column_if_missing(precursor_df)
         self._pad_zeros_if_fixed_len(precursor_df)
         self._check_predict_in_order(precursor_df)
+        self._predict_buffer = None
         self._prepare_predict_data_df(precursor_df,**kwargs)
         self.model.eval()
 
-        _grouped = precursor_df.groupby('nAA')
-        if verbose:
-            batch_tqdm = tqdm(_grouped)
+        if self.fixed_sequence_len != 0 or not self.supports_batch_features:
+            precursor_features = None
+        elif (
+            precursor_features is None or 
+            not precursor_features.is_valid_for(precursor_df)
+        ):
+            precursor_features = PrecursorFeatures(precursor_df)
+
+        # Batches are built in the background thread of `prefetch_batches()` 
+        # only from numpy arrays taken here, and predicted values are 
+        # written into numpy buffers, so `precursor_df` is only 
+        # accessed by this thread.
+        if precursor_features is not None:
+            precursor_features.load_column_values()
+        df_values = DataFrameValues(
+            precursor_df, [getattr(self, 'target_column_to_predict', None)]
+        )
+        sorted_rows = np.argsort(precursor_df.nAA.values, kind='stable')
+        sorted_nAAs = precursor_df.nAA.values[sorted_rows]
+
+        if (
+            precursor_features is not None and
+            self.max_tokens_per_batch > 0 and 
+            self.supports_attention_mask
+        ):
+            batch_bounds = get_token_budget_batches(
+                sorted_nAAs, self.max_tokens_per_batch
+            )
+            if verbose: logging.info(
+                f"Predicting {len(batch_bounds)-1} length-bucketed batches, "
+                f"padding overhead={get_padding_overhead(sorted_nAAs, batch_bounds)*100:.2f}%"
+            )
         else:
-            batch_tqdm = _grouped
-        with torch.no_grad():
-            for nAA, df_group in batch_tqdm:
-                for i in range(0, len(df_group), batch_size):
-                    batch_end = i+batch_size
-                    
-                    batch_df = df_group.iloc[i:batch_end,:]
-
-                    features = self._get_features_from_batch_df(
-                        batch_df, **kwargs
+            batch_bounds = get_nAA_batches(sorted_nAAs, batch_size)
+        batch_gen = prefetch_batches(
+            self._predict_batch_generator(
+                df_values, sorted_rows, batch_bounds, 
+                precursor_features, **kwargs
+            ), 
+            self.prefetch_batch_num
+        )
+        if verbose:
+            batch_gen = tqdm(batch_gen, total=len(batch_bounds)-1)
+        self._inference_model = self._get_inference_model()
+        with torch.no_grad(), self._inference_autocast():
+            for batch_rows, batch_df, features, attention_mask in batch_gen:
+                if not isinstance(features, tuple):
+                    features = (features,)
+                if attention_mask is None:
+                    predicts = self._predict_one_batch(*features)
+                else:
+                    predicts = self._predict_one_batch(
+                        *features, attention_mask=attention_mask
                     )
 
-                    if isinstance(features, tuple):
-                        predicts = self._predict_one_batch(*features)
-                    else:
-                        predicts = self._predict_one_batch(features)
-
-                    self._set_batch_predict_data(
-                        batch_df, predicts, 
-                        **kwargs
-                    )
+                self._batch_rows = batch_rows
+                self._set_batch_predict_data(
+                    batch_df, predicts, 
+                    **kwargs
+                )
 
+        self._batch_rows = None
+        self._inference_model = None
         torch.cuda.empty_cache()
-        return self.predict_df
+        return self._wrap_predict_buffers()
+
+    def _predict_batch_generator(self,
+        df_values:DataFrameValues,
+        sorted_rows:np.ndarray,
+        batch_bounds:np.ndarray,
+        precursor_features:PrecursorFeatures=None,
+        **kwargs
+    ):
+        """
+        Yields (batch_rows, batch_df, features, attention_mask) of 
+        each batch for `predict()`. Batch i has the precursors 
+        `sorted_rows[batch_bounds[i]:batch_bounds[i+1]]` 
+        (from `get_nAA_batches()` or `get_token_budget_batches()`), 
+        `attention_mask` is None unless the batch is padded.
+        """
+        for start, stop in zip(batch_bounds[:-1], batch_bounds[1:]):
+            batch_rows = sorted_rows[start:stop]
+            batch_df = df_values.take(batch_rows)
+            attention_mask = None
+            if precursor_features is None:
+                features = self._get_features_from_batch_df(
+                    batch_df, **kwargs
+                )
+            else:
+                # batch features are passed as arguments (not set 
+                # as attributes) as this runs in the prefetch thread
+                batch_features = precursor_features.get_padded_batch(
+                    start, stop
+                )
+                features = self._get_features_from_batch_df(
+                    batch_df, batch_features=batch_features, **kwargs
+                )
+                if batch_features.is_padded:
+                    attention_mask = self._as_tensor(
+                        batch_features.attention_mask
+                    )
+            yield batch_rows, batch_df, features, attention_mask
 
     def predict_mp(self,
         precursor_df:pd.DataFrame,
@@ -381,13 +1001,12 @@ class ModelInterface(object):
                 **kwargs
             )
             
-        _predict_func = functools.partial(self.predict, 
-            batch_size=batch_size, verbose=False, **kwargs
-        )
-
         def batch_df_gen(precursor_df, mp_batch_size):
             for i in range(0, len(precursor_df), mp_batch_size):
-                yield precursor_df.iloc[i:i+mp_batch_size]
+                yield (
+                    precursor_df.iloc[i:i+mp_batch_size],
+                    dict(batch_size=batch_size, verbose=False, **kwargs)
+                )
 
         self._check_predict_in_order(precursor_df)
         self._prepare_predict_data_df(precursor_df,**kwargs)
@@ -395,19 +1014,116 @@ class ModelInterface(object):
         print("Predicting with multiprocessing ...")
         self.model.share_memory()
         df_list = []
-        with mp.get_context('spawn').Pool(process_num) as p:
-            for ret_df in process_bar(p.imap(
-                    _predict_func,
-                    batch_df_gen(precursor_df, mp_batch_size),
-                ), len(precursor_df)//mp_batch_size+1
-            ):
-                df_list.append(ret_df)
+        p = self._mp_pool.get(self, process_num, self._get_mp_pool_state())
+        for ret_df in process_bar(p.imap(
+                _predict_mp_batch,
+                batch_df_gen(precursor_df, mp_batch_size),
+            ), len(precursor_df)//mp_batch_size+1
+        ):
+            df_list.append(ret_df)
 
         self.predict_df = pd.concat(df_list)
         self.predict_df.reset_index(drop=True, inplace=True)
         
         return self.predict_df
 
+    def get_model_hash(self)->str:
+        """
+        SHA1 hex digest of the model class, `model_params`, 
+        inference precision, the backend used by `predict()` 
+        (see :meth:`_get_predict_backend`), simple attributes 
+        of this object (e.g. `min_inten` of the MS2 model) 
+        and of `self.model`, and all model weights. It changes whenever 
+        the model is re-trained, fine-tuned or re-loaded with other weights,
+        prediction settings are changed,
+        or `predict()` switches to an ONNX or TorchScript file.
+        """
+        model = self.model
+        if isinstance(model, torch.nn.DataParallel):
+            model = model.module
+        sha1 = hashlib.sha1()
+        sha1.update(repr((
+            self.__class__.__name__,
+            sorted(self.model_params.items(), key=lambda x: str(x[0])),
+            self._inference_precision,
+            self._get_predict_backend(),
+            get_simple_attr_state(self, _model_hash_ignored_attrs),
+            get_simple_attr_state(model),
+        )).encode())
+        for name, value in model.state_dict().items():
+            sha1.update(name.encode())
+            if not torch.is_tensor(value):
+                # e.g. packed params of int8 quantized layers
+                value = torch.cat([
+                    v.int_repr().float().flatten() if v.is_quantized
+                    else v.float().flatten() for v in (
+                        value if isinstance(value, tuple) else (value,)
+                    ) if torch.is_tensor(v)
+                ] or [torch.zeros(0)])
+            elif value.is_quantized:
+                value = value.int_repr()
+            sha1.update(
+                value.detach().cpu().contiguous().view(-1)
+                .view(torch.uint8).numpy().tobytes()
+            )
+        return sha1.hexdigest()
+
+    def _get_predict_backend(self)->tuple:
+        """
+        (backend, SHA1 of the loaded file) of the model used by `predict()`,
+        backend is 'onnx', 'torchscript' or 'torch'.
+        """
+        if self._onnx_session is not None:
+            return ('onnx', self._onnx_file_hash)
+        if isinstance(self.model, torch.jit.ScriptModule):
+            return ('torchscript', self._torchscript_file_hash)
+        return ('torch', None)
+
+    def _get_mp_pool_state(self)->tuple:
+        """
+        Parameters are shared with workers by `share_memory()`, 
+        so the pool is only restarted if the model object is replaced 
+        (`_model_version`) or simple attributes have been changed.
+        `id(self.model)` is not used as it can be reused by a new model 
+        after the old one is garbage-collected.
+        """
+        ignored_attrs = ('_predict_in_order',)
+        if self._inference_precision != 'int8-dynamic':
+            ignored_attrs += ('_quantized_model_version',)
+        return (
+            self._model_version, 
+            get_simple_attr_state(self, ignored_attrs), 
+            get_simple_attr_state(self.model),
+        )
+
+    def __getstate__(self):
+        # workers quantize their own copies
+        state = self.__dict__.copy()
+        state['_quantized_model'] = None
+        # InferenceSession cannot be pickled, workers re-open `_onnx_file`
+        state['_onnx_session'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.__dict__.get('_onnx_file') is not None:
+            try:
+                self._onnx_session = self._open_onnx_session(
+                    self._onnx_file, self._onnx_thread_num
+                )
+            except Exception as e:
+                logging.warning(
+                    f"Failed to re-open ONNX model '{self._onnx_file}' ({e}), "
+                    f"{self.__class__.__name__} predicts with the python model"
+                )
+                self._onnx_file = None
+                self._onnx_thread_num = None
+                self._onnx_file_hash = None
+
+    def shutdown_mp_pool(self):
+        """Stop the worker pool of `predict_mp()`"""
+        self._mp_pool.shutdown()
+
     def save(self, filename:str):
         """
         Save the model state, the constants used, the code defining the model and the model parameters.
@@ -422,6 +1138,194 @@ class ModelInterface(object):
         self._save_codes(filename+'.model.py')
         save_yaml(filename+'.param.yaml', self.model_params)
 
+    def export_torchscript(self, 
+        filename:str, 
+        example_df:pd.DataFrame=None,
+    ):
+        """
+        Export the model as a traced TorchScript graph, which can be 
+        loaded by :meth:`load_torchscript` without building the python model.
+        Python attributes of the model (e.g. `_mask_modloss`) are fixed 
+        in the traced graph, and they are saved in the extra file 'attrs.yaml'.
+
+        Parameters
+        ----------
+        filename : str
+            TorchScript file, it is better to end with '.jit.pt', 
+            so that :meth:`load` can recognize it.
+
+        example_df : pd.DataFrame, optional
+            Precursors with the same nAA to trace the model. 
+            If None, a poly-A peptide is used.
+            Defaults to None.
+        """
+        model, features = self._get_example_features(example_df)
+        with torch.no_grad():
+            traced = torch.jit.trace(model, features)
+        module_attrs = set(vars(torch.nn.Module()))
+        attrs = dict(
+            (key, val) for key, val in vars(model).items()
+            if isinstance(val, (bool, int, float, str)) 
+            and key not in module_attrs
+        )
+        dir = os.path.dirname(filename)
+        if dir and not os.path.exists(dir): os.makedirs(dir)
+        torch.jit.save(traced, filename, _extra_files={
+            'param.yaml': yaml.dump(self.model_params),
+            'attrs.yaml': yaml.dump(attrs),
+        })
+
+    def _get_example_features(self, example_df:pd.DataFrame=None)->tuple:
+        """Get (eval-mode model, features of `example_df`) to trace the model"""
+        if example_df is None:
+            example_df = pd.DataFrame({
+                'sequence': ['AAAAAAAAAA']*2,
+                'mods': ['']*2, 'mod_sites': ['']*2,
+                'charge': [2, 3], 'nce': [30.0]*2,
+                'instrument': ['QE']*2,
+            })
+        example_df = append_nAA_column_if_missing(example_df.copy())
+        model = self.model
+        if isinstance(model, torch.nn.DataParallel):
+            model = model.module
+        model.eval()
+        features = self._get_features_from_batch_df(example_df)
+        if not isinstance(features, tuple):
+            features = (features,)
+        return model, features
+
+    def load_torchscript(self, model_file:Tuple[str, IO]):
+        """
+        Load the TorchScript model exported by :meth:`export_torchscript`
+        as `self.model`.
+        """
+        if isinstance(model_file, str):
+            self._torchscript_file_hash = get_file_sha1(model_file)
+        else:
+            model_bytes = model_file.read()
+            self._torchscript_file_hash = get_file_sha1(model_bytes)
+            model_file = io.BytesIO(model_bytes)
+        extra_files = {'param.yaml': '', 'attrs.yaml': ''}
+        self.model = torch.jit.load(
+            model_file, map_location=self.device, 
+            _extra_files=extra_files
+        )
+        if extra_files['param.yaml']:
+            self.model_params.update(yaml.load(
+                extra_files['param.yaml'], yaml.FullLoader
+            ))
+        if extra_files['attrs.yaml']:
+            for key, val in yaml.load(
+                extra_files['attrs.yaml'], yaml.FullLoader
+            ).items():
+                setattr(self.model, key, val)
+        self._model_to_device()
+
+    def export_onnx(self,
+        filename:str,
+        example_df:pd.DataFrame=None,
+        opset_version:int=14,
+    ):
+        """
+        Export the model as an ONNX graph for :meth:`load_onnx`.
+        The batch axis and the sequence axis (`nAA+2`) of the inputs 
+        are dynamic, and the inputs are named as 'input_0', 'input_1', ...
+        in the order of `_get_features_from_batch_df()`.
+        `attention_mask` is not exported.
+
+        Parameters
+        ----------
+        filename : str
+            ONNX file, usually ends with '.onnx'
+
+        example_df : pd.DataFrame, optional
+            See :meth:`export_torchscript`. Defaults to None.
+
+        opset_version : int, optional
+            ONNX opset version. Defaults to 14.
+        """
+        model, features = self._get_example_features(example_df)
+        seq_len = features[0].size(1)
+        input_names = [f'input_{i}' for i in range(len(features))]
+        dynamic_axes = {}
+        for name, x in zip(input_names, features):
+            if x.dim() > 1 and x.size(1) == seq_len:
+                dynamic_axes[name] = {0: 'batch', 1: 'seq'}
+            else:
+                dynamic_axes[name] = {0: 'batch'}
+        with torch.no_grad():
+            output = model(*features)
+        if output.dim() > 1:
+            # e.g. fragment intensities (batch, nAA-1, frag_types)
+            dynamic_axes['output'] = {0: 'batch', 1: 'seq'}
+        else:
+            dynamic_axes['output'] = {0: 'batch'}
+        dir = os.path.dirname(filename)
+        if dir and not os.path.exists(dir): os.makedirs(dir)
+        with torch.no_grad():
+            torch.onnx.export(
+                model, features, filename,
+                input_names=input_names, 
+                output_names=['output'],
+                dynamic_axes=dynamic_axes,
+                opset_version=opset_version,
+            )
+
+    def load_onnx(self, 
+        filename:str, 
+        thread_num:int=None,
+    ):
+        """
+        Load the ONNX graph exported by :meth:`export_onnx` into an 
+        onnxruntime `InferenceSession` (CPUExecutionProvider), 
+        which will be used by `predict()` instead of `self.model`.
+        `self.model` is kept for training and for python attributes,
+        call :meth:`unload_onnx` to predict with `self.model` again.
+        The session cannot be pickled, worker processes of 
+        :meth:`predict_mp` re-open `filename` when they start.
+
+        Parameters
+        ----------
+        filename : str
+            ONNX file
+
+        thread_num : int, optional
+            intra-op thread number of onnxruntime, 
+            None to use the onnxruntime default. Defaults to None.
+        """
+        self._onnx_session = self._open_onnx_session(filename, thread_num)
+        self._onnx_file = filename
+        self._onnx_thread_num = thread_num
+        self._onnx_file_hash = get_file_sha1(filename)
+        self.clear_quantized_model()
+
+    def _open_onnx_session(self, filename:str, thread_num:int=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError(
+                "ONNX inference requires onnxruntime, "
+                "install it by `pip install \"peptdeep[onnx]\"`"
+            )
+        sess_options = onnxruntime.SessionOptions()
+        sess_options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if thread_num:
+            sess_options.intra_op_num_threads = thread_num
+        return onnxruntime.InferenceSession(
+            filename, sess_options, 
+            providers=['CPUExecutionProvider'],
+        )
+
+    def unload_onnx(self):
+        """Predict with `self.model` instead of the ONNX session"""
+        self._onnx_session = None
+        self._onnx_file = None
+        self._onnx_thread_num = None
+        self._onnx_file_hash = None
+        self.clear_quantized_model()
+
     def load(
         self,
         model_file: Tuple[str, IO],
@@ -430,11 +1334,14 @@ class ModelInterface(object):
     ):
         """
         Load a model specified in a zip file, a text file or a file stream.
+        TorchScript files ending with '.jit.pt' are loaded by :meth:`load_torchscript`.
         """
         # TODO load tf.keras.Model
         if isinstance(model_file, str):
+            if model_file.lower().endswith('.jit.pt'):
+                self.load_torchscript(model_file)
             # We may release all models (msms, rt, ccs, ...) in a single zip file
-            if model_file.lower().endswith('.zip'):
+            elif model_file.lower().endswith('.zip'):
                 self._load_model_from_zipfile(model_file, model_path_in_zip)
             else:
                 self._load_model_from_pytorchfile(model_file)
@@ -492,6 +1399,7 @@ class ModelInterface(object):
         self.model = _module.Model(**kwargs)
         self.model_params = kwargs
         self.model.to(self.device)
+        self.clear_quantized_model()
         self._init_for_training()
 
     def _init_for_training(self):
@@ -506,7 +1414,8 @@ class ModelInterface(object):
         dtype:torch.dtype=torch.float32
     )->torch.Tensor:
         """Convert numerical np.array to pytorch tensor.
-        The tensor will be stored in self.device
+        The tensor will be stored in self.device.
+        For cuda, the data is copied via pinned memory without blocking.
 
         Parameters
         ----------
@@ -522,6 +1431,12 @@ class ModelInterface(object):
         torch.Tensor
             The tensor stored in self.device
         """
+        if self.device_type == 'cuda':
+            # Pinned memory (cached and reused by torch) 
+            # allows asynchronous host-to-device copy
+            return torch.as_tensor(
+                np.asarray(data), dtype=dtype
+            ).pin_memory().to(self.device, non_blocking=True)
         return torch.tensor(data, dtype=dtype, device=self.device)
 
     def _load_model_from_zipfile(self, model_file, model_path_in_zip):
@@ -534,6 +1449,7 @@ class ModelInterface(object):
             self._load_model_from_stream(pt_file)
 
     def _load_model_from_stream(self, stream):
+        self.clear_quantized_model()
         (
             missing_keys, unexpect_keys 
         ) = self.model.load_state_dict(torch.load(
@@ -557,6 +1473,31 @@ class ModelInterface(object):
         except (TypeError, ValueError, KeyError) as e:
             logging.info(f'Cannot save model source codes: {str(e)}')
 
+    def _train_batch_generator(self, batch_df_gen, **kwargs):
+        """Yields (targets, features) of each batch_df in `batch_df_gen`"""
+        for batch_df in batch_df_gen:
+            targets = self._get_targets_from_batch_df(
+                batch_df, **kwargs
+            )
+            features = self._get_features_from_batch_df(
+                batch_df, **kwargs
+            )
+            yield targets, features
+
+    def _train_batches(self, batch_df_gen, **kwargs):
+        """Yields the cost of each batch in `batch_df_gen`, 
+        next batches are prepared in background while training.
+        Gradients left by the last accumulation steps are applied at the end."""
+        for targets, features in prefetch_batches(
+            self._train_batch_generator(batch_df_gen, **kwargs),
+            self.prefetch_batch_num
+        ):
+            if isinstance(features, tuple):
+                yield self._train_one_batch(targets, *features)
+            else:
+                yield self._train_one_batch(targets, features)
+        self._optimizer_step()
+
     def _train_one_epoch_by_padding_zeros(self, 
         precursor_df, epoch, batch_size, verbose_each_epoch, 
         **kwargs
@@ -564,28 +1505,19 @@ class ModelInterface(object):
         """Training for an epoch by padding zeros"""
         batch_cost = []
         rnd_df = precursor_df.sample(frac=1)
+        batch_df_gen = (
+            rnd_df.iloc[i:i+batch_size,:] 
+            for i in range(0, len(rnd_df), batch_size)
+        )
         if verbose_each_epoch:
-            batch_tqdm = tqdm(range(0, len(rnd_df), batch_size))
-        else:
-            batch_tqdm = range(0, len(rnd_df), batch_size)
-        for i in batch_tqdm:
-            batch_end = i+batch_size
-
-            batch_df = rnd_df.iloc[i:batch_end,:]
-            targets = self._get_targets_from_batch_df(
-                batch_df, **kwargs
-            )
-            features = self._get_features_from_batch_df(
-                batch_df, **kwargs
+            batch_tqdm = tqdm(
+                self._train_batches(batch_df_gen, **kwargs),
+                total=(len(rnd_df)+batch_size-1)//batch_size
             )
-            if isinstance(features, tuple):
-                batch_cost.append(
-                    self._train_one_batch(targets, *features)
-                )
-            else:
-                batch_cost.append(
-                    self._train_one_batch(targets, features)
-                )
+        else:
+            batch_tqdm = self._train_batches(batch_df_gen, **kwargs)
+        for cost in batch_tqdm:
+            batch_cost.append(cost)
                 
         if verbose_each_epoch:
             batch_tqdm.set_description(
@@ -601,35 +1533,28 @@ class ModelInterface(object):
         batch_cost = []
         _grouped = list(precursor_df.sample(frac=1).groupby('nAA'))
         rnd_nAA = np.random.permutation(len(_grouped))
+
+        def batch_df_gen():
+            for i_group in rnd_nAA:
+                nAA, df_group = _grouped[i_group]
+                for i in range(0, len(df_group), batch_size):
+                    yield df_group.iloc[i:i+batch_size,:]
+
         if verbose_each_epoch:
-            batch_tqdm = tqdm(rnd_nAA)
-        else:
-            batch_tqdm = rnd_nAA
-        for i_group in batch_tqdm:
-            nAA, df_group = _grouped[i_group]
-            # df_group = df_group.reset_index(drop=True)
-            for i in range(0, len(df_group), batch_size):
-                batch_end = i+batch_size
-
-                batch_df = df_group.iloc[i:batch_end,:]
-                targets = self._get_targets_from_batch_df(
-                    batch_df, **kwargs
-                )
-                features = self._get_features_from_batch_df(
-                    batch_df, **kwargs
+            batch_tqdm = tqdm(
+                self._train_batches(batch_df_gen(), **kwargs),
+                total=sum(
+                    (len(df_group)+batch_size-1)//batch_size 
+                    for _, df_group in _grouped
                 )
-                if isinstance(features, tuple):
-                    batch_cost.append(
-                        self._train_one_batch(targets, *features)
-                    )
-                else:
-                    batch_cost.append(
-                        self._train_one_batch(targets, features)
-                    )
-                
+            )
+        else:
+            batch_tqdm = self._train_batches(batch_df_gen(), **kwargs)
+        for cost in batch_tqdm:
+            batch_cost.append(cost)
             if verbose_each_epoch:
                 batch_tqdm.set_description(
-                    f'Epoch={epoch+1}, nAA={nAA}, batch={len(batch_cost)}, loss={batch_cost[-1]:.4f}'
+                    f'Epoch={epoch+1}, batch={len(batch_cost)}, loss={batch_cost[-1]:.4f}'
                 )
         return batch_cost
 
@@ -638,22 +1563,63 @@ class ModelInterface(object):
         targets:torch.Tensor, 
         *features,
     ):
-        """Training for a mini batch"""
-        self.optimizer.zero_grad()
-        predicts = self.model(*features)
-        cost = self.loss_func(predicts, targets)
-        cost.backward()
-        torch.nn.utils.clip_grad_norm_(self.model.parameters(), 1.0)
-        self.optimizer.step()
+        """Training for a mini batch, the optimizer steps 
+        every `grad_accumulation_steps` batches"""
+        train_model = getattr(self, '_train_model', None)
+        if train_model is None:
+            # `_prepare_training()` was not called, e.g. by subclasses
+            train_model = self.model
+        grad_accumulation_steps = getattr(
+            self, '_grad_accumulation_steps', 1
+        )
+        with self._train_autocast():
+            predicts = train_model(*features)
+        cost = self.loss_func(predicts.float(), targets)
+        self._get_grad_scaler().scale(
+            cost/grad_accumulation_steps
+        ).backward()
+        self._accumulated_batch_num = getattr(
+            self, '_accumulated_batch_num', 0
+        )+1
+        if self._accumulated_batch_num >= grad_accumulation_steps:
+            self._optimizer_step()
         return cost.item()
 
+    def _get_grad_scaler(self):
+        """`_grad_scaler` set by `_prepare_training()`, 
+        or a disabled (pass-through) GradScaler if it is not set"""
+        if getattr(self, '_grad_scaler', None) is None:
+            self._grad_scaler = torch.cuda.amp.GradScaler(enabled=False)
+        return self._grad_scaler
+
+    def _optimizer_step(self):
+        """Clip and apply the accumulated gradients"""
+        if getattr(self, '_accumulated_batch_num', 0) == 0: return
+        grad_scaler = self._get_grad_scaler()
+        grad_scaler.unscale_(self.optimizer)
+        torch.nn.utils.clip_grad_norm_(self.model.parameters(), 1.0)
+        grad_scaler.step(self.optimizer)
+        grad_scaler.update()
+        self.optimizer.zero_grad()
+        self._accumulated_batch_num = 0
+
     def _predict_one_batch(self,
-        *features
+        *features, **kwargs
     ):
         """Predicting for a mini batch"""
-        return self.model(
-            *features
-        ).cpu().detach().numpy()
+        if self._onnx_session is not None:
+            input_names = set(
+                _input.name for _input in self._onnx_session.get_inputs()
+            )
+            return self._onnx_session.run(None, dict(
+                (f'input_{i}', x.cpu().numpy()) 
+                for i, x in enumerate(features) 
+                if f'input_{i}' in input_names
+            ))[0].astype(np.float32)
+        model = self.model if self._inference_model is None else self._inference_model
+        return model(
+            *features, **kwargs
+        ).float().cpu().detach().numpy()
 
     def _get_targets_from_batch_df(self,
         batch_df:pd.DataFrame, **kwargs,
@@ -712,12 +1678,17 @@ class ModelInterface(object):
         )
 
     def _get_26aa_indice_features(
-        self, batch_df:pd.DataFrame
+        self, batch_df:pd.DataFrame, 
+        batch_features:PrecursorFeatureBatch=None,
     )->torch.LongTensor:
         """
         Get indices values for 26 upper-case letters (amino acids), 
         from 1 to 26. 0 is used for padding.
         """
+        if batch_features is not None:
+            return self._as_tensor(
+                batch_features.aa_indices, dtype=torch.long
+            )
         return self._as_tensor(
             get_batch_aa_indices(
                 batch_df['sequence'].values.astype('U')
@@ -739,6 +1710,11 @@ class ModelInterface(object):
         batch_df : pd.DataFrame
             Batch of precursor dataframe.
 
+        batch_features : PrecursorFeatureBatch, optional
+            Pre-computed features of `batch_df` from `predict()`,
+            which should be passed to the `self._get_*_features()`
+            methods if the sub-class accepts this argument.
+
         Returns
         -------
         Union[torch.LongTensor, Tuple[torch.Tensor]]: 
@@ -748,19 +1724,24 @@ class ModelInterface(object):
         return self._get_aa_features(batch_df)
 
     def _get_aa_mod_features(self,
-        batch_df:pd.DataFrame, **kwargs,
+        batch_df:pd.DataFrame, 
+        batch_features:PrecursorFeatureBatch=None,
+        **kwargs,
     )->Tuple[torch.Tensor]:
         return (
             self._get_aa_features(batch_df),
-            self._get_mod_features(batch_df)
+            self._get_mod_features(batch_df, batch_features)
         )
 
     def _get_mod_features(
-        self, batch_df:pd.DataFrame
+        self, batch_df:pd.DataFrame, 
+        batch_features:PrecursorFeatureBatch=None,
     )->torch.Tensor:
         """
         Get modification features.
         """
+        if batch_features is not None:
+            return self._as_tensor(batch_features.mod_features)
         if self.fixed_sequence_len < 0:
             batch_df = batch_df.copy()
             batch_df['nAA'] = batch_df.nAA.max()
@@ -768,6 +1749,47 @@ class ModelInterface(object):
             get_batch_mod_feature(batch_df)
         )
 
+    def _get_charge_features(self, 
+        batch_df:pd.DataFrame, 
+        batch_features:PrecursorFeatureBatch=None,
+    )->torch.Tensor:
+        """
+        Get charges with shape (batch_size, 1)
+        """
+        if batch_features is not None:
+            charges = batch_features.charges
+        else:
+            charges = batch_df['charge'].values
+        return self._as_tensor(charges).unsqueeze(1)
+
+    def _get_nce_features(self, 
+        batch_df:pd.DataFrame, 
+        batch_features:PrecursorFeatureBatch=None,
+    )->torch.Tensor:
+        """
+        Get NCEs with shape (batch_size, 1)
+        """
+        if batch_features is not None:
+            nces = batch_features.nces
+        else:
+            nces = batch_df['nce'].values
+        return self._as_tensor(nces).unsqueeze(1)
+
+    def _get_instrument_features(self, 
+        batch_df:pd.DataFrame, 
+        batch_features:PrecursorFeatureBatch=None,
+    )->torch.LongTensor:
+        """
+        Get instrument indices
+        """
+        if batch_features is not None:
+            instrument_indices = batch_features.instrument_indices
+        else:
+            instrument_indices = parse_instrument_indices(
+                batch_df['instrument']
+            )
+        return self._as_tensor(instrument_indices, dtype=torch.long)
+
     def _get_aa_features(self, 
         batch_df:pd.DataFrame
     )->torch.LongTensor:
@@ -787,9 +1809,12 @@ class ModelInterface(object):
         This methods fills 0s in the column of 
         `self.target_column_to_predict` in `precursor_df`,
         and then does `self.predict_df=precursor_df`.
+        Predicted values are written into `self._predict_buffer`, 
+        which is assigned to the column by `_wrap_predict_buffers()`.
         """
         precursor_df[self.target_column_to_predict] = 0.0
         self.predict_df = precursor_df
+        self._predict_buffer = np.zeros(len(precursor_df))
 
     def _prepare_train_data_df(self,
         precursor_df:pd.DataFrame, 
@@ -809,7 +1834,9 @@ class ModelInterface(object):
         predict_values:np.ndarray,
         **kwargs
     ):
-        """Set predicted values into `self.predict_df`.
+        """Set predicted values of the rows `self._batch_rows` 
+        into `self._predict_buffer`, or into `self.predict_df` 
+        if `_prepare_predict_data_df()` does not make the buffer.
 
         Parameters
         ----------
@@ -820,7 +1847,9 @@ class ModelInterface(object):
             Predicted values
         """
         predict_values[predict_values<self._min_pred_value] = self._min_pred_value
-        if self._predict_in_order:
+        if self._predict_buffer is not None:
+            self._predict_buffer[self._batch_rows] = predict_values
+        elif self._predict_in_order:
             self.predict_df.loc[:,self.target_column_to_predict].values[
                 batch_df.index.values[0]:batch_df.index.values[-1]+1
             ] = predict_values
@@ -829,6 +1858,14 @@ class ModelInterface(object):
                 batch_df.index,self.target_column_to_predict
             ] = predict_values
 
+    def _wrap_predict_buffers(self)->pd.DataFrame:
+        """Assign `self._predict_buffer` to `self.predict_df` 
+        after prediction, and return `self.predict_df`"""
+        if self._predict_buffer is not None:
+            self.predict_df[self.target_column_to_predict] = self._predict_buffer
+            self._predict_buffer = None
+        return self.predict_df
+
     def _set_optimizer(self, lr):
         """Set optimizer"""
         self.optimizer = torch.optim.Adam(
@@ -871,8 +1908,18 @@ class ModelInterface(object):
         self._pad_zeros_if_fixed_len(precursor_df)
         self._prepare_train_data_df(precursor_df, **kwargs)
         self.model.train()
+        self.clear_quantized_model()
 
         self.set_lr(lr)
+        self.optimizer.zero_grad()
+        self._accumulated_batch_num = 0
+        self._train_model = self._get_train_model()
+        self._grad_scaler = torch.cuda.amp.GradScaler(
+            enabled=(
+                self._train_precision == 'fp16' 
+                and self.device_type == 'cuda'
+            )
+        )
 
     def _check_predict_in_order(self, precursor_df:pd.DataFrame):
         if is_precursor_sorted(precursor_df):
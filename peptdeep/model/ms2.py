@@ -8,8 +8,6 @@ from typing import List, Tuple, IO
 from tqdm import tqdm
 
 from alphabase.peptide.fragment import (
-    init_fragment_by_precursor_dataframe, 
-    update_sliced_fragment_dataframe, 
     get_sliced_fragment_dataframe, 
     get_charged_frag_types
 )
@@ -18,7 +16,7 @@ from peptdeep.utils import get_available_device
 
 from peptdeep.model.featurize import (
     get_batch_aa_indices, parse_instrument_indices, 
-    get_batch_mod_feature
+    get_batch_mod_feature, PrecursorFeatureBatch,
 )
 
 from peptdeep.settings import (
@@ -208,6 +206,7 @@ class ModelMS2Bert(torch.nn.Module):
         charges:torch.Tensor,
         NCEs:torch.Tensor,
         instrument_indices,
+        attention_mask:torch.Tensor=None,
     ):
 
         in_x = self.dropout(self.input_nn(
@@ -218,7 +217,7 @@ class ModelMS2Bert(torch.nn.Module):
         ).unsqueeze(1).repeat(1,in_x.size(1),1)
         in_x = torch.cat((in_x, meta_x),2)
 
-        hidden_x = self.hidden_nn(in_x)
+        hidden_x = self.hidden_nn(in_x, attention_mask)
         if self.output_attentions:
             self.attentions = hidden_x[1]
         else:
@@ -238,7 +237,7 @@ class ModelMS2Bert(torch.nn.Module):
                 )), 2)
             else:
                 modloss_x = self.modloss_nn[0](
-                    in_x
+                    in_x, attention_mask
                 )
                 if self.output_attentions:
                     self.modloss_attentions = modloss_x[-1]
@@ -412,10 +411,15 @@ class pDeepModel(model_interface.ModelInterface):
     def _check_predict_in_order(self, precursor_df: pd.DataFrame):
         pass
 
-    def _prepare_predict_data_df(self,
+    def _set_frag_idxes_to_predict(self,
         precursor_df:pd.DataFrame,
         reference_frag_df:pd.DataFrame=None,
-    ):
+    )->int:
+        """
+        Set `self._predict_in_order`, and make sure `precursor_df` has 
+        `frag_start_idx` and `frag_stop_idx` pointing to the predicted 
+        fragment rows. Returns the number of fragment rows.
+        """
         if reference_frag_df is None and precursor_df.nAA.is_monotonic_increasing:
             self._predict_in_order = True
             
@@ -426,35 +430,96 @@ class pDeepModel(model_interface.ModelInterface):
                 )
         else:
             self._predict_in_order = False
-        
-        self.predict_df = init_fragment_by_precursor_dataframe(
-            precursor_df, self.charged_frag_types, 
-            reference_fragment_df=reference_frag_df, 
-            dtype=np.float32
+
+        if 'frag_start_idx' in precursor_df.columns:
+            if reference_frag_df is not None:
+                return len(reference_frag_df)
+            return precursor_df.frag_stop_idx.max()
+        else:
+            # `reference_frag_df` is not used without 'frag_start_idx'
+            # in `precursor_df`, same as `init_fragment_by_precursor_dataframe`
+            frag_nums = precursor_df.nAA.values-1
+            precursor_df['frag_start_idx'] = np.cumsum(frag_nums)-frag_nums
+            precursor_df['frag_stop_idx'] = precursor_df.frag_start_idx.values+frag_nums
+            return frag_nums.sum()
+
+    def _prepare_predict_data_df(self,
+        precursor_df:pd.DataFrame,
+        reference_frag_df:pd.DataFrame=None,
+        frag_buffer_file:str=None,
+        frag_buffer:np.ndarray=None,
+        **kwargs,
+    ):
+        """
+        Preallocate flat fragment buffers which are written by 
+        `_set_batch_predict_data()` with numpy slices, and wrapped into
+        `self.predict_df` by `_wrap_predict_buffers()` after prediction.
+        """
+        frag_num = self._set_frag_idxes_to_predict(
+            precursor_df, reference_frag_df
         )
+        frag_buffer_shape = (int(frag_num), len(self.charged_frag_types))
+        if frag_buffer is not None:
+            if frag_buffer.shape != frag_buffer_shape:
+                raise ValueError(
+                    f"frag_buffer must be in shape {frag_buffer_shape}, "
+                    f"got {frag_buffer.shape}"
+                )
+            self._frag_inten_buffer = frag_buffer
+        elif frag_buffer_file:
+            # memory-mapped buffer for huge libraries
+            self._frag_inten_buffer = np.lib.format.open_memmap(
+                frag_buffer_file, mode='w+', 
+                dtype=np.float32, shape=frag_buffer_shape
+            )
+        else:
+            self._frag_inten_buffer = np.zeros(
+                frag_buffer_shape, dtype=np.float32
+            )
+        self._pep_ind_buffer = np.full(frag_buffer_shape[0], np.nan)
+        self._cleave_ind_buffer = np.full(frag_buffer_shape[0], np.nan)
+        self.predict_df = None
 
         # if np.all(precursor_df['nce'].values > 1):
         #     precursor_df['nce'] = precursor_df['nce']*self.NCE_factor
 
+    def _wrap_predict_buffers(self)->pd.DataFrame:
+        """Wrap the fragment buffers into `self.predict_df` 
+        without copying the intensity buffer"""
+        self.predict_df = pd.DataFrame(
+            self._frag_inten_buffer, 
+            columns=self.charged_frag_types,
+            copy=False
+        )
+        # TODO move this somewhere more appropriate?
+        self.predict_df.insert(0, 'pep_ind', self._pep_ind_buffer)
+        self.predict_df.insert(1, 'cleave_ind', self._cleave_ind_buffer)
+        del self._frag_inten_buffer
+        del self._pep_ind_buffer
+        del self._cleave_ind_buffer
+        return self.predict_df
+
     def _get_features_from_batch_df(self, 
         batch_df: pd.DataFrame, 
+        batch_features:PrecursorFeatureBatch=None,
         **kwargs,
     ) -> Tuple[torch.Tensor]:
-        aa_indices = self._get_26aa_indice_features(batch_df)
+        aa_indices = self._get_26aa_indice_features(
+            batch_df, batch_features
+        )
 
-        mod_x = self._get_mod_features(batch_df)
+        mod_x = self._get_mod_features(batch_df, batch_features)
 
-        charges = self._as_tensor(
-            batch_df['charge'].values
-        ).unsqueeze(1)*self.charge_factor
+        charges = self._get_charge_features(
+            batch_df, batch_features
+        )*self.charge_factor
 
-        nces = self._as_tensor(
-            batch_df['nce'].values
-        ).unsqueeze(1)*self.NCE_factor
+        nces = self._get_nce_features(
+            batch_df, batch_features
+        )*self.NCE_factor
 
-        instrument_indices = self._as_tensor(
-            parse_instrument_indices(batch_df['instrument']),
-            dtype=torch.long
+        instrument_indices = self._get_instrument_features(
+            batch_df, batch_features
         )
         return aa_indices, mod_x, charges, nces, instrument_indices
 
@@ -479,37 +544,40 @@ class pDeepModel(model_interface.ModelInterface):
         predicts:np.ndarray,
         **kwargs,
     ):
-        # TODO move this somewhere more appropriate?
-        if 'pep_ind' not in self.predict_df:
-            self.predict_df.insert(0, 'pep_ind', np.nan)
-        if 'cleave_ind' not in self.predict_df: 
-            self.predict_df.insert(1, 'cleave_ind', np.nan)
+        nAAs = batch_df.nAA.values
+        if nAAs[0] != nAAs[-1]:
+            # length-bucketed batch padded to the max nAA
+            valid_frags = (
+                np.arange(predicts.shape[1])[None,:] < (nAAs-1)[:,None]
+            )
+            predicts[~valid_frags] = 0.0
+        else:
+            valid_frags = None
 
         apex_intens = predicts.reshape((len(batch_df), -1)).max(axis=1)
         apex_intens[apex_intens<=0] = 1
         predicts /= apex_intens.reshape((-1,1,1))
         predicts[predicts<self.min_inten] = 0.0
+        if valid_frags is not None:
+            predicts = predicts[valid_frags]
+
+        frag_starts = batch_df.frag_start_idx.values.astype(np.int64)
+        frag_nums = batch_df.frag_stop_idx.values.astype(np.int64)-frag_starts
+        cleave_inds = np.arange(frag_nums.sum(), dtype=np.int64)-np.repeat(
+            np.cumsum(frag_nums)-frag_nums, frag_nums
+        )
         if self._predict_in_order:
-            self.predict_df.iloc[
-                batch_df.frag_start_idx.values[0]:
-                batch_df.frag_stop_idx.values[-1], 
-            2:] = predicts.reshape(
-                    (-1, len(self.charged_frag_types))
-                )
-            for i, row in batch_df.iterrows():
-                self.predict_df.iloc[row.frag_start_idx:row.frag_stop_idx, 0] = i
-                self.predict_df.iloc[row.frag_start_idx:row.frag_stop_idx, 1] = list(range(1, (row.frag_stop_idx-row.frag_start_idx)+1))
-            
+            frag_idxes = slice(frag_starts[0], frag_starts[0]+len(cleave_inds))
         else:
-            update_sliced_fragment_dataframe(
-                self.predict_df,
-                predicts.reshape(
-                    (-1, len(self.charged_frag_types))
-                ),
-                batch_df[
-                    ['frag_start_idx','frag_stop_idx']
-                ].values,
-            )
+            frag_idxes = np.repeat(frag_starts, frag_nums)+cleave_inds
+        
+        self._pep_ind_buffer[frag_idxes] = np.repeat(
+            batch_df.index.values, frag_nums
+        )
+        self._cleave_ind_buffer[frag_idxes] = cleave_inds+1
+        self._frag_inten_buffer[frag_idxes] = predicts.reshape(
+            (-1, len(self.charged_frag_types))
+        )
 
     def train_with_warmup(self,
         precursor_df: pd.DataFrame, 
@@ -565,13 +633,44 @@ class pDeepModel(model_interface.ModelInterface):
         batch_size=1024, 
         verbose=False, 
         reference_frag_df=None,
+        frag_buffer_file:str=None,
+        frag_buffer:np.ndarray=None,
         **kwargs
     ) -> pd.DataFrame:
+        """
+        Predict fragment intensities of `precursor_df`.
+
+        Parameters
+        ----------
+        reference_frag_df : pd.DataFrame, optional
+            If precursor_df has 'frag_start_idx' pointing to reference_frag_df. 
+            Defaults to None
+
+        frag_buffer_file : str, optional
+            If provided, predicted intensities are written into 
+            this memory-mapped .npy file instead of RAM, 
+            and the returned dataframe is backed by this file.
+            Defaults to None
+
+        frag_buffer : np.ndarray, optional
+            Preallocated float32 array of shape 
+            (fragment number, len(self.charged_frag_types)) to write 
+            the predicted intensities into, e.g. a shared-memory array. 
+            It has higher priority than `frag_buffer_file`.
+            Defaults to None
+
+        Returns
+        -------
+        pd.DataFrame
+            Predicted fragment intensity dataframe
+        """
         return super().predict(
             precursor_df, 
             batch_size=batch_size, 
             verbose=verbose, 
             reference_frag_df=reference_frag_df, 
+            frag_buffer_file=frag_buffer_file,
+            frag_buffer=frag_buffer,
             **kwargs
         )
 
@@ -4,7 +4,7 @@ import numpy as np
 
 from peptdeep.model.featurize import (
     get_batch_aa_indices, 
-    get_batch_mod_feature
+    get_batch_mod_feature, PrecursorFeatureBatch,
 )
 
 from peptdeep.settings import model_const
@@ -143,10 +143,11 @@ class AlphaRTModel(model_interface.ModelInterface):
 
     def _get_features_from_batch_df(self, 
         batch_df: pd.DataFrame,
+        batch_features:PrecursorFeatureBatch=None,
     ):
         return (
-            self._get_26aa_indice_features(batch_df),
-            self._get_mod_features(batch_df)
+            self._get_26aa_indice_features(batch_df, batch_features),
+            self._get_mod_features(batch_df, batch_features)
         )
 
     def add_irt_column_to_precursor_df(self,
@@ -270,12 +270,14 @@ def generate_library():
     lib_settings['infile_type'] # str. Input type for the library, could be 'fasta', 'sequence', 'peptide', or 'precursor'
     lib_settings['infiles'] # list of str. Input files to generate librarys
     lib_settings['output_tsv']['enabled'] # bool. If output tsv for diann/spectronaut
+    lib_settings['stream_chunk_size'] # int. If > 0, predict and save the library chunk by chunk
     ```
     Raises
     ------
     Exception
         Any kinds of exception if the pipeline fails.
     """
+    model_mgr = None
     try:
         lib_settings = global_settings['library']
         output_folder = os.path.expanduser(
@@ -299,39 +301,56 @@ def generate_library():
             model_manager=model_mgr
         )
         if lib_settings['infile_type'] == 'fasta':
-            lib_maker.make_library(lib_settings['infiles'])
+            lib_input = lib_settings['infiles']
         else:
             df_list = []
             for file_path in lib_settings['infiles']:
                 df_list.append(read_peptide_table(file_path))
-            df = pd.concat(df_list, ignore_index=True)
-            lib_maker.make_library(df)
+            lib_input = pd.concat(df_list, ignore_index=True)
         save_yaml(
             os.path.join(output_folder, 'peptdeep_settings.yaml'),
             global_settings
         )
-        
+
         hdf_path = os.path.join(
             output_folder, 
             'predict.speclib.hdf'
         )
-        logging.info(f"Saving HDF library to {hdf_path} ...")
-        lib_maker.spec_lib.save_hdf(hdf_path)
         if lib_settings['output_tsv']['enabled']:
             tsv_path = os.path.join(
                 output_folder, 
                 'predict.speclib.tsv'
             )
-            lib_maker.translate_to_tsv(
-                tsv_path, 
-                translate_mod_dict=mod_to_unimod_dict 
-                if lib_settings['output_tsv']['translate_mod_to_unimod_id'] 
-                else None
+        else:
+            tsv_path = None
+        translate_mod_dict = (
+            mod_to_unimod_dict 
+            if lib_settings['output_tsv']['translate_mod_to_unimod_id'] 
+            else None
+        )
+        if lib_settings['stream_chunk_size'] > 0:
+            lib_maker.make_library_stream(
+                lib_input, hdf_path, tsv_path,
+                chunk_size=lib_settings['stream_chunk_size'],
+                translate_mod_dict=translate_mod_dict,
             )
+        else:
+            lib_maker.make_library(lib_input)
+            logging.info(f"Saving HDF library to {hdf_path} ...")
+            lib_maker.spec_lib.save_hdf(hdf_path)
+            if tsv_path:
+                lib_maker.translate_to_tsv(
+                    tsv_path, 
+                    translate_mod_dict=translate_mod_dict
+                )
         logging.info("Library generated!!")
     except Exception as e:
         logging.error(traceback.format_exc())
         raise e
+    finally:
+        # stop the persistent worker pools, which hold model copies
+        if model_mgr is not None:
+            model_mgr.shutdown_mp_pool()
 
 def rescore():
     """Generate/predict a spectral library.
@@ -352,6 +371,7 @@ def rescore():
     Exception
         Any kinds of exception if the pipeline fails.
     """
+    model_mgr = None
     try:
         perc_settings = global_settings['percolator']
         output_folder = os.path.expanduser(
@@ -400,5 +420,8 @@ def rescore():
     except Exception as e:
         logging.error(traceback.format_exc())
         raise e
+    finally:
+        if model_mgr is not None:
+            model_mgr.shutdown_mp_pool()
 
 
@@ -2,14 +2,17 @@ import os
 import pathlib
 import io
 import pandas as pd
+import numpy as np
 import torch
 import urllib
 import socket
 import logging
 import shutil
 import ssl
+import copy
+import sqlite3
+import time
 from pickle import UnpicklingError
-import torch.multiprocessing as mp
 from typing import Dict
 from zipfile import ZipFile
 from tarfile import TarFile
@@ -39,6 +42,11 @@ from peptdeep.model.ms2 import (
 )
 from peptdeep.model.rt import AlphaRTModel
 from peptdeep.model.ccs import AlphaCCSModel
+from peptdeep.model.featurize import PrecursorFeatures
+from peptdeep.model.model_interface import (
+    PersistentPool, get_mp_worker_object, get_simple_attr_state,
+    append_nAA_column_if_missing, ModelInterface
+)
 from peptdeep.utils import (
     uniform_sampling, evaluate_linear_regression
 )
@@ -228,6 +236,250 @@ def clear_error_modloss_intensities(
                 fragment_mz_df[col]==0,col
             ] = 0
 
+def _to_shared_tensor(values:np.ndarray)->Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Copy a numeric or string array into shared-memory tensors, 
+    which are sent to worker processes as handles instead of pickled data.
+    Strings are stored as one flat utf-8 byte buffer (uint8 tensor) 
+    and int64 offsets of length `len(values)+1`, offsets are None 
+    for numeric arrays.
+    """
+    if values.dtype.kind not in 'OUS':
+        return torch.from_numpy(
+            np.ascontiguousarray(values)
+        ).share_memory_(), None
+    joined = ''.join(map(str, values))
+    if joined.isascii():
+        lengths = np.fromiter(
+            map(len, map(str, values)), dtype=np.int64, count=len(values)
+        )
+    else:
+        lengths = np.fromiter(
+            (len(str(s).encode('utf-8')) for s in values), 
+            dtype=np.int64, count=len(values)
+        )
+    offsets = np.zeros(len(values)+1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    data = torch.frombuffer(
+        bytearray(joined, 'utf-8'), dtype=torch.uint8
+    ) if offsets[-1] > 0 else torch.zeros(0, dtype=torch.uint8)
+    return data.share_memory_(), torch.from_numpy(offsets).share_memory_()
+
+def _from_shared_tensor(
+    data:torch.Tensor, offsets:torch.Tensor, start:int, stop:int
+)->np.ndarray:
+    """Copy values `start:stop` from `_to_shared_tensor()`"""
+    if offsets is None:
+        return data[start:stop].numpy().copy()
+    offsets = offsets[start:stop+1].numpy()
+    buffer = data[offsets[0]:offsets[-1]].numpy().tobytes()
+    offsets = offsets-offsets[0]
+    values = np.empty(stop-start, dtype=object)
+    values[:] = [
+        buffer[offsets[i]:offsets[i+1]].decode('utf-8') 
+        for i in range(stop-start)
+    ]
+    return values
+
+def _predict_shared_batch_mp(args)->int:
+    """
+    Predict precursors `start:stop` of the shared input tensors 
+    in a worker process, and write the results into the shared 
+    output tensors. Fragment intensities are written into 
+    rows `frag_start:frag_stop` of the shared intensity tensor.
+    """
+    inputs, outputs, start, stop, frag_start, frag_stop, predict_items = args
+    model_mgr:ModelManager = get_mp_worker_object()
+    precursor_df = pd.DataFrame(dict(
+        (col, _from_shared_tensor(data, offsets, start, stop))
+        for col, (data, offsets) in inputs.items()
+    ))
+    precursor_features = PrecursorFeatures(precursor_df)
+    if 'rt' in predict_items:
+        model_mgr.predict_rt(precursor_df,
+            batch_size=model_mgr_settings['predict']['batch_size_rt_ccs'],
+            precursor_features=precursor_features,
+        )
+    if 'mobility' in predict_items:
+        model_mgr.predict_mobility(precursor_df,
+            batch_size=model_mgr_settings['predict']['batch_size_rt_ccs'],
+            precursor_features=precursor_features,
+        )
+    for col, tensor in outputs.items():
+        if col in precursor_df.columns:
+            tensor.numpy()[start:stop] = precursor_df[col].values
+    if 'ms2' in predict_items:
+        model_mgr.set_default_nce_instrument(precursor_df)
+        model_mgr.ms2_model.predict(precursor_df,
+            batch_size=model_mgr_settings['predict']['batch_size_ms2'],
+            precursor_features=precursor_features,
+            frag_buffer=outputs['fragment_intensity'].numpy()[
+                frag_start:frag_stop
+            ],
+        )
+        model_mgr.ms2_model.predict_df = None
+    return stop-start
+
+def _get_flat_frag_idxes(
+    frag_starts:np.ndarray, frag_stops:np.ndarray
+)->np.ndarray:
+    """Fragment row indices of all `frag_starts[i]:frag_stops[i]`"""
+    frag_nums = frag_stops-frag_starts
+    return (
+        np.repeat(frag_starts-np.cumsum(frag_nums)+frag_nums, frag_nums)
+        +np.arange(frag_nums.sum(), dtype=np.int64)
+    )
+
+def _wrap_frag_inten_buffer(
+    precursor_df:pd.DataFrame, 
+    frag_inten_buffer:np.ndarray, 
+    frag_types:list,
+)->pd.DataFrame:
+    """Wrap `frag_inten_buffer` pointed by `precursor_df.frag_start_idx` 
+    into the same dataframe format as `pDeepModel.predict()`"""
+    frag_starts = precursor_df.frag_start_idx.values.astype(np.int64)
+    frag_stops = precursor_df.frag_stop_idx.values.astype(np.int64)
+    frag_nums = frag_stops-frag_starts
+    frag_idxes = _get_flat_frag_idxes(frag_starts, frag_stops)
+    pep_inds = np.full(len(frag_inten_buffer), np.nan)
+    pep_inds[frag_idxes] = np.repeat(precursor_df.index.values, frag_nums)
+    cleave_inds = np.full(len(frag_inten_buffer), np.nan)
+    cleave_inds[frag_idxes] = np.arange(
+        len(frag_idxes), dtype=np.int64
+    ) - np.repeat(np.cumsum(frag_nums)-frag_nums, frag_nums) + 1
+    fragment_intensity_df = pd.DataFrame(
+        frag_inten_buffer, columns=frag_types, copy=False
+    )
+    fragment_intensity_df.insert(0, 'pep_ind', pep_inds)
+    fragment_intensity_df.insert(1, 'cleave_ind', cleave_inds)
+    return fragment_intensity_df
+
+class PredictionCache(object):
+    """
+    Persistent on-disk cache of predictions in a sqlite3 database.
+    Values are bytes keyed by strings. The least recently used entries 
+    are evicted once the total size of values exceeds `max_size_mb`.
+    :class:`ModelManager` puts :meth:`ModelInterface.get_model_hash` 
+    into the keys, so fine-tuned or re-loaded models never hit 
+    predictions of other weights.
+    """
+    # sqlite limits the number of variables in a query
+    _query_batch_size = 900
+
+    def __init__(self, cache_file:str, max_size_mb:float=1024.0):
+        """
+        Parameters
+        ----------
+        cache_file : str
+            sqlite3 database file, created if not exists
+
+        max_size_mb : float, optional
+            Max total size of cached values in MB. Defaults to 1024.0
+        """
+        self.cache_file = os.path.expanduser(cache_file)
+        self.max_size = int(max_size_mb*1024**2)
+        self._conn = None
+        dir = os.path.dirname(self.cache_file)
+        if dir and not os.path.exists(dir): os.makedirs(dir)
+        self._connection
+
+    @property
+    def _connection(self)->sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.cache_file, timeout=60)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS predictions ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                'size INTEGER NOT NULL, last_used INTEGER NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS last_used_idx '
+                'ON predictions (last_used)'
+            )
+            self._conn.commit()
+        return self._conn
+
+    def __getstate__(self):
+        # sqlite connections cannot be pickled, reconnect in the new process
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        return state
+
+    def __len__(self):
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM predictions'
+        ).fetchone()[0]
+
+    @property
+    def size(self)->int:
+        """Total size of cached values in bytes"""
+        return self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM predictions'
+        ).fetchone()[0]
+
+    def get(self, keys:list)->dict:
+        """Get cached values of `keys` and mark them as recently used.
+
+        Parameters
+        ----------
+        keys : list
+            list of str
+
+        Returns
+        -------
+        dict
+            {key: value bytes} of found keys
+        """
+        conn = self._connection
+        now = time.time_ns()
+        ret = {}
+        for i in range(0, len(keys), self._query_batch_size):
+            batch_keys = list(keys[i:i+self._query_batch_size])
+            rows = conn.execute(
+                'SELECT key, value FROM predictions WHERE key IN '
+                f'({",".join("?"*len(batch_keys))})', batch_keys
+            ).fetchall()
+            if not rows: continue
+            ret.update(rows)
+            conn.execute(
+                'UPDATE predictions SET last_used=? WHERE key IN '
+                f'({",".join("?"*len(rows))})', [now]+[key for key,_ in rows]
+            )
+        conn.commit()
+        return ret
+
+    def put(self, keys:list, values:list):
+        """Put values (bytes) of `keys` into the cache, 
+        and evict the least recently used entries if the cache is full."""
+        conn = self._connection
+        now = time.time_ns()
+        conn.executemany(
+            'INSERT OR REPLACE INTO predictions VALUES (?,?,?,?)',
+            (
+                (key, val, len(val), now) 
+                for key, val in zip(keys, values)
+            )
+        )
+        if self.size > self.max_size:
+            conn.execute(
+                'DELETE FROM predictions WHERE key IN ('
+                'SELECT key FROM (SELECT key, SUM(size) OVER ('
+                'ORDER BY last_used DESC, key) AS total_size FROM predictions'
+                ') WHERE total_size > ?)', (self.max_size,)
+            )
+        conn.commit()
+
+    def clear(self):
+        """Remove all cached predictions"""
+        self._connection.execute('DELETE FROM predictions')
+        self._connection.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
 class ModelManager(object):
     """ 
     The manager class to access MS2/RT/CCS models.
@@ -271,7 +523,20 @@ class ModelManager(object):
         If self.ms2_model uses `peptdeep.model.ms2.pDeepModel.grid_nce_search()` to determine optimal
         NCE and instrument type. This will change `self.nce` and `self.instrument` values.
         Defaults to global_settings['model_mgr']['transfer']['grid_nce_search'].
+
+    deduplicate_inputs : bool
+        If predict RT only once for each peptide, and CCS/MS2 only once for 
+        each (peptide, charge[, nce, instrument]), then scatter the 
+        predictions back to all precursors.
+        Defaults to global_settings['model_mgr']['predict']['deduplicate_inputs'].
     """
+    # columns which the predictions of each model depend on
+    _rt_key_columns = ['sequence', 'mods', 'mod_sites']
+    _ccs_key_columns = ['sequence', 'mods', 'mod_sites', 'charge']
+    _ms2_key_columns = [
+        'sequence', 'mods', 'mod_sites', 'charge', 'nce', 'instrument'
+    ]
+
     def __init__(self, 
         mask_modloss:bool=True,
         device:str='gpu',
@@ -294,6 +559,8 @@ class ModelManager(object):
         self.ms2_model:pDeepModel = pDeepModel(mask_modloss=mask_modloss, device=device)
         self.rt_model:AlphaRTModel = AlphaRTModel(device=device)
         self.ccs_model:AlphaCCSModel = AlphaCCSModel(device=device)
+        self._mp_pool = PersistentPool()
+        self.prediction_cache:PredictionCache = None
 
         self.reset_by_global_settings(False, False)
 
@@ -377,7 +644,29 @@ class ModelManager(object):
         self.nce = mgr_settings['default_nce']
         self.instrument = mgr_settings['default_instrument']
         self.verbose = mgr_settings['predict']['verbose']
+        self.deduplicate_inputs = mgr_settings['predict']['deduplicate_inputs']
         self.train_verbose = mgr_settings['transfer']['verbose']
+        self.set_inference_precision(
+            mgr_settings['predict']['inference_precision']
+        )
+        self.set_max_tokens_per_batch(
+            ms2=mgr_settings['predict']['max_tokens_per_batch_ms2'],
+            rt_ccs=mgr_settings['predict']['max_tokens_per_batch_rt_ccs'],
+        )
+        self.set_train_options(
+            precision=mgr_settings['transfer']['train_precision'],
+            grad_accumulation_steps=mgr_settings['transfer'][
+                'grad_accumulation_steps'
+            ],
+            compile_train_step=mgr_settings['transfer'][
+                'compile_train_step'
+            ],
+        )
+        if mgr_settings['predict']['cache_file']:
+            self.set_prediction_cache(
+                mgr_settings['predict']['cache_file'],
+                mgr_settings['predict']['cache_size_mb'],
+            )
 
 
     @property
@@ -428,6 +717,119 @@ class ModelManager(object):
             os.makedirs(folder)
             self.save_models(folder)
 
+    def export_torchscript_models(self, 
+        folder:str, example_df:pd.DataFrame=None
+    ):
+        """Export MS2/RT/CCS models as traced TorchScript files 
+        ('ms2.jit.pt', 'rt.jit.pt' and 'ccs.jit.pt') into a folder.
+        Note that `mask_modloss` of the MS2 model is fixed after exporting.
+
+        Parameters
+        ----------
+        folder : str
+            folder to export
+
+        example_df : pd.DataFrame, optional
+            Example precursors to trace the models, 
+            see :meth:`peptdeep.model.model_interface.ModelInterface.export_torchscript`.
+            Defaults to None
+        """
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.ms2_model.export_torchscript(
+            os.path.join(folder, 'ms2.jit.pt'), example_df
+        )
+        self.rt_model.export_torchscript(
+            os.path.join(folder, 'rt.jit.pt'), example_df
+        )
+        self.ccs_model.export_torchscript(
+            os.path.join(folder, 'ccs.jit.pt'), example_df
+        )
+
+    def load_torchscript_models(self, folder:str):
+        """Load MS2/RT/CCS TorchScript models exported by 
+        :meth:`export_torchscript_models` from a folder, 
+        python models will not be built.
+
+        Parameters
+        ----------
+        folder : str
+            folder of TorchScript models
+        """
+        for model, file_name in [
+            (self.ms2_model, 'ms2.jit.pt'), 
+            (self.rt_model, 'rt.jit.pt'), 
+            (self.ccs_model, 'ccs.jit.pt'),
+        ]:
+            model_file = os.path.join(folder, file_name)
+            if os.path.isfile(model_file):
+                model.load_torchscript(model_file)
+            else:
+                logging.warning(f"{model_file} does not exist, skip loading it.")
+
+    def export_onnx_models(self, 
+        folder:str, example_df:pd.DataFrame=None
+    ):
+        """Export MS2/RT/CCS models as ONNX files 
+        ('ms2.onnx', 'rt.onnx' and 'ccs.onnx') into a folder.
+        Note that `mask_modloss` of the MS2 model is fixed after exporting.
+
+        Parameters
+        ----------
+        folder : str
+            folder to export
+
+        example_df : pd.DataFrame, optional
+            Example precursors to trace the models, 
+            see :meth:`peptdeep.model.model_interface.ModelInterface.export_onnx`.
+            Defaults to None
+        """
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.ms2_model.export_onnx(
+            os.path.join(folder, 'ms2.onnx'), example_df
+        )
+        self.rt_model.export_onnx(
+            os.path.join(folder, 'rt.onnx'), example_df
+        )
+        self.ccs_model.export_onnx(
+            os.path.join(folder, 'ccs.onnx'), example_df
+        )
+
+    def load_onnx_models(self, 
+        folder:str, thread_num:int=None
+    ):
+        """Predict with onnxruntime using the ONNX models exported by 
+        :meth:`export_onnx_models` from a folder. 
+        The python models are still used for training, 
+        call :meth:`unload_onnx_models` to predict with them again.
+
+        Parameters
+        ----------
+        folder : str
+            folder of ONNX models
+
+        thread_num : int, optional
+            intra-op thread number of onnxruntime. 
+            Defaults to None (onnxruntime default).
+        """
+        for model, file_name in [
+            (self.ms2_model, 'ms2.onnx'), 
+            (self.rt_model, 'rt.onnx'), 
+            (self.ccs_model, 'ccs.onnx'),
+        ]:
+            model_file = os.path.join(folder, file_name)
+            if os.path.isfile(model_file):
+                model.load_onnx(model_file, thread_num)
+            else:
+                logging.warning(f"{model_file} does not exist, skip loading it.")
+
+    def unload_onnx_models(self):
+        """Predict with the python MS2/RT/CCS models again"""
+        self.ms2_model.unload_onnx()
+        self.rt_model.unload_onnx()
+        self.ccs_model.unload_onnx()
+
     def load_installed_models(self, 
         model_type:str='generic'
     ):
@@ -764,10 +1166,374 @@ class ModelManager(object):
             )
             
 
+    def set_inference_precision(self, precision:str='fp32'):
+        """Set the inference precision of MS2/RT/CCS models, 
+        see :meth:`peptdeep.model.model_interface.ModelInterface.set_inference_precision`.
+
+        Parameters
+        ----------
+        precision : str, optional
+            'fp32', 'fp16', 'bf16' or 'int8-dynamic'. By default 'fp32'
+        """
+        self.ms2_model.set_inference_precision(precision)
+        self.rt_model.set_inference_precision(precision)
+        self.ccs_model.set_inference_precision(precision)
+
+    def set_max_tokens_per_batch(self, ms2:int=0, rt_ccs:int=0):
+        """Set the token budget to pack peptides of different lengths 
+        into padded and masked batches in prediction, see 
+        :attr:`peptdeep.model.model_interface.ModelInterface.max_tokens_per_batch`.
+        Models without attention masks (e.g. LSTM-based RT/CCS models) 
+        still predict in per-nAA batches.
+
+        Parameters
+        ----------
+        ms2 : int, optional
+            Token budget of the MS2 model, 0 to disable. By default 0
+
+        rt_ccs : int, optional
+            Token budget of RT/CCS models, 0 to disable. By default 0
+        """
+        if ms2 < 0 or rt_ccs < 0:
+            raise ValueError(
+                "max_tokens_per_batch must be >= 0, "
+                f"got ms2={ms2}, rt_ccs={rt_ccs}"
+            )
+        self.ms2_model.max_tokens_per_batch = ms2
+        self.rt_model.max_tokens_per_batch = rt_ccs
+        self.ccs_model.max_tokens_per_batch = rt_ccs
+
+    def set_train_options(self,
+        precision:str='fp32',
+        grad_accumulation_steps:int=1,
+        compile_train_step:bool=False,
+    ):
+        """Set the training options of MS2/RT/CCS models, 
+        see :meth:`peptdeep.model.model_interface.ModelInterface.set_train_options`.
+
+        Parameters
+        ----------
+        precision : str, optional
+            'fp32', 'fp16' or 'bf16'. By default 'fp32'
+
+        grad_accumulation_steps : int, optional
+            By default 1
+
+        compile_train_step : bool, optional
+            By default False
+        """
+        for model in (self.ms2_model, self.rt_model, self.ccs_model):
+            model.set_train_options(
+                precision=precision,
+                grad_accumulation_steps=grad_accumulation_steps,
+                compile_train_step=compile_train_step,
+            )
+
+    def evaluate_inference_precision(self, 
+        precursor_df:pd.DataFrame,
+        precision:str='int8-dynamic',
+        predict_items:list = ['rt','mobility','ms2'],
+    )->pd.DataFrame:
+        """Compare the predictions with `precision` against float32 predictions 
+        of the same models, using the R² of `rt_pred` and `ccs_pred`, 
+        and the median PCC of fragment intensities.
+
+        Parameters
+        ----------
+        precursor_df : pd.DataFrame
+            precursors to predict, it will not be changed.
+
+        precision : str, optional
+            precision to evaluate. By default 'int8-dynamic'
+
+        predict_items : list, optional
+            By default ['rt','mobility','ms2']
+
+        Returns
+        -------
+        pd.DataFrame
+            with 'metric' and 'value' columns
+        """
+        precision_bak = self.ms2_model.inference_precision
+        try:
+            self.set_inference_precision('fp32')
+            fp32_dict = self.predict_all(
+                precursor_df.copy(), predict_items=predict_items,
+                multiprocessing=False,
+            )
+            self.set_inference_precision(precision)
+            test_dict = self.predict_all(
+                precursor_df.copy(), predict_items=predict_items,
+                multiprocessing=False,
+            )
+        finally:
+            self.set_inference_precision(precision_bak)
+
+        metrics = []
+        for item, col in [('rt','rt_pred'),('mobility','ccs_pred')]:
+            if item not in predict_items: continue
+            r = np.corrcoef(
+                fp32_dict['precursor_df'][col].values,
+                test_dict['precursor_df'][col].values,
+            )[0,1]
+            metrics.append((f'{col} R_square', r**2))
+        if 'ms2' in predict_items:
+            psm_df, _ = calc_ms2_similarity(
+                test_dict['precursor_df'],
+                test_dict['fragment_intensity_df'],
+                fp32_dict['fragment_intensity_df'],
+                metrics=['PCC'], GPU=False,
+            )
+            metrics.append(('fragment PCC median', psm_df.PCC.median()))
+        return pd.DataFrame(metrics, columns=['metric','value'])
+
+    def set_prediction_cache(self, 
+        cache_file:str=None, max_size_mb:float=1024.0
+    ):
+        """Use an on-disk :class:`PredictionCache` in 
+        :meth:`predict_rt`, :meth:`predict_mobility` and :meth:`predict_ms2`.
+        RT is cached by (sequence, mods, mod_sites), CCS by 
+        (sequence, mods, mod_sites, charge), and MS2 by (sequence, mods, 
+        mod_sites, charge, nce, instrument), all keys also contain 
+        the model hash. Only cache misses are predicted by the models.
+
+        Parameters
+        ----------
+        cache_file : str, optional
+            sqlite3 cache file, None to disable the cache. Defaults to None
+
+        max_size_mb : float, optional
+            Max size of the cache in MB. Defaults to 1024.0
+        """
+        if self.prediction_cache is not None:
+            self.prediction_cache.close()
+        if cache_file:
+            self.prediction_cache = PredictionCache(cache_file, max_size_mb)
+        else:
+            self.prediction_cache = None
+
+    def _get_cache_keys(self, 
+        model:ModelInterface, precursor_df:pd.DataFrame, key_columns:list
+    )->np.ndarray:
+        keys = pd.Series(model.get_model_hash(), index=precursor_df.index)
+        for col in key_columns:
+            keys = keys + '|' + precursor_df[col].astype(str)
+        return keys.values
+
+    def _get_model_predict_func(self, 
+        model:ModelInterface, batch_size:int
+    ):
+        """`predict_func` of :meth:`_predict_values` and 
+        :meth:`_predict_ms2` which calls `model.predict()`"""
+        def predict_func(df, precursor_features=None, **kwargs):
+            return model.predict(df,
+                batch_size=batch_size, verbose=self.verbose,
+                precursor_features=precursor_features, **kwargs
+            )
+        return predict_func
+
+    def _predict_values_with_cache(self,
+        model:ModelInterface, precursor_df:pd.DataFrame, 
+        key_columns:list, predict_func,
+    )->pd.DataFrame:
+        """Predict `model.target_column_to_predict` inplace, 
+        only for precursors not in `self.prediction_cache`"""
+        precursor_df = append_nAA_column_if_missing(precursor_df)
+        col = model.target_column_to_predict
+        keys = self._get_cache_keys(model, precursor_df, key_columns)
+        cached = self.prediction_cache.get(keys)
+        hits = np.array([key in cached for key in keys], dtype=bool)
+        values = np.zeros(len(keys))
+        if hits.any():
+            values[hits] = np.frombuffer(
+                b''.join(cached[key] for key in keys[hits]), 
+                dtype=np.float64
+            )
+        if not hits.all():
+            miss_df = precursor_df.loc[~hits].copy()
+            miss_df = predict_func(miss_df)
+            miss_values = miss_df[col].values.astype(np.float64)
+            values[~hits] = miss_values
+            self.prediction_cache.put(
+                keys[~hits], [val.tobytes() for val in miss_values]
+            )
+        if self.verbose:
+            logging.info(f"{hits.sum()} of {len(hits)} predictions are cached")
+        precursor_df[col] = values
+        return precursor_df
+
+    def _predict_ms2_with_cache(self,
+        precursor_df:pd.DataFrame, 
+        reference_frag_df:pd.DataFrame,
+        predict_func,
+    )->pd.DataFrame:
+        """Predict fragment intensities only for precursors 
+        not in `self.prediction_cache`, the returned dataframe 
+        is the same as `self.ms2_model.predict()`."""
+        precursor_df = append_nAA_column_if_missing(precursor_df)
+        frag_types = self.ms2_model.charged_frag_types
+        frag_num = self.ms2_model._set_frag_idxes_to_predict(
+            precursor_df, reference_frag_df
+        )
+        frag_starts = precursor_df.frag_start_idx.values.astype(np.int64)
+        frag_stops = precursor_df.frag_stop_idx.values.astype(np.int64)
+        frag_inten_buffer = np.zeros(
+            (int(frag_num), len(frag_types)), dtype=np.float32
+        )
+
+        keys = self._get_cache_keys(
+            self.ms2_model, precursor_df, self._ms2_key_columns
+        ) + '|' + ','.join(frag_types)
+        cached = self.prediction_cache.get(keys)
+        hits = np.array([key in cached for key in keys], dtype=bool)
+        if hits.any():
+            frag_inten_buffer[
+                _get_flat_frag_idxes(frag_starts[hits], frag_stops[hits])
+            ] = np.frombuffer(
+                b''.join(cached[key] for key in keys[hits]), 
+                dtype=np.float32
+            ).reshape(-1, len(frag_types))
+        if not hits.all():
+            miss_df = precursor_df.loc[~hits].drop(
+                columns=['frag_start_idx', 'frag_stop_idx']
+            )
+            miss_inten_df = predict_func(miss_df)
+            miss_intens = miss_inten_df[frag_types].values
+            frag_inten_buffer[
+                _get_flat_frag_idxes(frag_starts[~hits], frag_stops[~hits])
+            ] = miss_intens[_get_flat_frag_idxes(
+                miss_df.frag_start_idx.values.astype(np.int64), 
+                miss_df.frag_stop_idx.values.astype(np.int64),
+            )]
+            self.prediction_cache.put(keys[~hits], [
+                miss_intens[start:stop].tobytes() for start, stop in zip(
+                    miss_df.frag_start_idx.values, 
+                    miss_df.frag_stop_idx.values,
+                )
+            ])
+        if self.verbose:
+            logging.info(f"{hits.sum()} of {len(hits)} predictions are cached")
+        return _wrap_frag_inten_buffer(
+            precursor_df, frag_inten_buffer, frag_types
+        )
+
+    def _get_unique_precursors(self,
+        precursor_df:pd.DataFrame, key_columns:list
+    )->Tuple[pd.DataFrame, np.ndarray]:
+        """Unique precursors of `key_columns` to predict.
+
+        Returns
+        -------
+        Tuple[pd.DataFrame, np.ndarray]
+            pd.DataFrame: unique precursors in the order of first 
+            occurrences, or None if there are no duplicates or 
+            `self.deduplicate_inputs` is False.
+
+            np.ndarray: the index map, `precursor_df` row i is 
+            predicted by row `inverse[i]` of the unique dataframe.
+        """
+        if not self.deduplicate_inputs or len(precursor_df) == 0:
+            return None, None
+        inverse = precursor_df.groupby(
+            key_columns, sort=False, dropna=False
+        ).ngroup().values
+        unique_num = inverse.max()+1
+        if unique_num == len(precursor_df):
+            return None, None
+        first_idxes = np.zeros(unique_num, dtype=np.int64)
+        first_idxes[inverse[::-1]] = np.arange(
+            len(inverse), dtype=np.int64
+        )[::-1]
+        unique_df = precursor_df.iloc[first_idxes].drop(
+            columns=['frag_start_idx', 'frag_stop_idx'], errors='ignore'
+        ).reset_index(drop=True)
+        if self.verbose:
+            logging.info(
+                f"Predicting {unique_num} unique of {len(precursor_df)} precursors"
+            )
+        return unique_df, inverse
+
+    def _predict_values(self,
+        model:ModelInterface, precursor_df:pd.DataFrame, 
+        key_columns:list, predict_func, 
+        precursor_features:PrecursorFeatures = None,
+    )->pd.DataFrame:
+        """Predict `model.target_column_to_predict` inplace 
+        once for each unique `key_columns` of `precursor_df`. 
+        Only the precursors not in `self.prediction_cache` are 
+        predicted by `predict_func(df, precursor_features=None)`, 
+        which sets the column in `df` and returns `df`."""
+        precursor_df = append_nAA_column_if_missing(precursor_df)
+        unique_df, inverse = self._get_unique_precursors(
+            precursor_df, key_columns
+        )
+        df = precursor_df if unique_df is None else unique_df
+        if self.prediction_cache is not None:
+            df = self._predict_values_with_cache(
+                model, df, key_columns, predict_func
+            )
+        else:
+            df = predict_func(df, 
+                precursor_features if unique_df is None else None
+            )
+        if unique_df is None:
+            return df
+        col = model.target_column_to_predict
+        precursor_df[col] = df[col].values[inverse]
+        return precursor_df
+
+    def _predict_ms2(self,
+        precursor_df:pd.DataFrame, 
+        predict_func,
+        reference_frag_df:pd.DataFrame = None,
+        precursor_features:PrecursorFeatures = None,
+    )->pd.DataFrame:
+        """See :meth:`predict_ms2`, deduplication and the cache 
+        work as :meth:`_predict_values`. `predict_func(df, 
+        precursor_features=None, reference_frag_df=None)` 
+        returns the same dataframe as `self.ms2_model.predict()`."""
+        precursor_df = append_nAA_column_if_missing(precursor_df)
+        unique_df, inverse = self._get_unique_precursors(
+            precursor_df, self._ms2_key_columns
+        )
+        if unique_df is None:
+            if self.prediction_cache is not None:
+                return self._predict_ms2_with_cache(
+                    precursor_df, reference_frag_df, predict_func
+                )
+            return predict_func(precursor_df, 
+                precursor_features, reference_frag_df=reference_frag_df,
+            )
+
+        if self.prediction_cache is not None:
+            unique_inten_df = self._predict_ms2_with_cache(
+                unique_df, None, predict_func
+            )
+        else:
+            unique_inten_df = predict_func(unique_df)
+        frag_types = self.ms2_model.charged_frag_types
+        frag_num = self.ms2_model._set_frag_idxes_to_predict(
+            precursor_df, reference_frag_df
+        )
+        frag_inten_buffer = np.zeros(
+            (int(frag_num), len(frag_types)), dtype=np.float32
+        )
+        frag_inten_buffer[_get_flat_frag_idxes(
+            precursor_df.frag_start_idx.values.astype(np.int64),
+            precursor_df.frag_stop_idx.values.astype(np.int64),
+        )] = unique_inten_df[frag_types].values[_get_flat_frag_idxes(
+            unique_df.frag_start_idx.values.astype(np.int64)[inverse],
+            unique_df.frag_stop_idx.values.astype(np.int64)[inverse],
+        )]
+        return _wrap_frag_inten_buffer(
+            precursor_df, frag_inten_buffer, frag_types
+        )
+
     def predict_ms2(self, precursor_df:pd.DataFrame, 
         *, 
         batch_size:int=512,
         reference_frag_df:pd.DataFrame = None,
+        precursor_features:PrecursorFeatures = None,
     )->pd.DataFrame:
         """Predict MS2 for the given precursor_df
 
@@ -784,6 +1550,10 @@ class ModelManager(object):
             If precursor_df has 'frag_start_idx' pointing to reference_frag_df. 
             Defaults to None
 
+        precursor_features : PrecursorFeatures, optional
+            Features shared with other models for the same precursor_df.
+            Defaults to None
+
         Returns
         -------
         pd.DataFrame
@@ -795,15 +1565,15 @@ class ModelManager(object):
         self.set_default_nce_instrument(precursor_df)
         if self.verbose:
             logging.info('Predicting MS2 ...')
-        return self.ms2_model.predict(precursor_df, 
-            batch_size=batch_size,
-            reference_frag_df=reference_frag_df,
-            verbose=self.verbose
+        return self._predict_ms2(precursor_df, 
+            self._get_model_predict_func(self.ms2_model, batch_size),
+            reference_frag_df, precursor_features,
         )
 
     def predict_rt(self, precursor_df:pd.DataFrame,
         *, 
-        batch_size:int=1024
+        batch_size:int=1024,
+        precursor_features:PrecursorFeatures = None,
     )->pd.DataFrame:
         """ Predict RT ('rt_pred') inplace into `precursor_df`.
 
@@ -816,6 +1586,10 @@ class ModelManager(object):
             Batch size for prediction. 
             Defaults to 1024.
 
+        precursor_features : PrecursorFeatures, optional
+            Features shared with other models for the same precursor_df.
+            Defaults to None
+
         Returns
         -------
         pd.DataFrame
@@ -823,15 +1597,18 @@ class ModelManager(object):
         """
         if self.verbose:
             logging.info("Predicting RT ...")
-        df = self.rt_model.predict(precursor_df, 
-            batch_size=batch_size, verbose=self.verbose
+        df = self._predict_values(
+            self.rt_model, precursor_df, self._rt_key_columns,
+            self._get_model_predict_func(self.rt_model, batch_size),
+            precursor_features,
         )
         df['rt_norm_pred'] = df.rt_pred
         return df
 
     def predict_mobility(self, precursor_df:pd.DataFrame,
         *, 
-        batch_size:int=1024
+        batch_size:int=1024,
+        precursor_features:PrecursorFeatures = None,
     )->pd.DataFrame:
         """ Predict mobility (`ccs_pred` and `mobility_pred`) inplace into `precursor_df`.
 
@@ -844,6 +1621,10 @@ class ModelManager(object):
             Batch size for prediction. 
             Defaults to 1024.
 
+        precursor_features : PrecursorFeatures, optional
+            Features shared with other models for the same precursor_df.
+            Defaults to None
+
         Returns
         -------
         pd.DataFrame
@@ -851,18 +1632,149 @@ class ModelManager(object):
         """
         if self.verbose:
             logging.info("Predicting mobility ...")
-        precursor_df = self.ccs_model.predict(precursor_df,
-            batch_size=batch_size, verbose=self.verbose
+        precursor_df = self._predict_values(
+            self.ccs_model, precursor_df, self._ccs_key_columns,
+            self._get_model_predict_func(self.ccs_model, batch_size),
+            precursor_features,
         )
         return self.ccs_model.ccs_to_mobility_pred(
             precursor_df
         )
 
-    def _predict_func_for_mp(self, arg_dict):
-        """Internal function, for multiprocessing"""
-        return self.predict_all(
-            multiprocessing=False, **arg_dict
-        )
+    def _get_frag_types_to_predict(self, frag_types:list=None)->list:
+        if frag_types is not None:
+            return frag_types
+        if self.ms2_model.model._mask_modloss:
+            return [
+                frag for frag in self.ms2_model.charged_frag_types
+                if 'modloss' not in frag
+            ]
+        else:
+            return self.ms2_model.charged_frag_types
+
+    def _get_mp_pool(self, process_num:int):
+        """
+        Get the persistent worker pool, which is started at the first call 
+        and restarted if `process_num`, any model object, or simple 
+        attributes of the manager and models (e.g. `nce`, `instrument`) 
+        have been changed. In-place parameter updates (e.g. training) 
+        do not need a restart as parameters are in shared memory.
+        """
+        for model in (self.ms2_model, self.rt_model, self.ccs_model):
+            model.model.share_memory()
+        # the cache and deduplication are handled in the main process
+        worker_mgr = copy.copy(self)
+        worker_mgr.verbose = False
+        worker_mgr.prediction_cache = None
+        worker_mgr.deduplicate_inputs = False
+        return self._mp_pool.get(worker_mgr, process_num, (
+            get_simple_attr_state(worker_mgr),
+            self.ms2_model._get_mp_pool_state(),
+            self.rt_model._get_mp_pool_state(),
+            self.ccs_model._get_mp_pool_state(),
+        ))
+
+    def shutdown_mp_pool(self):
+        """Stop the persistent worker pools used by `predict_all()` 
+        and by `predict_mp()` of the models"""
+        self._mp_pool.shutdown()
+        for model in (self.ms2_model, self.rt_model, self.ccs_model):
+            model.shutdown_mp_pool()
+
+    def _predict_in_mp_pool(self, 
+        precursor_df:pd.DataFrame, 
+        predict_item:str,
+        process_num:int, 
+        mp_batch_size:int,
+    )->pd.DataFrame:
+        """
+        Predict `predict_item` ('rt', 'mobility' or 'ms2') of `precursor_df` 
+        with the worker pool. Input columns and outputs are exchanged 
+        through shared-memory tensors: each task is a row range, 
+        and workers write predicted values and fragment intensities 
+        directly into the shared outputs at precomputed offsets.
+
+        Returns
+        -------
+        pd.DataFrame
+            `precursor_df` with predicted columns, or the fragment 
+            intensity dataframe for 'ms2' (as `self.ms2_model.predict()`)
+        """
+        if predict_item == 'ms2':
+            # workers predict in the continuous layout of each row range
+            precursor_df.drop(
+                columns=['frag_start_idx', 'frag_stop_idx'], 
+                errors='ignore', inplace=True
+            )
+            frag_num = self.ms2_model._set_frag_idxes_to_predict(precursor_df)
+            frag_start_idxes = precursor_df.frag_start_idx.values
+            frag_stop_idxes = precursor_df.frag_stop_idx.values
+
+        inputs = {}
+        for col in [
+            'sequence', 'mods', 'mod_sites', 'nAA', 'charge',
+            'precursor_mz', 'nce', 'instrument',
+        ]:
+            if col in precursor_df.columns:
+                inputs[col] = _to_shared_tensor(precursor_df[col].values)
+
+        outputs = {}
+        if predict_item == 'rt':
+            out_cols = ['rt_pred']
+        elif predict_item == 'mobility':
+            out_cols = ['ccs_pred', 'mobility_pred']
+        else:
+            out_cols = []
+            outputs['fragment_intensity'] = torch.zeros(
+                int(frag_num), len(self.ms2_model.charged_frag_types), 
+                dtype=torch.float32
+            ).share_memory_()
+        for col in out_cols:
+            outputs[col] = torch.zeros(
+                len(precursor_df), dtype=torch.float64
+            ).share_memory_()
+
+        def mp_param_generator():
+            for start in range(0, len(precursor_df), mp_batch_size):
+                stop = min(start+mp_batch_size, len(precursor_df))
+                if predict_item == 'ms2':
+                    frag_start = frag_start_idxes[start]
+                    frag_stop = frag_stop_idxes[stop-1]
+                else:
+                    frag_start = frag_stop = 0
+                yield (
+                    inputs, outputs, start, stop, 
+                    frag_start, frag_stop, [predict_item]
+                )
+
+        p = self._get_mp_pool(process_num)
+        for _ in process_bar(
+            p.imap_unordered(
+                _predict_shared_batch_mp, mp_param_generator()
+            ), 
+            (len(precursor_df)+mp_batch_size-1)//mp_batch_size
+        ):
+            pass
+
+        if predict_item == 'ms2':
+            return _wrap_frag_inten_buffer(
+                precursor_df, outputs['fragment_intensity'].numpy(),
+                self.ms2_model.charged_frag_types,
+            )
+        for col in out_cols:
+            precursor_df[col] = outputs[col].numpy()
+        return precursor_df
+
+    def _get_mp_predict_func(self, 
+        predict_item:str, process_num:int, mp_batch_size:int
+    ):
+        """`predict_func` of :meth:`_predict_values` and 
+        :meth:`_predict_ms2` which calls :meth:`_predict_in_mp_pool`"""
+        def predict_func(df, precursor_features=None, **kwargs):
+            return self._predict_in_mp_pool(
+                df, predict_item, process_num, mp_batch_size
+            )
+        return predict_func
 
     def predict_all_mp(self, precursor_df:pd.DataFrame,
         *,
@@ -870,81 +1782,71 @@ class ModelManager(object):
             'rt' ,'mobility' ,'ms2'
         ], 
         frag_types:list =  None,
-        process_num:int = 8,
+        process_num:int = None,
         mp_batch_size:int = 100000,
     ):
-        self.ms2_model.model.share_memory()
-        self.rt_model.model.share_memory()
-        self.ccs_model.model.share_memory()
-
-        df_groupby = precursor_df.groupby('nAA')
-
-        def get_batch_num_mp(df_groupby):
-            batch_num = 0
-            for group_len in df_groupby.size().values:
-                for i in range(0, group_len, mp_batch_size):
-                    batch_num += 1
-            return batch_num
-
-        def mp_param_generator(df_groupby):
-            for nAA, df in df_groupby:
-                for i in range(0, len(df), mp_batch_size):
-                    yield {
-                        'precursor_df': df.iloc[i:i+mp_batch_size,:],
-                        'predict_items': predict_items,
-                        'frag_types': frag_types,
-                    }
-
-        precursor_df_list = []
+        """
+        Predict with a pool of cpu worker processes, see :meth:`predict_all`.
+        Models are sent to each worker only once when the worker starts,
+        see :meth:`_predict_in_mp_pool` for how data are exchanged. 
+        Deduplication and `self.prediction_cache` are handled 
+        in the main process, only unique precursors which are not 
+        cached are sent to the workers.
+        The worker pool is kept alive for later calls, 
+        see :meth:`shutdown_mp_pool`.
+        """
+        if process_num is None:
+            process_num = global_settings['thread_num']
+        frag_types = self._get_frag_types_to_predict(frag_types)
+        if (
+            'mobility' in predict_items and
+            'precursor_mz' not in precursor_df.columns
+        ):
+            update_precursor_mz(precursor_df)
         if 'ms2' in predict_items:
-            fragment_mz_df_list = []
-            fragment_intensity_df_list = []
+            refine_precursor_df(precursor_df)
         else:
-            fragment_mz_df_list = None
+            refine_precursor_df(precursor_df, drop_frag_idx=False)
 
         if self.verbose:
             logging.info(
                 f'Predicting {",".join(predict_items)} ...'
             )
-        verbose_bak = self.verbose
-        self.verbose = False
-
-        with mp.get_context('spawn').Pool(process_num) as p:
-            for ret_dict in process_bar(
-                p.imap_unordered(
-                    self._predict_func_for_mp, 
-                    mp_param_generator(df_groupby)
-                ), 
-                get_batch_num_mp(df_groupby)
-            ):
-                precursor_df_list.append(ret_dict['precursor_df'])
-                if fragment_mz_df_list is not None:
-                    fragment_mz_df_list.append(
-                        ret_dict['fragment_mz_df']
-                    )
-                    fragment_intensity_df_list.append(
-                        ret_dict['fragment_intensity_df']
-                    )
-        self.verbose = verbose_bak
+        if 'rt' in predict_items:
+            self._predict_values(
+                self.rt_model, precursor_df, self._rt_key_columns,
+                self._get_mp_predict_func('rt', process_num, mp_batch_size),
+            )
+            precursor_df['rt_norm_pred'] = precursor_df.rt_pred
+        if 'mobility' in predict_items:
+            self._predict_values(
+                self.ccs_model, precursor_df, self._ccs_key_columns,
+                self._get_mp_predict_func(
+                    'mobility', process_num, mp_batch_size
+                ),
+            )
+            self.ccs_model.ccs_to_mobility_pred(precursor_df)
 
-        if fragment_mz_df_list is not None:
-            (
-                precursor_df, fragment_mz_df, fragment_intensity_df
-            ) = concat_precursor_fragment_dataframes(
-                precursor_df_list,
-                fragment_mz_df_list,
-                fragment_intensity_df_list,
+        if 'ms2' in predict_items:
+            fragment_mz_df = create_fragment_mz_dataframe(
+                precursor_df, frag_types
+            )
+            precursor_df.drop(
+                columns=['frag_start_idx'], inplace=True
+            )
+            self.set_default_nce_instrument(precursor_df)
+            fragment_intensity_df = self._predict_ms2(precursor_df,
+                self._get_mp_predict_func('ms2', process_num, mp_batch_size),
+            )[frag_types]
+            clear_error_modloss_intensities(
+                fragment_mz_df, fragment_intensity_df
             )
-            
             return {
                 'precursor_df': precursor_df, 
                 'fragment_mz_df': fragment_mz_df,
                 'fragment_intensity_df': fragment_intensity_df, 
             }
         else:
-            precursor_df = pd.concat(precursor_df_list)
-            precursor_df.reset_index(drop=True, inplace=True)
-            
             return {'precursor_df': precursor_df} 
 
     def predict_all(self, precursor_df:pd.DataFrame,
@@ -955,7 +1857,7 @@ class ModelManager(object):
         frag_types:list =  None,
         multiprocessing:bool = True,
         min_required_precursor_num_for_mp:int = 3000,
-        process_num:int = 8,
+        process_num:int = None,
         mp_batch_size:int = 100000,
     )->Dict[str, pd.DataFrame]:
         """ 
@@ -983,7 +1885,8 @@ class ModelManager(object):
             Defaults to True.
 
         process_num : int, optional
-            Defaults to 4
+            Defaults to None, which means 
+            global_settings['thread_num'] when it is called.
 
         min_required_precursor_num_for_mp : int, optional
             It will not use multiprocessing when the number of precursors in precursor_df 
@@ -1012,14 +1915,7 @@ class ModelManager(object):
             else:
                 refine_precursor_df(df, drop_frag_idx=False)
 
-        if frag_types is None:
-            if self.ms2_model.model._mask_modloss:
-                frag_types = [
-                    frag for frag in self.ms2_model.charged_frag_types
-                    if 'modloss' not in frag
-                ]
-            else:
-                frag_types = self.ms2_model.charged_frag_types
+        frag_types = self._get_frag_types_to_predict(frag_types)
 
         if 'precursor_mz' not in precursor_df.columns:
             update_precursor_mz(precursor_df)
@@ -1029,13 +1925,17 @@ class ModelManager(object):
             or len(precursor_df) < min_required_precursor_num_for_mp
         ):
             refine_df(precursor_df)
+            # featurize once for all models
+            precursor_features = PrecursorFeatures(precursor_df)
             if 'rt' in predict_items:
                 self.predict_rt(precursor_df, 
-                    batch_size=model_mgr_settings['predict']['batch_size_rt_ccs']
+                    batch_size=model_mgr_settings['predict']['batch_size_rt_ccs'],
+                    precursor_features=precursor_features,
                 )
             if 'mobility' in predict_items:
                 self.predict_mobility(precursor_df,
-                    batch_size=model_mgr_settings['predict']['batch_size_rt_ccs']
+                    batch_size=model_mgr_settings['predict']['batch_size_rt_ccs'],
+                    precursor_features=precursor_features,
                 )
             if 'ms2' in predict_items:
                 fragment_mz_df = create_fragment_mz_dataframe(
@@ -1048,7 +1948,8 @@ class ModelManager(object):
                 
                 fragment_intensity_df = self.predict_ms2(
                     precursor_df,
-                    batch_size=model_mgr_settings['predict']['batch_size_ms2']
+                    batch_size=model_mgr_settings['predict']['batch_size_ms2'],
+                    precursor_features=precursor_features,
                 )
 
                 fragment_intensity_df.drop(
@@ -1070,10 +1971,13 @@ class ModelManager(object):
             else:
                 return {'precursor_df': precursor_df}
         else:
+            if process_num is None:
+                process_num = global_settings['thread_num']
             logging.info(f"Using multiprocessing with {process_num} processes ...")
             return self.predict_all_mp(
                 precursor_df, 
                 predict_items=predict_items,
+                frag_types=frag_types,
                 process_num = process_num,
                 mp_batch_size=mp_batch_size,
             )
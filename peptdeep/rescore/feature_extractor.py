@@ -29,10 +29,23 @@ def match_one_raw(
     frag_types_to_match,
     ms2_ppm, ms2_tol,
     calibrate_frag_mass_error,
+    frag_mass_calibrator='knn',
+    use_peak_store=None,
+    peak_store_folder=None,
+    reader_process_num=None,
+    thread_num=None,
 ):
-    """ Internal function """
+    """ Internal function. 
+    Settings used in worker processes (e.g. `use_peak_store`) 
+    must be passed explicitly, as `spawn` workers only see 
+    the default `global_settings`.
+    """
     match = PepSpecMatch(
-        charged_frag_types=frag_types_to_match
+        charged_frag_types=frag_types_to_match,
+        thread_num=thread_num,
+        use_peak_store=use_peak_store,
+        peak_store_folder=peak_store_folder,
+        reader_process_num=reader_process_num,
     )
 
     (
@@ -47,15 +60,18 @@ def match_one_raw(
 
     if calibrate_frag_mass_error:
         from peptdeep.mass_spec.mass_calibration import (
-            MassCalibratorForRT_KNN
+            MassCalibratorForRT_KNN, MassCalibratorForRT_Bin
         )
-        frag_mass_calibrator = MassCalibratorForRT_KNN()
+        if frag_mass_calibrator == 'rt_bin':
+            calibrator = MassCalibratorForRT_Bin()
+        else:
+            calibrator = MassCalibratorForRT_KNN()
         _df_fdr = psm_df.query("fdr<0.01")
         
-        frag_mass_calibrator.fit(
+        calibrator.fit(
             _df_fdr, matched_mz_err_df
         )
-        matched_mz_err_df =  frag_mass_calibrator.calibrate(
+        matched_mz_err_df =  calibrator.calibrate(
             psm_df, matched_mz_err_df
         )
 
@@ -475,7 +491,9 @@ def get_ms2_features(
 
 # for imap/imap_unordered with multiprocessing.Pool()
 def match_one_raw_mp(args):
-    return match_one_raw(*args)
+    # raws are already distributed over processes,
+    # and pool workers cannot start reader processes
+    return match_one_raw(*args, reader_process_num=1, thread_num=1)
     
 # for imap/imap_unordered with multiprocessing.Pool()
 def get_ms2_features_mp(args):
@@ -560,6 +578,18 @@ class ScoreFeatureExtractor:
         self.calibrate_frag_mass_error = perc_settings[
             'calibrate_frag_mass_error'
         ]
+        self.frag_mass_calibrator = perc_settings[
+            'frag_mass_calibrator'
+        ]
+        self.use_peak_store = global_settings['peak_matching'][
+            'use_peak_store'
+        ]
+        self.peak_store_folder = global_settings['peak_matching'][
+            'peak_store_folder'
+        ]
+        self.reader_process_num = global_settings['peak_matching'][
+            'reader_process_num'
+        ]
 
     def _select_raw_to_tune(self,
         psm_df:pd.DataFrame,
@@ -657,6 +687,10 @@ class ScoreFeatureExtractor:
                 frag_types_to_match,
                 ms2_ppm, ms2_tol,
                 self.calibrate_frag_mass_error,
+                self.frag_mass_calibrator,
+                self.use_peak_store,
+                self.peak_store_folder,
+                reader_process_num=self.reader_process_num,
             )
             psm_df_list.append(df)
             matched_intensity_df_list.append(inten_df)
@@ -887,6 +921,10 @@ class ScoreFeatureExtractor:
                 frag_types,
                 ms2_ppm, ms2_tol,
                 self.calibrate_frag_mass_error,
+                self.frag_mass_calibrator,
+                self.use_peak_store,
+                self.peak_store_folder,
+                reader_process_num=self.reader_process_num,
             )
 
             self.extract_rt_features(df)
@@ -981,6 +1019,9 @@ class ScoreFeatureExtractorMP(ScoreFeatureExtractor):
                     frag_types_to_match,
                     ms2_ppm, ms2_tol,
                     self.calibrate_frag_mass_error,
+                    self.frag_mass_calibrator,
+                    self.use_peak_store,
+                    self.peak_store_folder,
                 )
         
         logging.info('Preparing for fine-tuning ...')  
@@ -1015,6 +1056,9 @@ class ScoreFeatureExtractorMP(ScoreFeatureExtractor):
         frag_types,
         ms2_ppm, ms2_tol,
         calibrate_frag_mass_error,
+        frag_mass_calibrator='knn',
+        use_peak_store=None,
+        peak_store_folder=None,
     ):
         (
             df, frag_mz_df, frag_inten_df, frag_merr_df
@@ -1022,6 +1066,10 @@ class ScoreFeatureExtractorMP(ScoreFeatureExtractor):
             ms2_file, ms2_file_type, frag_types,
             ms2_ppm, ms2_tol,
             calibrate_frag_mass_error,
+            frag_mass_calibrator,
+            use_peak_store,
+            peak_store_folder,
+            reader_process_num=1,
         )
 
         self.extract_rt_features(df)
@@ -1100,6 +1148,9 @@ class ScoreFeatureExtractorMP(ScoreFeatureExtractor):
                     used_frag_types,
                     ms2_ppm, ms2_tol,
                     self.calibrate_frag_mass_error,
+                    self.frag_mass_calibrator,
+                    self.use_peak_store,
+                    self.peak_store_folder,
                 )
 
         logging.info(
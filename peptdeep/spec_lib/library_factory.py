@@ -6,6 +6,7 @@ import numpy as np
 from typing import Union
 
 from alphabase.peptide.fragment import get_charged_frag_types
+from alphabase.io.hdf import HDF_File
 
 from peptdeep.settings import global_settings
 from peptdeep.protein.fasta import PredictSpecLibFasta
@@ -60,8 +61,49 @@ class PredictLibraryMakerBase(object):
         pass
 
     def _input(self, _input):
-        """Virtual method to be re-implemented by sub-classes"""
-        raise NotImplementedError("All sub-classes must re-implement '_input()' method")
+        """Load `_input` and expand it into precursors"""
+        self._load_input(_input)
+        self._expand_input()
+
+    def _load_input(self, _input):
+        """Virtual method to be re-implemented by sub-classes, 
+        load `_input` into `self.spec_lib._precursor_df`"""
+        raise NotImplementedError("All sub-classes must re-implement '_load_input()' method")
+
+    def _expand_input(self):
+        """Expand the loaded `self.spec_lib._precursor_df` into precursors,
+        e.g. adding decoys, modifications and charges"""
+        self._expand_sequences()
+        self._expand_precursors()
+
+    def _expand_sequences(self):
+        """Virtual method for expansions which need all loaded rows 
+        at once, e.g. adding decoys as decoys matching any target 
+        sequence are removed"""
+        pass
+
+    def _expand_precursors(self):
+        """Virtual method for row-wise expansions after 
+        `_expand_sequences()`, e.g. adding modifications and charges"""
+        pass
+
+    def _precursor_chunks(self, _input, chunk_size:int):
+        """Yields precursor dataframes of at most `chunk_size` precursors.
+        Decoys are generated over all loaded rows of `_input` by 
+        `_expand_sequences()`, then target and decoy rows are expanded 
+        into precursors `chunk_size` rows at a time."""
+        self._load_input(_input)
+        self._expand_sequences()
+        loaded_df = self.spec_lib._precursor_df
+        for i in range(0, len(loaded_df), chunk_size):
+            self.spec_lib._precursor_df = loaded_df.iloc[
+                i:i+chunk_size
+            ].reset_index(drop=True)
+            self._expand_precursors()
+            self._check_df()
+            precursor_df = self.spec_lib._precursor_df
+            for j in range(0, len(precursor_df), chunk_size):
+                yield precursor_df.iloc[j:j+chunk_size].reset_index(drop=True)
 
     def _predict(self):
         self.spec_lib.predict_all()
@@ -110,6 +152,94 @@ class PredictLibraryMakerBase(object):
             )
         except ValueError as e:
             raise e
+
+    def make_library_stream(self, 
+        _input, 
+        hdf_path:str, 
+        tsv_path:str=None,
+        chunk_size:int=100000,
+        translate_mod_dict:dict=None,
+    )->int:
+        """Predict a library for the `_input` chunk by chunk, 
+        each chunk is appended to the HDF (and TSV) file right 
+        after it is predicted, so the memory is bounded by 
+        `chunk_size` rather than the library size. 
+        Dataframes of `self.spec_lib` are empty after this function.
+
+        Parameters
+        ----------
+        _input
+            _input file or source
+
+        hdf_path : str
+            HDF library file to write, `frag_start_idx` and `frag_stop_idx`
+            of the precursors point to the whole fragment dataframes.
+
+        tsv_path : str, optional
+            If not None, also write the library in TSV format 
+            for DiaNN/Spectronaut. Defaults to None.
+
+        chunk_size : int, optional
+            Max number of precursors to predict at a time. 
+            Defaults to 100000.
+
+        translate_mod_dict : dict, optional
+            See :meth:`translate_to_tsv`. Defaults to None.
+
+        Returns
+        -------
+        int
+            Number of predicted precursors
+        """
+        logging.info(
+            f"Generating the spectral library in chunks of {chunk_size} precursors ..."
+        )
+        precursor_num = 0
+        frag_num = 0
+        for precursor_df in self._precursor_chunks(_input, chunk_size):
+            self.spec_lib._precursor_df = precursor_df
+            self._predict()
+            self._append_chunk_to_hdf(hdf_path, frag_num, precursor_num==0)
+            if tsv_path:
+                self._append_chunk_to_tsv(
+                    tsv_path, translate_mod_dict, precursor_num==0
+                )
+            precursor_num += len(self.precursor_df)
+            frag_num += len(self.fragment_mz_df)
+            logging.info(
+                f'Saved {precursor_num} precursors, '
+                f'used {psutil.Process(os.getpid()).memory_info().rss/1024**3:.4f} GB memory'
+            )
+            self.spec_lib._precursor_df = pd.DataFrame()
+            self.spec_lib._fragment_mz_df = pd.DataFrame()
+            self.spec_lib._fragment_intensity_df = pd.DataFrame()
+        if precursor_num == 0:
+            logging.warning("No precursors in the library, nothing is saved")
+        return precursor_num
+
+    def _append_chunk_to_hdf(self, 
+        hdf_path:str, frag_offset:int, create:bool
+    ):
+        if create:
+            self.spec_lib.save_hdf(hdf_path)
+            return
+        precursor_df = self.spec_lib.precursor_df.copy()
+        precursor_df['frag_start_idx'] += frag_offset
+        precursor_df['frag_stop_idx'] += frag_offset
+        _hdf = HDF_File(hdf_path, read_only=False)
+        _hdf.library.precursor_df.append(precursor_df)
+        _hdf.library.fragment_mz_df.append(self.spec_lib.fragment_mz_df)
+        _hdf.library.fragment_intensity_df.append(
+            self.spec_lib.fragment_intensity_df
+        )
+
+    def _append_chunk_to_tsv(self,
+        tsv_path:str, translate_mod_dict:dict, create:bool
+    ):
+        self.translate_library(translate_mod_dict).to_csv(
+            tsv_path, sep='\t', index=False, 
+            header=create, mode='w' if create else 'a',
+        )
     
     def translate_to_tsv(self, 
         tsv_path:str, 
@@ -175,8 +305,10 @@ class PredictLibraryMakerBase(object):
 
 class PrecursorLibraryMaker(PredictLibraryMakerBase):
     """For input dataframe of charged modified sequences"""
-    def _input(self, precursor_df:pd.DataFrame):
+    def _load_input(self, precursor_df:pd.DataFrame):
         self.spec_lib._precursor_df = precursor_df
+
+    def _expand_sequences(self):
         self.spec_lib.add_peptide_labeling()
         self.spec_lib.append_decoy_sequence()
     
@@ -205,17 +337,16 @@ class PrecursorLibraryMaker(PredictLibraryMakerBase):
 
 class PeptideLibraryMaker(PrecursorLibraryMaker):
     """For input dataframe of modified sequences"""
-    def _input(self, peptide_df:pd.DataFrame):
-        self.spec_lib._precursor_df = peptide_df
+    def _expand_sequences(self):
         self.spec_lib.append_decoy_sequence()
+
+    def _expand_precursors(self):
         self.spec_lib.add_peptide_labeling()
         self.spec_lib.add_charge()
 
 class SequenceLibraryMaker(PeptideLibraryMaker):
     """For input dataframe of AA sequences"""
-    def _input(self, sequence_df:pd.DataFrame):
-        self.spec_lib._precursor_df = sequence_df
-        self.spec_lib.append_decoy_sequence()
+    def _expand_precursors(self):
         self.spec_lib.add_modifications()
         self.spec_lib.add_special_modifications()
         self.spec_lib.add_peptide_labeling()
@@ -223,9 +354,13 @@ class SequenceLibraryMaker(PeptideLibraryMaker):
 
 class FastaLibraryMaker(PredictLibraryMakerBase):
     """For fasta or a list of fasta files"""
-    def _input(self, fasta:Union[str,list]):
+    def _load_input(self, fasta:Union[str,list]):
         self.spec_lib.get_peptides_from_fasta(fasta)
+
+    def _expand_sequences(self):
         self.spec_lib.append_decoy_sequence()
+
+    def _expand_precursors(self):
         self.spec_lib.add_modifications()
         self.spec_lib.add_special_modifications()
         self.spec_lib.add_peptide_labeling()
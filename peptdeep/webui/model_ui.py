@@ -21,6 +21,12 @@ def predict():
     global_ui_settings['model_mgr']['predict']['verbose'] = verbose
     multiprocessing = st.checkbox(label='Multiprocessing (if no GPUs)', value=global_ui_settings['model_mgr']['predict']['multiprocessing'])
     global_ui_settings['model_mgr']['predict']['multiprocessing'] = multiprocessing
+    precisions = global_ui_settings['model_mgr']['predict']['inference_precision_choices']
+    global_ui_settings['model_mgr']['predict']['inference_precision'] = st.selectbox(
+        label='Inference precision (int8-dynamic is only for CPU)',options=precisions,index = precisions.index(
+            global_ui_settings['model_mgr']['predict']['inference_precision']
+        )
+    )
 
 def model():
     model_url = st.text_input(label='URL (or local path) to download the pre-trained models',value = global_ui_settings['model_url'])